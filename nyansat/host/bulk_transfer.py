@@ -0,0 +1,273 @@
+"""
+Fast file upload over the raw REPL. A small receiver is started on the device with a single
+exec, after which files are streamed as binary frames instead of one hex encoded exec per
+chunk. Frames are pipelined up to a window and acknowledged by the receiver; a frame that
+fails its CRC32 check is negatively acknowledged and everything from it onward is resent.
+
+Frame layout, big endian:
+
+    type (1 byte) | sequence (2) | length (2) | payload (length) | CRC32 of everything before (4)
+
+Types are O (open, payload is the device path), D (data), C (close, payload is the CRC32 of
+the whole file) and Q (stop the receiver). The receiver answers with text lines: A<seq> when
+a frame was handled, N<seq> to ask for a resend starting at seq, E<message> on an error.
+"""
+import binascii
+import logging
+import struct
+import time
+from typing import Optional
+
+LOG = logging.getLogger('antenny_bulk_transfer')
+
+FRAME_HEADER = '!cHH'
+FRAME_HEADER_LENGTH = 5
+FRAME_CRC_LENGTH = 4
+SEQUENCE_MODULUS = 0x10000
+# Longest payload the receiver accepts, a corrupted length field beyond it is rejected right away
+MAX_PAYLOAD_LENGTH = 2048
+# The ESP32 buffers only 260 bytes of UART input, the frames in flight have to fit while the receiver
+# is busy writing to flash
+SERIAL_FRAME_SIZE = 96
+SERIAL_WINDOW = 2
+# WebREPL and telnet connections are buffered by the network stack
+NETWORK_FRAME_SIZE = 1024
+NETWORK_WINDOW = 8
+_RESPONSE_TIMEOUT = 5
+_READY_TIMEOUT = 5
+_MAX_FAILURES = 10
+
+# Runs on the device until it receives a Q frame, keyboard interrupts are disabled so 0x03
+# bytes in the data are not mistaken for ctrl-C
+RECEIVER_STUB = """
+import sys, micropython, ubinascii, ustruct, uselect
+def _antenny_receive():
+    i = sys.stdin.buffer
+    o = sys.stdout.buffer
+    p = uselect.poll()
+    p.register(sys.stdin, uselect.POLLIN)
+    f = None
+    file_crc = 0
+    expected = 0
+    micropython.kbd_intr(-1)
+    o.write(b'R\\n')
+    try:
+        while True:
+            header = i.read(5)
+            kind, seq, length = ustruct.unpack('!cHH', header)
+            if length > {max_length}:
+                kind = b'?'
+            else:
+                payload = i.read(length) if length else b''
+                crc = ustruct.unpack('!I', i.read(4))[0]
+            if kind not in b'ODCQ' or ubinascii.crc32(payload, ubinascii.crc32(header)) != crc:
+                # Drain whatever is left of the broken stream, then ask for a resend
+                while p.poll(50):
+                    i.read(1)
+                o.write(b'N%d\\n' % expected)
+                continue
+            if seq != expected:
+                continue
+            expected = (expected + 1) & 0xFFFF
+            if kind == b'O':
+                if f is not None:
+                    f.close()
+                f = open(payload.decode(), 'wb')
+                file_crc = 0
+            elif kind == b'D':
+                f.write(payload)
+                file_crc = ubinascii.crc32(payload, file_crc)
+            elif kind == b'C':
+                f.close()
+                f = None
+                if ustruct.unpack('!I', payload)[0] != file_crc:
+                    raise ValueError('file CRC mismatch')
+            o.write(b'A%d\\n' % seq)
+            if kind == b'Q':
+                return
+    except Exception as e:
+        o.write(b'E%s\\n' % str(e).encode())
+    finally:
+        if f is not None:
+            f.close()
+        micropython.kbd_intr(3)
+_antenny_receive()
+del _antenny_receive
+""".format(max_length=MAX_PAYLOAD_LENGTH)
+
+
+class BulkTransferException(Exception):
+    pass
+
+
+def encode_frame(kind: bytes, sequence: int, payload: bytes = b'') -> bytes:
+    header = struct.pack(FRAME_HEADER, kind, sequence, len(payload))
+    crc = binascii.crc32(payload, binascii.crc32(header)) & 0xFFFFFFFF
+    return header + payload + struct.pack('!I', crc)
+
+
+class BulkTransfer(object):
+    """
+    Uploads files through a receiver running on the device. Use as a context manager around
+    any number of put calls; the pyboard must be in the raw REPL, as an mpfshell file explorer
+    keeps it.
+    """
+
+    def __init__(
+            self,
+            pyboard,
+            frame_size: Optional[int] = None,
+            window: Optional[int] = None,
+    ):
+        """
+        :param pyboard: mpfshell Pyboard or file explorer
+        :param frame_size: payload bytes per frame, defaults depend on the connection type
+        :param window: frames sent ahead of the acknowledgements
+        """
+        self._pyboard = pyboard
+        self._con = pyboard.con
+        serial = type(self._con).__name__ == 'ConSerial'
+        self.frame_size = min(frame_size or (SERIAL_FRAME_SIZE if serial else NETWORK_FRAME_SIZE), MAX_PAYLOAD_LENGTH)
+        self.window = window or (SERIAL_WINDOW if serial else NETWORK_WINDOW)
+        self._sequence = 0
+        # Sequence number the receiver expects next, a stop frame has to carry it to be accepted
+        self._receiver_sequence = 0
+        self._buffer = b''
+        self._running = False
+        self.bytes_sent = 0
+        self.resends = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.stop()
+        else:
+            self.abort()
+
+    def start(self):
+        """
+        Starts the receiver on the device
+        """
+        self._sequence = 0
+        self._receiver_sequence = 0
+        self._pyboard.exec_raw_no_follow(RECEIVER_STUB)
+        line = self._read_line(_READY_TIMEOUT)
+        if line != 'R':
+            self.abort()
+            raise BulkTransferException("The receiver did not start: {}".format(line))
+        self._running = True
+
+    def stop(self):
+        """
+        Stops the receiver and returns the device to the raw REPL prompt
+        """
+        if not self._running:
+            return
+        self._running = False
+        try:
+            self._send_frames([(b'Q', b'')])
+        finally:
+            # Consume the end of the exec's output
+            self._pyboard.follow(_RESPONSE_TIMEOUT)
+
+    def abort(self):
+        """
+        Best effort cleanup after a failed transfer, so the caller can fall back to regular
+        puts. A receiver that reported an error has already exited, otherwise it is sent a stop
+        frame without waiting for its answer.
+        """
+        if self._running:
+            self._running = False
+            self._con.write(encode_frame(b'Q', self._receiver_sequence))
+        try:
+            self._pyboard.follow(_RESPONSE_TIMEOUT)
+        except Exception:
+            LOG.warning("The receiver did not exit cleanly")
+        self._buffer = b''
+
+    def put(self, local_path: str, device_path: str):
+        """
+        Uploads a file
+        :param local_path:
+        :param device_path: absolute path on the device, its directory has to exist
+        """
+        with open(local_path, 'rb') as f:
+            data = f.read()
+        self.put_bytes(data, device_path)
+
+    def put_bytes(self, data: bytes, device_path: str):
+        if not self._running:
+            raise BulkTransferException("The receiver is not running")
+        frames = [(b'O', device_path.encode('utf-8'))]
+        for offset in range(0, len(data), self.frame_size):
+            frames.append((b'D', data[offset:offset + self.frame_size]))
+        frames.append((b'C', struct.pack('!I', binascii.crc32(data) & 0xFFFFFFFF)))
+        start = time.time()
+        self._send_frames(frames)
+        elapsed = time.time() - start
+        LOG.info("Sent {} ({} bytes, {:.1f} kB/s)".format(
+                device_path, len(data), len(data) / 1000 / elapsed if elapsed else 0))
+
+    def _send_frames(self, frames):
+        """
+        Sends frames with up to window of them unacknowledged, going back to a frame the
+        receiver asks for again
+        """
+        first_sequence = self._sequence
+        base = 0
+        next_index = 0
+        # Consecutive failures, reset whenever the receiver makes progress
+        failures = 0
+        while base < len(frames):
+            while next_index < len(frames) and next_index - base < self.window:
+                kind, payload = frames[next_index]
+                encoded = encode_frame(kind, (first_sequence + next_index) % SEQUENCE_MODULUS, payload)
+                self._con.write(encoded)
+                self.bytes_sent += len(encoded)
+                next_index += 1
+            try:
+                line = self._read_line(_RESPONSE_TIMEOUT)
+            except BulkTransferException:
+                # A corrupted length field leaves the receiver waiting for bytes that never come,
+                # filler completes its read so it fails the CRC check and asks for a resend
+                failures += 1
+                if failures > _MAX_FAILURES:
+                    raise
+                LOG.warning("No response from the receiver, sending filler")
+                self._con.write(bytes(MAX_PAYLOAD_LENGTH + FRAME_HEADER_LENGTH + FRAME_CRC_LENGTH))
+                continue
+            if line.startswith('A'):
+                acked_index = (int(line[1:]) - first_sequence) % SEQUENCE_MODULUS
+                if base <= acked_index < len(frames):
+                    base = acked_index + 1
+                    self._receiver_sequence = (first_sequence + base) % SEQUENCE_MODULUS
+                    failures = 0
+            elif line.startswith('N'):
+                failures += 1
+                self.resends += 1
+                if failures > _MAX_FAILURES:
+                    raise BulkTransferException("Too many corrupted frames")
+                LOG.warning("Resending from frame {}".format(line[1:]))
+                next_index = base = (int(line[1:]) - first_sequence) % SEQUENCE_MODULUS
+            elif line.startswith('E'):
+                self._running = False
+                raise BulkTransferException("The receiver failed: {}".format(line[1:]))
+            else:
+                raise BulkTransferException("Unexpected response from the receiver: {}".format(line))
+        self._sequence = (first_sequence + len(frames)) % SEQUENCE_MODULUS
+
+    def _read_line(self, timeout: float) -> str:
+        deadline = time.time() + timeout
+        while b'\n' not in self._buffer:
+            if time.time() > deadline:
+                raise BulkTransferException("Timed out waiting for the receiver")
+            waiting = self._con.inWaiting()
+            if waiting:
+                self._buffer += self._con.read(waiting)
+            else:
+                time.sleep(0.001)
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return line.decode('utf-8', 'replace').strip()
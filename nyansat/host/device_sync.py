@@ -0,0 +1,305 @@
+"""
+Incremental deployment of the antenny sources. The device keeps a manifest of the content
+hash of every file the installer put on it, so a sync only has to read that one file,
+compare it with the host tree and transfer what changed.
+"""
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+from mp.mpfexp import RemoteIOError
+from mp.pyboard import PyboardError
+
+from nyansat.host.bulk_transfer import BulkTransfer, BulkTransferException
+
+LOG = logging.getLogger('antenny_device_sync')
+
+MANIFEST_PATH = '/.antenny_manifest.json'
+MANIFEST_VERSION = 1
+# Host side code that lives in the station tree but is never put on the device
+HOST_ONLY_DIRECTORIES = ('installer',)
+_HASH_CHUNK_SIZE = 4096
+
+# Hashes every file on the device in a single exec, used when there is no manifest yet
+_DEVICE_HASH_SCRIPT = """
+import uos, uhashlib, ubinascii, ujson
+def _antenny_hash(d, out):
+    for e in uos.ilistdir(d):
+        p = d.rstrip('/') + '/' + e[0]
+        if e[1] == 0x4000:
+            _antenny_hash(p, out)
+            continue
+        h = uhashlib.sha256()
+        with open(p, 'rb') as f:
+            while True:
+                b = f.read(512)
+                if not b:
+                    break
+                h.update(b)
+        out[p] = ubinascii.hexlify(h.digest()).decode()
+_antenny_hashes = {}
+_antenny_hash('/', _antenny_hashes)
+print(ujson.dumps(_antenny_hashes))
+del _antenny_hash, _antenny_hashes
+"""
+
+_DEVICE_MAKEDIRS_SCRIPT = """
+import uos
+for _antenny_dir in {directories!r}:
+    try:
+        uos.mkdir(_antenny_dir)
+    except OSError:
+        pass
+"""
+
+_DEVICE_DELETE_SCRIPT = """
+import uos
+for _antenny_path in {files!r}:
+    try:
+        uos.remove(_antenny_path)
+    except OSError:
+        pass
+for _antenny_path in {directories!r}:
+    try:
+        uos.rmdir(_antenny_path)
+    except OSError:
+        pass
+"""
+
+
+def hash_file(path: str) -> str:
+    """
+    Hashes a host file the same way the device hashes its files
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _walk_files(root: str, skip_reserved: bool):
+    """
+    Yields (relative path, host path) for every file below root, skipping dotfiles and,
+    if requested, python reserved names such as __init__.py and __pycache__
+    """
+    for directory, directory_names, file_names in os.walk(root):
+        directory_names[:] = sorted(
+                name for name in directory_names
+                if not name.startswith('.') and not (skip_reserved and name.startswith('__'))
+        )
+        for file_name in sorted(file_names):
+            if file_name.startswith('.') or (skip_reserved and file_name.startswith('__')):
+                continue
+            host_path = os.path.join(directory, file_name)
+            yield os.path.relpath(host_path, root).replace(os.sep, '/'), host_path
+
+
+def collect_station_files(
+        station_root: str,
+        ignore_configs: bool = False,
+        components: Optional[List[str]] = None,
+) -> Dict[str, str]:
+    """
+    Lists the station files an installation puts on the device
+    :param station_root: path of nyansat/station
+    :param ignore_configs: leave out the configs directory
+    :param components: only include these top level files and directories
+    :return: device path to host path
+    """
+    files = {}
+    for relative_path, host_path in _walk_files(station_root, skip_reserved=True):
+        top_level = relative_path.split('/')[0]
+        if top_level in HOST_ONLY_DIRECTORIES:
+            continue
+        if ignore_configs and top_level == 'configs':
+            continue
+        if components is not None and top_level not in components:
+            continue
+        files['/' + relative_path] = host_path
+    return files
+
+
+def collect_library_files(library_root: str, components: Optional[List[str]] = None) -> Dict[str, str]:
+    """
+    Lists the library files an installation puts on the device, the contents of each
+    library repository are placed at the root of the device
+    :param library_root: path of lib
+    :param components: only include these library directories
+    :return: device path to host path
+    """
+    files = {}
+    for repository in sorted(os.listdir(library_root)):
+        repository_root = os.path.join(library_root, repository)
+        if repository.startswith('.') or not os.path.isdir(repository_root):
+            continue
+        for relative_path, host_path in _walk_files(repository_root, skip_reserved=False):
+            if '/' in relative_path and components is not None and relative_path.split('/')[0] not in components:
+                continue
+            files['/' + relative_path] = host_path
+    return files
+
+
+class SyncPlan(object):
+    """
+    Differences between the host files and the files on the device
+    """
+
+    def __init__(
+            self,
+            upload: Dict[str, str],
+            delete: List[str],
+            unchanged: int,
+            manifest: Dict[str, str],
+    ):
+        """
+        :param upload: device path to host path of new and changed files
+        :param delete: device paths of files the installer put there that no longer exist on the host
+        :param unchanged: number of files already up to date
+        :param manifest: device path to hash after the sync
+        """
+        self.upload = upload
+        self.delete = delete
+        self.unchanged = unchanged
+        self.manifest = manifest
+
+    def __repr__(self):
+        return "<SyncPlan upload={} delete={} unchanged={}>".format(len(self.upload), len(self.delete), self.unchanged)
+
+
+def plan_sync(
+        host_files: Dict[str, str],
+        device_hashes: Dict[str, str],
+        managed_paths: Optional[Dict[str, str]] = None,
+        in_scope=None,
+) -> SyncPlan:
+    """
+    Compares the host files with the device
+    :param host_files: device path to host path
+    :param device_hashes: device path to hash of the files currently on the device
+    :param managed_paths: the previous manifest, only files listed there are ever deleted
+    :param in_scope: called with a device path, False for files outside of this sync, which are kept
+    :return:
+    """
+    upload = {}
+    unchanged = 0
+    manifest = {}
+    for device_path, host_path in sorted(host_files.items()):
+        file_hash = hash_file(host_path)
+        manifest[device_path] = file_hash
+        if device_hashes.get(device_path) == file_hash:
+            unchanged += 1
+        else:
+            upload[device_path] = host_path
+    delete = []
+    for device_path, file_hash in sorted((managed_paths or {}).items()):
+        if device_path in host_files:
+            continue
+        if in_scope is not None and not in_scope(device_path):
+            # Out of scope files stay managed so a later full sync can still clean them up
+            manifest[device_path] = file_hash
+            continue
+        delete.append(device_path)
+    return SyncPlan(upload, delete, unchanged, manifest)
+
+
+class DeviceSync(object):
+    """
+    Reads and writes the manifest and applies a SyncPlan through an mpfshell file explorer
+    """
+
+    def __init__(self, file_explorer, bulk: bool = True):
+        """
+        :param file_explorer:
+        :param bulk: stream uploads through a BulkTransfer receiver instead of one put per file
+        """
+        self._file_explorer = file_explorer
+        self.bulk = bulk
+
+    def read_manifest(self) -> Optional[Dict[str, str]]:
+        """
+        :return: device path to hash, None if the device has no usable manifest
+        """
+        try:
+            raw = self._file_explorer.gets(MANIFEST_PATH)
+        except (RemoteIOError, PyboardError):
+            return None
+        try:
+            manifest = json.loads(raw)
+        except ValueError:
+            LOG.warning("Ignoring a corrupt manifest on the device")
+            return None
+        if manifest.get('version') != MANIFEST_VERSION:
+            LOG.warning("Ignoring a manifest with version {}".format(manifest.get('version')))
+            return None
+        return manifest.get('files', {})
+
+    def hash_device_files(self) -> Dict[str, str]:
+        """
+        Hashes every file on the device in one batched exec
+        :return: device path to hash
+        """
+        output = self._file_explorer.exec_(_DEVICE_HASH_SCRIPT)
+        if isinstance(output, bytes):
+            output = output.decode('utf-8')
+        hashes = json.loads(output.strip().splitlines()[-1])
+        hashes.pop(MANIFEST_PATH, None)
+        return hashes
+
+    def write_manifest(self, manifest: Dict[str, str]):
+        self._file_explorer.puts(MANIFEST_PATH, json.dumps({'version': MANIFEST_VERSION, 'files': manifest}))
+
+    def _bulk_upload(self, uploads: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        """
+        Uploads files through a single receiver session
+        :param uploads: (device path, host path) pairs
+        :return: the pairs that still have to be put the regular way after a failure
+        """
+        done = 0
+        try:
+            with BulkTransfer(self._file_explorer) as bulk:
+                for device_path, host_path in uploads:
+                    LOG.info("Uploading {}".format(device_path))
+                    bulk.put(host_path, device_path)
+                    done += 1
+        except (BulkTransferException, PyboardError) as e:
+            LOG.warning("Bulk transfer failed, falling back to regular uploads: {}".format(e))
+        return uploads[done:]
+
+    def apply(self, plan: SyncPlan):
+        """
+        Uploads the changed files, then deletes obsolete files and their emptied directories in one exec
+        :param plan:
+        :return:
+        """
+        directories = set()
+        for device_path in plan.upload:
+            parent = os.path.dirname(device_path)
+            while parent not in ('', '/'):
+                directories.add(parent)
+                parent = os.path.dirname(parent)
+        if directories:
+            # Sorted by length so parents are created first
+            self._file_explorer.exec_(_DEVICE_MAKEDIRS_SCRIPT.format(directories=sorted(directories, key=len)))
+        remaining = sorted(plan.upload.items())
+        if self.bulk and remaining:
+            remaining = self._bulk_upload(remaining)
+        for device_path, host_path in remaining:
+            LOG.info("Uploading {}".format(device_path))
+            self._file_explorer.put(host_path, device_path)
+        if plan.delete:
+            LOG.info("Deleting {} obsolete file(s)".format(len(plan.delete)))
+            emptied = set()
+            for device_path in plan.delete:
+                parent = os.path.dirname(device_path)
+                while parent not in ('', '/'):
+                    emptied.add(parent)
+                    parent = os.path.dirname(parent)
+            # Deepest directories first, rmdir fails harmlessly on the ones that still hold files
+            self._file_explorer.exec_(_DEVICE_DELETE_SCRIPT.format(
+                    files=list(plan.delete),
+                    directories=sorted(emptied, key=len, reverse=True),
+            ))
+        self.write_manifest(plan.manifest)
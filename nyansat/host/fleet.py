@@ -0,0 +1,313 @@
+"""
+Provisions many antenny boards at once from a fleet manifest, without prompting. Each board
+is synced with the incremental installer, then given its Wi-Fi credentials, WebREPL password
+and an antenny config carrying its board ID. Boards are provisioned in parallel, each with its
+own log file, and a summary is printed and written next to the logs.
+
+Example manifest:
+
+    {
+        "wifi_profiles": {
+            "lab": {"ssid": "antenny-lab", "key_env": "LAB_WIFI_KEY"}
+        },
+        "defaults": {"config": "default", "wifi": "lab", "webrepl_password_env": "WEBREPL_PASS"},
+        "boards": [
+            {"port": "/dev/ttyUSB0", "board_id": 1},
+            {"port": "/dev/ttyUSB1", "board_id": 2, "overrides": {"latitude": 40.1}}
+        ]
+    }
+
+Secrets can be given inline ("key", "webrepl_password") or read from environment variables
+("key_env", "webrepl_password_env") so the manifest can be checked in.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from nyansat.host.exceptions import AntennyInstallationException
+from nyansat.host.mpy_build import MpyCompiler
+from nyansat.station.installer.__main__ import AntennyInstaller, STATION_CODE_RELATIVE_PATH
+
+LOG = logging.getLogger('antenny_fleet')
+
+DEFAULT_LOG_DIRECTORY = 'fleet_logs'
+SUMMARY_FILE = 'summary.json'
+DEVICE_WIFI_CONFIG_PATH = '/configs/wifi_config.json'
+DEVICE_WEBREPL_CONFIG_PATH = '/webrepl_cfg.py'
+DEVICE_DEFAULTS_PATH = '/configs/defaults.json'
+BOARD_CONFIG_NAME = 'board_{}'
+_LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+
+class BoardSpec(object):
+    """
+    One board of the fleet manifest, with the manifest defaults applied
+    """
+
+    def __init__(
+            self,
+            port: str,
+            board_id: int,
+            config: str = 'default',
+            wifi: Optional[Dict[str, str]] = None,
+            webrepl_password: Optional[str] = None,
+            overrides: Optional[dict] = None,
+            clean: bool = False,
+    ):
+        """
+        :param port: serial port of the board
+        :param board_id: multi-client board ID, stored in the board's antenny config
+        :param config: host antenny config the board's config is based on
+        :param wifi: dictionary with the ssid and key
+        :param webrepl_password:
+        :param overrides: antenny config values set on this board only
+        :param clean: erase the device before syncing
+        """
+        self.port = port
+        self.board_id = board_id
+        self.config = config
+        self.wifi = wifi
+        self.webrepl_password = webrepl_password
+        self.overrides = overrides or {}
+        self.clean = clean
+
+    def __repr__(self):
+        return "<BoardSpec port={} board_id={} config={}>".format(self.port, self.board_id, self.config)
+
+    @property
+    def name(self) -> str:
+        return "board-{}".format(self.board_id)
+
+
+class ProvisionResult(object):
+
+    def __init__(self, board: BoardSpec):
+        self.board = board
+        self.ok = False
+        self.error = None
+        self.duration = 0.
+        self.uploaded = 0
+        self.deleted = 0
+        self.unchanged = 0
+        self.log_path = None
+
+    def as_dict(self) -> dict:
+        return {
+            "port": self.board.port,
+            "board_id": self.board.board_id,
+            "ok": self.ok,
+            "error": self.error,
+            "duration": round(self.duration, 1),
+            "uploaded": self.uploaded,
+            "deleted": self.deleted,
+            "unchanged": self.unchanged,
+            "log": self.log_path,
+        }
+
+
+def _secret(entry: dict, key: str) -> Optional[str]:
+    """
+    Reads a secret given inline or through an environment variable named by key + "_env"
+    """
+    if key in entry:
+        return entry[key]
+    environment_variable = entry.get(key + '_env')
+    if environment_variable is None:
+        return None
+    value = os.environ.get(environment_variable)
+    if value is None:
+        raise AntennyInstallationException("Environment variable {} is not set".format(environment_variable))
+    return value
+
+
+def load_fleet_manifest(path: str) -> List[BoardSpec]:
+    """
+    Parses a fleet manifest
+    :param path:
+    :return:
+    """
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    profiles = manifest.get('wifi_profiles', {})
+    defaults = manifest.get('defaults', {})
+    boards = []
+    ports = set()
+    board_ids = set()
+    for entry in manifest.get('boards', []):
+        settings = dict(defaults)
+        settings.update(entry)
+        if 'port' not in settings or 'board_id' not in settings:
+            raise AntennyInstallationException("Every board needs a port and a board_id: {}".format(entry))
+        if settings['port'] in ports:
+            raise AntennyInstallationException("Port {} is listed twice".format(settings['port']))
+        if settings['board_id'] in board_ids:
+            raise AntennyInstallationException("Board ID {} is listed twice".format(settings['board_id']))
+        ports.add(settings['port'])
+        board_ids.add(settings['board_id'])
+        wifi = None
+        if settings.get('wifi') is not None:
+            if settings['wifi'] not in profiles:
+                raise AntennyInstallationException("Unknown Wi-Fi profile {}".format(settings['wifi']))
+            profile = profiles[settings['wifi']]
+            wifi = {"ssid": profile['ssid'], "key": _secret(profile, 'key') or ''}
+        overrides = dict(defaults.get('overrides', {}))
+        overrides.update(entry.get('overrides', {}))
+        boards.append(BoardSpec(
+                settings['port'],
+                int(settings['board_id']),
+                config=settings.get('config', 'default'),
+                wifi=wifi,
+                webrepl_password=_secret(settings, 'webrepl_password'),
+                overrides=overrides,
+                clean=settings.get('clean', False),
+        ))
+    return boards
+
+
+class _ThreadFilter(logging.Filter):
+    """
+    Passes only the records logged from one thread, which separates the per board logs of
+    the installer's module level loggers
+    """
+
+    def __init__(self, thread_name: str):
+        super(_ThreadFilter, self).__init__()
+        self.thread_name = thread_name
+
+    def filter(self, record):
+        return record.threadName == self.thread_name
+
+
+class FleetProvisioner(object):
+
+    def __init__(
+            self,
+            boards: List[BoardSpec],
+            log_directory: str = DEFAULT_LOG_DIRECTORY,
+            jobs: Optional[int] = None,
+            compiler: Optional[MpyCompiler] = None,
+    ):
+        """
+        :param boards:
+        :param log_directory: where the per board logs and the summary are written
+        :param jobs: boards provisioned at once, all of them by default
+        :param compiler: upload modules as .mpy built by this compiler
+        """
+        self.boards = boards
+        self.log_directory = log_directory
+        self.jobs = jobs or max(len(boards), 1)
+        self.compiler = compiler
+
+    def _board_config(self, board: BoardSpec) -> dict:
+        path = os.path.join(STATION_CODE_RELATIVE_PATH, 'configs', 'antenny', board.config + '.json')
+        with open(path, 'r') as f:
+            config = json.load(f)
+        config.update(board.overrides)
+        config['board_id'] = board.board_id
+        return config
+
+    def _provision(self, board: BoardSpec, result: ProvisionResult):
+        installer = AntennyInstaller(board.port)
+        installer.connect()
+        if board.clean:
+            installer._clean_files()
+        plan = installer.sync(compiler=self.compiler)
+        result.uploaded = len(plan.upload)
+        result.deleted = len(plan.delete)
+        result.unchanged = plan.unchanged
+        file_explorer = installer._file_explorer
+        if board.wifi is not None:
+            LOG.info("Writing Wi-Fi credentials for {}".format(board.wifi['ssid']))
+            file_explorer.puts(DEVICE_WIFI_CONFIG_PATH, json.dumps(board.wifi))
+        if board.webrepl_password is not None:
+            LOG.info("Writing the WebREPL password")
+            file_explorer.puts(DEVICE_WEBREPL_CONFIG_PATH, "PASS = '{}'\n".format(board.webrepl_password))
+        config_name = BOARD_CONFIG_NAME.format(board.board_id)
+        LOG.info("Writing antenny config {} based on {}".format(config_name, board.config))
+        file_explorer.puts(
+                '/configs/antenny/{}.json'.format(config_name),
+                json.dumps(self._board_config(board)),
+        )
+        # The sync manifest keeps the stock hash of defaults.json, so later syncs leave the selection alone
+        # unless the stock file itself changes
+        defaults = json.loads(file_explorer.gets(DEVICE_DEFAULTS_PATH))
+        defaults['antenny'] = config_name
+        file_explorer.puts(DEVICE_DEFAULTS_PATH, json.dumps(defaults))
+
+    def _run_board(self, board: BoardSpec) -> ProvisionResult:
+        threading.current_thread().name = board.name
+        result = ProvisionResult(board)
+        result.log_path = os.path.join(self.log_directory, board.name + '.log')
+        handler = logging.FileHandler(result.log_path, mode='w')
+        handler.setFormatter(logging.Formatter(_LOG_FORMAT))
+        handler.addFilter(_ThreadFilter(board.name))
+        logging.getLogger().addHandler(handler)
+        start = time.time()
+        try:
+            LOG.info("Provisioning {} on {}".format(board.name, board.port))
+            self._provision(board, result)
+            result.ok = True
+            LOG.info("Provisioned {}".format(board.name))
+        except Exception as e:
+            result.error = "{}: {}".format(type(e).__name__, e)
+            LOG.error("Failed to provision {}".format(board.name), exc_info=True)
+        finally:
+            result.duration = time.time() - start
+            logging.getLogger().removeHandler(handler)
+            handler.close()
+        return result
+
+    def run(self) -> List[ProvisionResult]:
+        os.makedirs(self.log_directory, exist_ok=True)
+        if self.compiler is not None:
+            # Build once up front so the boards do not race to fill the cache
+            self.compiler.compiler_id()
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            results = list(executor.map(self._run_board, self.boards))
+        with open(os.path.join(self.log_directory, SUMMARY_FILE), 'w') as f:
+            json.dump([result.as_dict() for result in results], f, indent=2)
+        return results
+
+
+def format_summary(results: List[ProvisionResult]) -> str:
+    lines = ["{:<16} {:>8} {:>6} {:>8} {:>8} {:>7}  {}".format(
+            "port", "board_id", "status", "time", "uploaded", "deleted", "error")]
+    for result in results:
+        lines.append("{:<16} {:>8} {:>6} {:>7.1f}s {:>8} {:>7}  {}".format(
+                result.board.port,
+                result.board.board_id,
+                "ok" if result.ok else "FAILED",
+                result.duration,
+                result.uploaded,
+                result.deleted,
+                result.error or "",
+        ))
+    failed = len([result for result in results if not result.ok])
+    lines.append("{} of {} board(s) provisioned".format(len(results) - failed, len(results)))
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(threadName)s %(levelname)s: %(message)s')
+    parser = argparse.ArgumentParser(description="Provision a fleet of antenny boards from a manifest")
+    parser.add_argument('manifest', help="Path to the fleet manifest")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="Boards provisioned at once, default all")
+    parser.add_argument('--log-dir', default=DEFAULT_LOG_DIRECTORY, help="Where per board logs are written")
+    parser.add_argument('--mpy', action='store_true', help="Upload modules cross-compiled to .mpy bytecode")
+    parser.add_argument('--mpy-cross', default=None, help="mpy-cross compatible compiler to use")
+    args = parser.parse_args()
+    provisioner = FleetProvisioner(
+            load_fleet_manifest(args.manifest),
+            log_directory=args.log_dir,
+            jobs=args.jobs,
+            compiler=MpyCompiler(args.mpy_cross) if args.mpy else None,
+    )
+    results = provisioner.run()
+    print(format_summary(results))
+    sys.exit(0 if all(result.ok for result in results) else 1)
@@ -0,0 +1,127 @@
+"""
+Cross-compiles the antenny sources to .mpy bytecode before they are put on the device, so
+the board does not have to compile every module at import time. Compiled files are cached
+by the hash of their source and of the compiler, so only changed modules are rebuilt.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import threading
+from typing import Dict, List, Optional
+
+from nyansat.host.device_sync import hash_file
+from nyansat.host.exceptions import AntennyInstallationException
+
+LOG = logging.getLogger('antenny_mpy_build')
+
+MPY_CROSS_ENVIRONMENT_VARIABLE = 'MPY_CROSS'
+DEFAULT_MPY_CROSS = 'mpy-cross'
+DEFAULT_CACHE_DIRECTORY = os.path.join(os.getcwd(), '.mpy_cache')
+# MicroPython only runs these from source
+SOURCE_ONLY_FILES = ('/boot.py', '/main.py')
+
+
+class MpyCompiler(object):
+    """
+    Wraps an mpy-cross executable. Any compiler that accepts mpy-cross's -o and -s options
+    can be swapped in, by path or through the MPY_CROSS environment variable.
+    """
+
+    def __init__(
+            self,
+            mpy_cross: Optional[str] = None,
+            extra_args: Optional[List[str]] = None,
+            cache_directory: str = DEFAULT_CACHE_DIRECTORY,
+    ):
+        """
+        :param mpy_cross: compiler executable, defaults to $MPY_CROSS or mpy-cross on the PATH
+        :param extra_args: passed to every compile, such as -march=xtensawin
+        :param cache_directory: where compiled files are kept between runs
+        """
+        self.mpy_cross = mpy_cross or os.environ.get(MPY_CROSS_ENVIRONMENT_VARIABLE, DEFAULT_MPY_CROSS)
+        self.extra_args = list(extra_args or [])
+        self.cache_directory = cache_directory
+        self._compiler_id = None
+        self.compiled = 0
+        self.cached = 0
+
+    def compiler_id(self) -> str:
+        """
+        Identifies the compiler and its options, part of every cache key so switching
+        compilers or bytecode versions never reuses stale artifacts
+        """
+        if self._compiler_id is None:
+            executable = shutil.which(self.mpy_cross)
+            if executable is None:
+                raise AntennyInstallationException("Could not find the mpy-cross compiler '{}'".format(self.mpy_cross))
+            try:
+                version = subprocess.run(
+                        [executable, '--version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=False,
+                ).stdout
+            except OSError as e:
+                raise AntennyInstallationException("Could not run the mpy-cross compiler: {}".format(e))
+            digest = hashlib.sha256(version)
+            digest.update(hash_file(executable).encode())
+            digest.update(' '.join(self.extra_args).encode())
+            self._compiler_id = digest.hexdigest()
+        return self._compiler_id
+
+    def compile(self, host_path: str, device_path: str) -> str:
+        """
+        Compiles a source file, or finds it in the cache
+        :param host_path: source file
+        :param device_path: path of the source on the device, recorded in tracebacks
+        :return: host path of the .mpy file
+        """
+        key = hashlib.sha256((self.compiler_id() + hash_file(host_path) + device_path).encode()).hexdigest()
+        artifact = os.path.join(self.cache_directory, key + '.mpy')
+        if os.path.exists(artifact):
+            self.cached += 1
+            return artifact
+        os.makedirs(self.cache_directory, exist_ok=True)
+        # Written under a temporary name so an interrupted build never leaves a truncated artifact in the cache,
+        # unique per thread since fleet provisioning compiles for many boards at once
+        partial = '{}.{}.{}.partial'.format(artifact, os.getpid(), threading.get_ident())
+        command = [self.mpy_cross] + self.extra_args + ['-s', device_path, '-o', partial, host_path]
+        LOG.info("Compiling {}".format(device_path))
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=False)
+        if result.returncode != 0:
+            if os.path.exists(partial):
+                os.remove(partial)
+            LOG.error(result.stdout.decode('utf-8', 'replace'))
+            raise AntennyInstallationException("Failed to compile {}".format(host_path))
+        os.replace(partial, artifact)
+        self.compiled += 1
+        return artifact
+
+
+def compile_files(host_files: Dict[str, str], compiler: MpyCompiler) -> Dict[str, str]:
+    """
+    Replaces every compilable python source in an install plan with its compiled .mpy
+    :param host_files: device path to host path
+    :param compiler:
+    :return: device path to host path, with .mpy device paths for compiled modules
+    """
+    compiled_files = {}
+    for device_path, host_path in host_files.items():
+        if not device_path.endswith('.py') or device_path in SOURCE_ONLY_FILES:
+            compiled_files[device_path] = host_path
+            continue
+        compiled_files[device_path[:-3] + '.mpy'] = compiler.compile(host_path, device_path)
+    LOG.info("Compiled {} module(s), {} from the cache".format(compiler.compiled, compiler.cached))
+    return compiled_files
+
+
+def shadowed_sources(host_files: Dict[str, str], device_hashes: Dict[str, str]) -> Dict[str, str]:
+    """
+    Finds sources on the device that would be imported instead of their compiled module
+    :param host_files: device path to host path, after compile_files
+    :param device_hashes: device path to hash of the files on the device
+    :return: device path to hash of the sources that have to be deleted
+    """
+    return {
+        device_path: file_hash for device_path, file_hash in device_hashes.items()
+        if device_path.endswith('.py') and device_path[:-3] + '.mpy' in host_files
+    }
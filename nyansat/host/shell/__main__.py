@@ -1,6 +1,7 @@
 import argparse
 import io
 import logging
+import os
 import platform
 import sys
 from websocket import WebSocketConnectionClosedException
@@ -11,6 +12,7 @@ from mp import mpfshell
 from nyansat.host.shell.cli_arg_parser import CLIArgumentProperty, parse_cli_args
 from nyansat.host.shell.terminal_printer import TerminalPrinter
 from nyansat.host.shell.antenny_client import AntennyClient
+from nyansat.host.bulk_transfer import BulkTransfer, BulkTransferException
 
 from nyansat.host.shell.errors import cli_handler
 
@@ -336,6 +338,39 @@ class NyanShell(mpfshell.MpFileShell):
         """
         self.client.cancel()
 
+    @cli_handler
+    def do_bput(self, args):
+        """bput <LOCAL_FILE> <REMOTE_FILE>
+        Upload a file through a streaming receiver, much faster than put for large files.
+        Falls back to a regular put if the transfer fails.
+        """
+        arg_properties = [
+            CLIArgumentProperty(
+                str,
+                None
+            ),
+            CLIArgumentProperty(
+                str,
+                None
+            )
+        ]
+        parsed_args = parse_cli_args(args, 'bput', 2, arg_properties)
+        local_path, remote_path = parsed_args
+        if self.fe is None:
+            TerminalPrinter.print_error("Not connected to a device")
+            return
+        if not os.path.isfile(local_path):
+            TerminalPrinter.print_error("No such file: {}".format(local_path))
+            return
+        if not remote_path.startswith('/'):
+            remote_path = self.fe.pwd().rstrip('/') + '/' + remote_path
+        try:
+            with BulkTransfer(self.fe) as bulk:
+                bulk.put(local_path, remote_path)
+        except BulkTransferException as e:
+            TerminalPrinter.print_warning("Bulk transfer failed ({}), using a regular put".format(e))
+            self.fe.put(local_path, remote_path)
+
     def do_wifi(self, args):
         """wifi
         Run the WiFi setup script.
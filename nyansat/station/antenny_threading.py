@@ -91,22 +91,27 @@ class MPQueue(object):
             while True:
                 try:
                     with self._lock:
-                        return self._queue.pop()
+                        return self._queue.pop(0)
                 except IndexError:
                     pass
         delay = 0
-        item = None
-        while delay < timeout:
+        while True:
             try:
                 with self._lock:
-                    item = self._queue.pop()
+                    return self._queue.pop(0)
             except IndexError:
                 pass
+            if delay >= timeout:
+                raise Empty
             time.sleep(_DEFAULT_DELAY)
             delay += _DEFAULT_DELAY
-        if item is None:
+
+    def get_nowait(self):
+        try:
+            with self._lock:
+                return self._queue.pop(0)
+        except IndexError:
             raise Empty
-        return item
 
     def put(self, item):
         with self._lock:
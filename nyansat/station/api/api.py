@@ -1,36 +1,31 @@
 import time
 import machine
 
-from config.config import Config
+from clock.clock import CLOCK
+from config.config import Config, shared_config
 
+from api.bringup import BringUp, Stage, print_status
+from api.components import component_class, is_component, loaded_components
 from controller.controller import PlatformController
-from controller.mock_controller import MockPlatformController
-from controller.pid_controller import PIDPlatformController
-from controller.gps_location_controller import GPSLocationController
-from controller.screen_ss1306_controller import Ssd1306ScreenController
+from memory.gc_policy import GcPolicy, DEFAULT_PERIOD_MS
+from profiler import profiler
+from scheduler.scheduler import shared_scheduler
 
 from exceptions import AntennyIMUException, AntennyMotorException, AntennyTelemetryException, AntennyScreenException
 from gps.gps import GPSController
-from gps.gps_basic import BasicGPSController
-from gps.mock_gps_controller import MockGPSController
 from imu.imu import ImuController
-from imu.imu_bno055 import Bno055ImuController
-from imu.imu_bno08x_i2c import Bno08xImuController
-from imu.imu_bno08x_rvc import Bno08xUARTImuController
-from imu.mock_imu import MockImuController
-from motor.mock_motor import MockPWMController
 from motor.motor import PWMController, ServoController
-from motor.motor_pca9685 import Pca9685ServoController, Pca9685Controller
-from screen.mock_screen import MockScreenController
 from screen.screen import ScreenController
 from antenny_threading import Queue
 from sender.sender import TelemetrySender
-from sender.sender_udp import UDPTelemetrySender
-from sender.mock_sender import MockTelemetrySender
 
 
 _DEFAULT_MOTOR_POSITION = 90.
 _DEFAULT_MOTION_DELAY = 0.75
+# The BNO08x needs a reset and a calibration reset before it answers
+_IMU_INIT_TIMEOUT_MS = 15000
+# The default thread stack of about 5 kB is too small for the driver constructors
+_INIT_STACK_SIZE = 12 * 1024
 
 
 class AntennyAPI:
@@ -39,19 +34,23 @@ class AntennyAPI:
     """
 
     def __init__(self):
-        self.antenny_config: Config = Config("antenny")
-        self.imu_config: Config = Config("imu")
-        self.servo_config: Config = Config("servo")
-        self.pid_config: Config = Config("pid")
+        self.antenny_config: Config = shared_config("antenny")
+        self.imu_config: Config = shared_config("imu")
+        self.servo_config: Config = shared_config("servo")
+        self.pid_config: Config = shared_config("pid")
         self.safe_mode: bool = True
         self.imu: ImuController = ImuController()
         self.pwm_controller: PWMController = PWMController()
         self.screen: ScreenController = ScreenController()
+        self.screen_dashboard = None
         self.telemetry: TelemetrySender = TelemetrySender()
         self.gps: GPSController = GPSController()
         self.elevation_servo: ServoController = ServoController()
         self.azimuth_servo: ServoController = ServoController()
         self.platform: PlatformController = PlatformController()
+        self.gc_policy = GcPolicy(
+            self.antenny_config.get("gc_period_ms") if self.antenny_config.has("gc_period_ms") else DEFAULT_PERIOD_MS
+        )
 
         self.i2c_bno: machine.I2C = self.i2c_init(0, 0, 0)
         self.i2c_pwm_controller: machine.I2C = self.i2c_init(1, 0, 0)
@@ -182,10 +181,19 @@ class AntennyAPI:
         """
         return self.safe_mode
 
-    def antenny_init_components(self):
+    def antenny_loaded_components(self):
         """
-        Initialize all antenny system components
-        :return: None
+        Lists the drivers imported so far, only the ones selected by the use_* flags of the config are
+        :return: component keys
+        """
+        return loaded_components()
+
+    def antenny_init_components(self, parallel: bool = True, timeouts: dict = None):
+        """
+        Initialize all antenny system components, independent ones concurrently
+        :param parallel: False brings the components up one at a time
+        :param timeouts: component name to timeout in milliseconds, overrides the defaults
+        :return: readiness status of every component, see api/bringup.py
         """
         if self.antenny_config is None:
             print("Please load a config before initializing components")
@@ -194,14 +202,60 @@ class AntennyAPI:
             print("If you believe this is an error, or you have modified the base components of the antenny board, "
                   "please check Config class as well as the default configs for more details.")
 
-        self.imu_init()
-        self.pwm_controller_init()
-        self.elevation_servo_init()
-        self.azimuth_servo_init()
-        self.screen_init()
-        self.gps_init()
-        self.telemetry_init()
-        self.platform_init()
+        timeouts = timeouts or {}
+        # The BNO055/BNO08x I2C IMUs and the screen both use I2C peripheral 1, the RVC IMU uses UART 1
+        imu_bus = "uart1" if self.antenny_config.get("use_bno08x_rvc") else "i2c1"
+        stages = [
+            Stage("imu", self.imu_init, resource=imu_bus, timeout_ms=timeouts.get("imu", _IMU_INIT_TIMEOUT_MS)),
+            Stage("pwm", self.pwm_controller_init, resource="i2c0"),
+            Stage("gps", self.gps_init),
+            Stage("elevation_servo", self.elevation_servo_init, requires=("pwm",), resource="i2c0"),
+            Stage("azimuth_servo", self.azimuth_servo_init, requires=("pwm",), resource="i2c0"),
+            # The dashboard pages read the IMU and the GPS as soon as the screen starts
+            Stage("screen", self.screen_init, requires=("imu", "gps"), resource="i2c1"),
+            Stage("telemetry", self.telemetry_init, requires=("imu", "gps")),
+            Stage("platform", self.platform_init, requires=("imu", "elevation_servo", "azimuth_servo", "gps")),
+        ]
+        for stage in stages:
+            if stage.name in timeouts:
+                stage.timeout_ms = timeouts[stage.name]
+        # Importing compiles the driver modules, which takes more stack than the stage threads have
+        for key in self._selected_components():
+            try:
+                component_class(key)
+            except Exception as e:
+                print("Failed to import {}: {}".format(key, e))
+        status = BringUp(stages, max_parallel=None if parallel else 1, stack_size=_INIT_STACK_SIZE).run()
+        print_status(status)
+        # Init garbage is collected once here, then collections follow the PID job
+        self.gc_policy.install()
+        return status
+
+    def _selected_components(self):
+        """
+        Drivers the loaded config asks for, the fallbacks to mocks on init failures are not included
+        :return: component keys
+        """
+        config = self.antenny_config
+        if config.get("use_bno055"):
+            imu = "imu.bno055"
+        elif config.get("use_bno08x_i2c"):
+            imu = "imu.bno08x_i2c"
+        elif config.get("use_bno08x_rvc"):
+            imu = "imu.bno08x_rvc"
+        else:
+            imu = "imu.mock"
+        keys = [imu, "servo.pca9685"]
+        keys.append("pwm.pca9685" if config.get("use_motor") else "pwm.mock")
+        if config.get("use_screen"):
+            keys.extend(("screen.ssd1306", "screen.dashboard", "screen.pointing_page", "screen.gps_page",
+                         "screen.network_page"))
+        else:
+            keys.append("screen.mock")
+        keys.extend(("gps.basic", "gps.location") if config.get("use_gps") else ("gps.mock",))
+        keys.append("telemetry.udp" if config.get("use_telemetry") else "telemetry.mock")
+        keys.append("platform.mock" if imu == "imu.mock" or not config.get("use_motor") else "platform.pid")
+        return keys
 
     def antenny_save(self, name: str = None):
         """
@@ -494,11 +548,11 @@ class AntennyAPI:
                 )
             else:
                 self.i2c_pwm_controller = chain
-            pwm_controller = Pca9685Controller(self.i2c_pwm_controller, freq=freq)
+            pwm_controller = component_class("pwm.pca9685")(self.i2c_pwm_controller, freq=freq)
             print("Motor connected")
             safe_mode = False
         else:
-            pwm_controller = MockPWMController()
+            pwm_controller = component_class("pwm.mock")()
             print("According to your config, you do not have a motor connected, entering Safe Mode")
             safe_mode = True
         self.pwm_controller = pwm_controller
@@ -525,7 +579,7 @@ class AntennyAPI:
         if self.pwm_controller is None:
             print("You must initialize the PWM controller before the servo")
             raise AntennyMotorException
-        self.elevation_servo = Pca9685ServoController(
+        self.elevation_servo = component_class("servo.pca9685")(
             self.pwm_controller,
             self.antenny_config.get("elevation_servo_index")
         )
@@ -585,7 +639,7 @@ class AntennyAPI:
         if self.pwm_controller is None:
             print("You must initialize the PWM controller before the servo")
             raise AntennyMotorException
-        self.azimuth_servo = Pca9685ServoController(
+        self.azimuth_servo = component_class("servo.pca9685")(
             self.pwm_controller,
             self.antenny_config.get("azimuth_servo_index")
         )
@@ -660,15 +714,37 @@ class AntennyAPI:
                 # HARDCODED id to 1. need to fix
             else:
                 self.i2c_screen = chain
-            screen = Ssd1306ScreenController(
+            screen = component_class("screen.ssd1306")(
                 self.i2c_screen,
             )
+            self.screen_dashboard = component_class("screen.dashboard")(
+                screen,
+                [
+                    component_class("screen.pointing_page")(self),
+                    component_class("screen.gps_page")(self),
+                    component_class("screen.network_page")(),
+                ]
+            )
+            screen.set_dashboard(self.screen_dashboard)
+            screen.start()
         else:
-            screen = MockScreenController(Queue())
+            screen = component_class("screen.mock")(Queue())
             print("According to your config, you do not have a screen connected")
         self.screen = screen
         return screen
 
+    def screen_show_page(self, index: int, rotate: bool = False):
+        """
+        Shows a dashboard page on the screen
+        :param index: 0 pointing, 1 GPS, 2 network
+        :param rotate: keep cycling through pages afterwards
+        :return:
+        """
+        if self.screen_dashboard is None:
+            print("No screen dashboard is running")
+            raise AntennyScreenException("No screen dashboard is running")
+        self.screen_dashboard.show_page(index, rotate)
+
     def screen_scan(self):
         """
         Scan the screen I2C chain
@@ -688,9 +764,13 @@ class AntennyAPI:
         """
         if self.antenny_config.get("use_gps"):
             print("use_gps found in config: {}".format(self.antenny_config.get_name()))
-            gps = BasicGPSController(self.antenny_config.get("gps_uart_tx"), self.antenny_config.get("gps_uart_rx"))
+            gps = component_class("gps.basic")(self.antenny_config.get("gps_uart_tx"), self.antenny_config.get("gps_uart_rx"))
+            pps_pin = None
+            if self.antenny_config.has("gps_pps_pin") and self.antenny_config.get("gps_pps_pin") is not None:
+                pps_pin = machine.Pin(self.antenny_config.get("gps_pps_pin"), machine.Pin.IN)
+            CLOCK.attach_gps(gps.get_parser(), pps_pin=pps_pin)
         else:
-            gps = MockGPSController()
+            gps = component_class("gps.mock")()
             print("According to your config, you do not have a GPS connected")
         self.gps = gps
         return gps
@@ -710,14 +790,14 @@ class AntennyAPI:
             print("Cannot initalize telemetry without GPS")
             raise AntennyTelemetryException("Cannot initalize telemetry without GPS")
 
-        if isinstance(self.imu, MockImuController) or isinstance(self.gps, MockGPSController):
+        if is_component(self.imu, "imu.mock") or is_component(self.gps, "gps.mock"):
             print("WARNING: Initializing telemetry sender with mock components, please check your config")
 
         if self.antenny_config.get("use_telemetry"):
             print("use_telemetry found in config")
-            telemetry_sender = UDPTelemetrySender(port, self.gps, self.imu)
+            telemetry_sender = component_class("telemetry.udp")(port, self.gps, self.imu)
         else:
-            telemetry_sender = MockTelemetrySender("localhost", 31337)
+            telemetry_sender = component_class("telemetry.mock")("localhost", 31337)
             print("According to your config, you do not have a telemetry enabled")
         self.telemetry = telemetry_sender
         return telemetry_sender
@@ -740,14 +820,13 @@ class AntennyAPI:
                 self.i2c_bno = self.i2c_init(1, i2c_bno_scl, i2c_bno_sda, freq=freq)
             else:
                 self.i2c_bno = chain
-            self.imu = Bno055ImuController(
+            self.imu = component_class("imu.bno055")(
                 self.i2c_bno,
                 crystal=False,
                 address=self.antenny_config.get("i2c_bno_address"),
                 sign=(0, 0, 0)
             )
             self.imu_load()
-            self.imu.upload_calibration_profile()
             print("IMU connected")
         elif self.antenny_config.get("use_bno08x_i2c"):
             print("use_bno08x_i2c found in config: {}".format(self.antenny_config.get_name()))
@@ -762,7 +841,7 @@ class AntennyAPI:
             reset = machine.Pin(self.antenny_config.get("bno_rst"), machine.Pin.OUT)
             ps0.off()
             ps1.off()
-            self.imu = Bno08xImuController(
+            self.imu = component_class("imu.bno08x_i2c")(
                 self.i2c_bno,
                 debug=debug,
                 reset=reset
@@ -782,7 +861,7 @@ class AntennyAPI:
                 ps0.on()
                 ps1.off()
             uart_bno = self.uart_init(1, rx, tx, baud=115200)
-            self.imu = Bno08xUARTImuController(
+            self.imu = component_class("imu.bno08x_rvc")(
                 uart_bno,
                 reset=reset
             )
@@ -791,7 +870,7 @@ class AntennyAPI:
             self.imu.start()
             print("IMU connected")
         else:
-            self.imu = MockImuController()
+            self.imu = component_class("imu.mock")()
             print("According to your config, ou do not have an IMU connected")
         return self.imu
 
@@ -814,16 +893,8 @@ class AntennyAPI:
         """
         if self.antenny_config.get("use_bno055"):
             self.imu_config.set(
-                "accelerometer",
-                self.imu.get_accelerometer_calibration()
-            )
-            self.imu_config.set(
-                "magnetometer",
-                self.imu.get_magnetometer_calibration()
-            )
-            self.imu_config.set(
-                "gyroscope",
-                self.imu.get_gyroscope_calibration()
+                "calibration",
+                self.imu.get_calibration_profile()
             )
             self.imu_config.save(name=name, force=force)
 
@@ -833,19 +904,32 @@ class AntennyAPI:
         :param name: A different config to be loaded if specified
         :return:
         """
-        if not self.antenny_config.get("use_bno08x"):
+        if self.antenny_config.get("use_bno055"):
             self.imu_config.load(name)
-            self.imu.set_accelerometer_calibration(
-                self.imu_config.get("accelerometer")
-            )
-            self.imu.set_magnetometer_calibration(
-                self.imu_config.get("magnetometer")
-            )
-            self.imu.set_gyroscope_calibration(
-                self.imu_config.get("gyroscope")
+            self._imu_migrate_calibration()
+            self.imu.set_calibration_profile(
+                self.imu_config.get("calibration")
             )
             self.imu.upload_calibration_profile()
 
+    def _imu_migrate_calibration(self):
+        """
+        Converts an IMU config saved with per-register calibration dicts into a single calibration profile
+        :return:
+        """
+        if self.imu_config.has("calibration"):
+            return
+        print("Migrating IMU config {} to a single calibration profile".format(self.imu_config.get_name()))
+        self.imu_config.set(
+            "calibration",
+            component_class("imu.bno055").calibration_profile_from_registers(
+                self.imu_config.remove("accelerometer") or {},
+                self.imu_config.remove("magnetometer") or {},
+                self.imu_config.remove("gyroscope") or {},
+            )
+        )
+        self.imu_config.save()
+
     def imu_make_default(self):
         """
         Makes the current IMU calibration config default
@@ -897,12 +981,12 @@ class AntennyAPI:
         Initialize the antenny axis control system
         :return: AntennaController
         """
-        if isinstance(self.imu, MockImuController) or isinstance(self.pwm_controller, MockPWMController):
+        if is_component(self.imu, "imu.mock") or is_component(self.pwm_controller, "pwm.mock"):
             print("Mock components detected, creating mock antenna controller")
-            platform = MockPlatformController(self.azimuth_servo, self.elevation_servo, self.imu)
+            platform = component_class("platform.mock")(self.azimuth_servo, self.elevation_servo, self.imu)
         else:
             print("Initializing PIDAntennaController class")
-            platform = PIDPlatformController(
+            platform = component_class("platform.pid")(
                 self.azimuth_servo,
                 self.elevation_servo,
                 self.imu,
@@ -915,8 +999,8 @@ class AntennyAPI:
             
         self.platform = platform
 
-        if not isinstance(self.gps, MockGPSController):
-            self.gps_update_loop = GPSLocationController(self.gps)
+        if not is_component(self.gps, "gps.mock"):
+            self.gps_update_loop = component_class("gps.location")(self.gps, clock=CLOCK)
             self.gps_update_loop.start()
         else:
             self.gps_update_loop = None
@@ -1036,7 +1120,59 @@ class AntennyAPI:
         Checks the antenny config for components before attempting to calibrate
         :return:
         """
-        if isinstance(self.pwm_controller, MockPWMController):
+        if is_component(self.pwm_controller, "pwm.mock"):
             raise AntennyMotorException("Can not auto calibrate without a motor")
-        if isinstance(self.imu, MockImuController):
+        if is_component(self.imu, "imu.mock"):
             raise AntennyIMUException("Can not auto calibrate without an imu")
+
+#  Scheduler Functions
+
+    def scheduler_report(self, reset: bool = False):
+        """
+        Prints the CPU share of every periodic job
+        :param reset: start measuring again afterwards
+        :return: job name to run statistics
+        """
+        scheduler = shared_scheduler()
+        scheduler.print_report()
+        report = scheduler.report()
+        if reset:
+            scheduler.reset_stats()
+        return report
+
+#  Profiling Functions
+
+    def profile_report(self, reset: bool = False):
+        """
+        Prints the call counts, time and, when tracked, heap allocation of the instrumented sections
+        :param reset: start measuring again afterwards
+        :return: section name to statistics
+        """
+        profiler.print_report()
+        report = profiler.report()
+        if reset:
+            profiler.reset()
+        return report
+
+    def profile_enable(self, enabled: bool = True, track_alloc: bool = False):
+        """
+        Turns the instrumentation on or off
+        :param enabled:
+        :param track_alloc: also measure heap allocation, slows every instrumented section down
+        :return:
+        """
+        profiler.enable(enabled, track_alloc)
+
+#  Memory Functions
+
+    def memory_report(self):
+        """
+        Prints the scheduled garbage collection pauses and the free heap
+        :return: dictionary of the GC policy statistics
+        """
+        report = self.gc_policy.report()
+        print("GC every {} ms, threshold {} bytes, {} collection(s)".format(
+            report["period_ms"], report["threshold"], report["collections"]))
+        print("Pause avg {} us, max {} us, last {} us, free heap {} bytes".format(
+            report["avg_pause_us"], report["max_pause_us"], report["last_pause_us"], report["free_after"]))
+        return report
@@ -0,0 +1,229 @@
+"""
+Brings the antenny components up in dependency order, running independent stages on their
+own threads so slow parts such as the IMU boot or the GPS UART setup overlap. Stages that use
+the same bus are never run at the same time. Each stage gets a timeout and the outcome of
+every stage is returned as a dictionary:
+
+    {
+        "ready": False,
+        "total_ms": 1840,
+        "components": {
+            "imu": {"status": "ready", "ms": 1210, "error": None, "requires": []},
+            "telemetry": {"status": "skipped", "ms": 0, "error": "gps timeout", "requires": ["imu", "gps"]},
+            ...
+        }
+    }
+"""
+try:
+    from utime import ticks_ms, ticks_diff
+except ImportError:
+    import time
+
+    def ticks_ms():
+        return int(time.monotonic() * 1000)
+
+    def ticks_diff(new, old):
+        return new - old
+
+try:
+    import _thread
+except ImportError:
+    _thread = None
+
+from antenny_threading import Thread, Queue, Empty
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_READY = "ready"
+STATUS_FAILED = "failed"
+STATUS_TIMEOUT = "timeout"
+STATUS_SKIPPED = "skipped"
+
+_DEFAULT_TIMEOUT_MS = 10000
+
+
+class Stage:
+    """
+    One component bring-up
+    """
+
+    def __init__(self, name: str, function, requires=(), resource: str = None, timeout_ms: int = _DEFAULT_TIMEOUT_MS):
+        """
+        :param name:
+        :param function: called without arguments, raises on failure
+        :param requires: names of the stages that have to be ready first
+        :param resource: bus the stage uses, stages sharing one run one after the other
+        :param timeout_ms:
+        """
+        self.name = name
+        self.function = function
+        self.requires = tuple(requires)
+        self.resource = resource
+        self.timeout_ms = timeout_ms
+        self.status = STATUS_PENDING
+        self.error = None
+        self.started = None
+        self.ms = 0
+
+    def as_dict(self):
+        return {
+            "status": self.status,
+            "ms": self.ms,
+            "error": self.error,
+            "requires": list(self.requires),
+        }
+
+
+class _StageThread(Thread):
+    """
+    Runs a stage and reports its outcome on the orchestrator's queue
+    """
+
+    def __init__(self, stage: Stage, results: Queue):
+        super(_StageThread, self).__init__()
+        self._stage = stage
+        self._results = results
+
+    def run(self):
+        error = None
+        try:
+            self._stage.function()
+        except Exception as e:
+            error = "{}: {}".format(type(e).__name__, e)
+        self._results.put((self._stage.name, error))
+
+
+class BringUp:
+    """
+    Runs stages concurrently as their requirements and buses allow
+    """
+
+    def __init__(self, stages, max_parallel: int = None, stack_size: int = None):
+        """
+        :param stages: Stage list, in the order stages are preferred when several can start
+        :param max_parallel: stages running at once, unlimited if None
+        :param stack_size: stack of the stage threads in bytes, the firmware's thread default if None
+        """
+        self.stages = stages
+        self.max_parallel = max_parallel
+        self.stack_size = stack_size
+        self._by_name = {}
+        for stage in stages:
+            self._by_name[stage.name] = stage
+        for stage in stages:
+            for requirement in stage.requires:
+                if requirement not in self._by_name:
+                    raise ValueError("Stage {} requires unknown stage {}".format(stage.name, requirement))
+
+    def _start_ready(self, results: Queue, running: dict, held: dict):
+        """
+        Starts every pending stage whose requirements are met, skips the ones that can not run anymore
+        """
+        for stage in self.stages:
+            if stage.status != STATUS_PENDING:
+                continue
+            blocked = None
+            waiting = False
+            for requirement in stage.requires:
+                status = self._by_name[requirement].status
+                if status in (STATUS_FAILED, STATUS_TIMEOUT, STATUS_SKIPPED):
+                    blocked = "{} {}".format(requirement, status)
+                    break
+                if status != STATUS_READY:
+                    waiting = True
+            if blocked is not None:
+                stage.status = STATUS_SKIPPED
+                stage.error = blocked
+                continue
+            if waiting or (stage.resource is not None and stage.resource in held):
+                stage.error = None if waiting else "waiting for {} held by {}".format(stage.resource, held[stage.resource])
+                continue
+            if self.max_parallel is not None and len(running) >= self.max_parallel:
+                return
+            stage.status = STATUS_RUNNING
+            stage.error = None
+            stage.started = ticks_ms()
+            running[stage.name] = stage
+            if stage.resource is not None:
+                held[stage.resource] = stage.name
+            _StageThread(stage, results).start()
+
+    def run(self):
+        """
+        Brings up all stages
+        :return: status dictionary
+        """
+        start = ticks_ms()
+        results = Queue()
+        running = {}
+        # Bus to the name of the stage using it
+        held = {}
+        # Timed out stages whose threads may still be using their bus
+        abandoned = {}
+        previous_stack_size = None
+        if self.stack_size is not None and _thread is not None:
+            previous_stack_size = _thread.stack_size(self.stack_size)
+        try:
+            self._run(results, running, held, abandoned)
+        finally:
+            if previous_stack_size is not None:
+                _thread.stack_size(previous_stack_size)
+        for stage in self.stages:
+            if stage.status == STATUS_PENDING:
+                stage.status = STATUS_SKIPPED
+                if stage.error is None:
+                    stage.error = "requirements never became ready"
+        components = {}
+        for stage in self.stages:
+            components[stage.name] = stage.as_dict()
+        return {
+            "ready": all(stage.status == STATUS_READY for stage in self.stages),
+            "total_ms": ticks_diff(ticks_ms(), start),
+            "components": components,
+        }
+
+    def _run(self, results: Queue, running: dict, held: dict, abandoned: dict):
+        while True:
+            self._start_ready(results, running, held)
+            if not running:
+                # Stages left waiting on the bus of an abandoned stage are skipped
+                break
+            now = ticks_ms()
+            wait_ms = min(stage.timeout_ms - ticks_diff(now, stage.started) for stage in running.values())
+            try:
+                name, error = results.get(timeout=max(wait_ms, 0) / 1000)
+            except Empty:
+                name = None
+            now = ticks_ms()
+            if name in running:
+                stage = running.pop(name)
+                stage.ms = ticks_diff(now, stage.started)
+                stage.status = STATUS_READY if error is None else STATUS_FAILED
+                stage.error = error
+                if stage.resource is not None:
+                    del held[stage.resource]
+            elif name in abandoned:
+                # The late result of a timed out stage, its status stays timeout but the bus is free again
+                stage = abandoned.pop(name)
+                if stage.resource is not None:
+                    del held[stage.resource]
+            for stage in list(running.values()):
+                if ticks_diff(now, stage.started) >= stage.timeout_ms:
+                    # The thread can not be stopped and may still be talking on the bus, which stays
+                    # held until its late result arrives
+                    running.pop(stage.name)
+                    abandoned[stage.name] = stage
+                    stage.ms = ticks_diff(now, stage.started)
+                    stage.status = STATUS_TIMEOUT
+                    stage.error = "did not finish within {} ms".format(stage.timeout_ms)
+
+
+def print_status(status: dict):
+    """
+    Prints a bring-up status as a table
+    :param status: returned by BringUp.run
+    :return:
+    """
+    for name, component in status["components"].items():
+        print("{:<16} {:<8} {:>6} ms  {}".format(name, component["status"], component["ms"], component["error"] or ""))
+    print("{} in {} ms".format("Ready" if status["ready"] else "NOT READY", status["total_ms"]))
@@ -0,0 +1,76 @@
+"""
+Registry of the drivers AntennyAPI can build. Driver modules are only imported the first time
+one of their classes is asked for, so a board that does not use a screen or a GPS never pays
+for the SSD1306 framebuffer code or the NMEA parser, and booting to a prompt only has to load
+the config.
+"""
+import sys
+
+# Component key: (module, class)
+COMPONENTS = {
+    "imu.bno055": ("imu.imu_bno055", "Bno055ImuController"),
+    "imu.bno08x_i2c": ("imu.imu_bno08x_i2c", "Bno08xImuController"),
+    "imu.bno08x_rvc": ("imu.imu_bno08x_rvc", "Bno08xUARTImuController"),
+    "imu.mock": ("imu.mock_imu", "MockImuController"),
+    "pwm.pca9685": ("motor.motor_pca9685", "Pca9685Controller"),
+    "pwm.mock": ("motor.mock_motor", "MockPWMController"),
+    "servo.pca9685": ("motor.motor_pca9685", "Pca9685ServoController"),
+    "screen.ssd1306": ("controller.screen_ss1306_controller", "Ssd1306ScreenController"),
+    "screen.mock": ("screen.mock_screen", "MockScreenController"),
+    "screen.dashboard": ("screen.screen_pages", "ScreenDashboard"),
+    "screen.pointing_page": ("screen.screen_pages", "PointingPage"),
+    "screen.gps_page": ("screen.screen_pages", "GPSPage"),
+    "screen.network_page": ("screen.screen_pages", "NetworkPage"),
+    "gps.basic": ("gps.gps_basic", "BasicGPSController"),
+    "gps.mock": ("gps.mock_gps_controller", "MockGPSController"),
+    "gps.location": ("controller.gps_location_controller", "GPSLocationController"),
+    "telemetry.udp": ("sender.sender_udp", "UDPTelemetrySender"),
+    "telemetry.mock": ("sender.mock_sender", "MockTelemetrySender"),
+    "platform.pid": ("controller.pid_controller", "PIDPlatformController"),
+    "platform.mock": ("controller.mock_controller", "MockPlatformController"),
+}
+
+_loaded = {}
+
+
+def component_class(key: str):
+    """
+    Imports a driver on first use
+    :param key: a key of COMPONENTS
+    :return: the driver class
+    """
+    cls = _loaded.get(key)
+    if cls is None:
+        if key not in COMPONENTS:
+            raise KeyError("Unknown component {}".format(key))
+        module_name, class_name = COMPONENTS[key]
+        module = __import__(module_name, None, None, (class_name,))
+        cls = getattr(module, class_name)
+        _loaded[key] = cls
+    return cls
+
+
+def is_component(obj, key: str) -> bool:
+    """
+    isinstance against a registered driver without importing it, an object can not be an
+    instance of a driver that was never loaded
+    :param obj:
+    :param key: a key of COMPONENTS
+    :return:
+    """
+    cls = _loaded.get(key)
+    if cls is None:
+        # Also covers drivers imported directly, outside of the registry
+        module_name, class_name = COMPONENTS[key]
+        module = sys.modules.get(module_name)
+        if module is None:
+            return False
+        cls = getattr(module, class_name)
+    return isinstance(obj, cls)
+
+
+def loaded_components():
+    """
+    :return: keys of the drivers imported so far
+    """
+    return sorted(_loaded.keys())
@@ -59,6 +59,13 @@ class Connection(object):
                 except:
                     pass
                 time.sleep(1)
+            from clock.clock import CLOCK, start_ntp_sync
+            try:
+                CLOCK.sync_ntp()
+            except Exception as e:
+                print("Could not discipline the station clock: {}".format(e))
+            # Later exchanges estimate the drift when no GPS disciplines the clock
+            start_ntp_sync()
 
         # Failure, starting access point
         else:
@@ -0,0 +1,348 @@
+import socket
+import struct
+import time
+
+from antenny_threading import Thread
+from gps.nmea import new_fix, FIX_VALID, FIX_TIME, FIX_DATE, FIX_TICKS_US
+
+try:
+    import machine
+    from utime import ticks_us, ticks_diff
+
+    RTC = machine.RTC()
+except ImportError:
+    machine = None
+    RTC = None
+
+    def ticks_us():
+        return time.monotonic_ns() // 1000
+
+    def ticks_diff(new, old):
+        return new - old
+
+# All disciplined times are integer microseconds since 2000-01-01 UTC, the
+# MicroPython epoch, so they agree between the ESP32 and a CPython leader.
+UNIX_Y2K_DELTA = 946684800
+NTP_Y2K_DELTA = 3155673600
+_NTP_PORT = 123
+_NTP_PACKET_LENGTH = 48
+
+# Offsets larger than this are stepped instead of slewed
+_STEP_THRESHOLD_US = 100000
+# A backward step that holds the clock for longer than this is reported
+_LONG_HOLD_US = 1000000
+# Fraction of the measured phase error corrected per sample (1 / gain)
+_PHASE_GAIN = 2
+# Fraction of the implied frequency error corrected per sample (1 / gain)
+_FREQUENCY_GAIN = 4
+_MAX_FREQUENCY_PPB = 500000
+# A PPS edge is paired with the NMEA sentence that follows it within a second
+_PPS_WINDOW_US = 1000000
+_SAMPLE_HISTORY = 8
+
+SOURCE_NONE = 0
+SOURCE_NMEA = 1
+SOURCE_NTP = 2
+SOURCE_PPS = 3
+
+
+def days_since_y2k(year: int, month: int, day: int) -> int:
+    """
+    Counts days from 2000-01-01 to the given date in the proleptic Gregorian calendar
+    :param year:
+    :param month:
+    :param day:
+    :return:
+    """
+    if month <= 2:
+        year -= 1
+        month += 12
+    return 365 * year + year // 4 - year // 100 + year // 400 + (153 * (month - 3) + 2) // 5 + day - 730426
+
+
+def _wall_clock_us() -> int:
+    """
+    Reads the undisciplined wall clock
+    :return: microseconds since 2000-01-01
+    """
+    if RTC is None:
+        return int(time.time() * 1000000) - UNIX_Y2K_DELTA * 1000000
+    return time.time() * 1000000 + RTC.datetime()[7]
+
+
+class ClockDiscipline(object):
+    """
+    Steers a disciplined clock to a time reference. The local microsecond tick
+    counter is extended to a monotonic count, then mapped to reference time
+    with an offset and a frequency correction that are refined as GPS, PPS or
+    NTP samples come in.
+    """
+
+    def __init__(self):
+        self._last_ticks = ticks_us()
+        self._monotonic_us = 0
+        self._base_local_us = self.monotonic_us()
+        self._base_reference_us = _wall_clock_us()
+        self._frequency_ppb = 0
+        self._last_sample_local_us = None
+        self._last_now_us = 0
+        self._source = SOURCE_NONE
+        self._sample_count = 0
+        self._errors_us = []
+        self._gps_parser = None
+        self._gps_fix = new_fix()
+        self._gps_sequence = 0
+        self._gps_second = None
+        self._pps_ticks = 0
+        self._pps_count = 0
+        self._pps_pin = None
+
+    def monotonic_us(self) -> int:
+        """
+        Gets the undisciplined local time, extended past the ticks_us() wrap
+        :return: microseconds since an arbitrary start
+        """
+        now = ticks_us()
+        self._monotonic_us += ticks_diff(now, self._last_ticks)
+        self._last_ticks = now
+        return self._monotonic_us
+
+    def local_from_ticks(self, ticks: int) -> int:
+        """
+        Converts a recent ticks_us() reading to the monotonic local time base
+        :param ticks:
+        :return:
+        """
+        return self.monotonic_us() - ticks_diff(self._last_ticks, ticks)
+
+    def to_reference_us(self, local_us: int) -> int:
+        """
+        Maps a monotonic local time to disciplined reference time
+        :param local_us:
+        :return:
+        """
+        elapsed = local_us - self._base_local_us
+        return self._base_reference_us + elapsed + elapsed * self._frequency_ppb // 1000000000
+
+    def to_local_us(self, reference_us: int) -> int:
+        """
+        Maps a disciplined reference time to the monotonic local time base
+        :param reference_us:
+        :return:
+        """
+        elapsed = reference_us - self._base_reference_us
+        return self._base_local_us + elapsed * 1000000000 // (1000000000 + self._frequency_ppb)
+
+    def now_us(self) -> int:
+        """
+        Gets the disciplined time, never decreasing between calls. After a backward step the
+        previous value is returned until the stepped time catches up with it.
+        :return: microseconds since 2000-01-01 UTC
+        """
+        now = self.to_reference_us(self.monotonic_us())
+        if now < self._last_now_us:
+            return self._last_now_us
+        self._last_now_us = now
+        return now
+
+    def now(self) -> float:
+        """
+        Gets the disciplined time in seconds, for display and coarse comparisons
+        :return: seconds since 2000-01-01 UTC
+        """
+        return self.now_us() / 1000000
+
+    def is_synchronized(self) -> bool:
+        """
+        Checks if the clock has been set from a time reference
+        :return:
+        """
+        return self._source != SOURCE_NONE
+
+    def add_sample(self, local_us: int, reference_us: int, source: int):
+        """
+        Steers the clock towards a reference time observed at a local time
+        :param local_us: monotonic local time of the observation
+        :param reference_us: reference time at that instant, microseconds since 2000-01-01
+        :param source: SOURCE_* constant of the reference
+        :return: the phase error before correction in microseconds
+        """
+        # A coarse source is ignored once a more precise one is steering the clock
+        if source < self._source and self._last_sample_local_us is not None \
+                and local_us - self._last_sample_local_us < 60000000:
+            return None
+        error = reference_us - self.to_reference_us(local_us)
+        self._sample_count += 1
+        self._errors_us.append(error)
+        if len(self._errors_us) > _SAMPLE_HISTORY:
+            self._errors_us.pop(0)
+        if self._last_sample_local_us is None or abs(error) > _STEP_THRESHOLD_US:
+            self._base_local_us = local_us
+            self._base_reference_us = reference_us
+            if self._last_sample_local_us is None:
+                # Times read before the first sample came from the unset RTC and are dropped
+                self._last_now_us = 0
+            elif error < -_LONG_HOLD_US:
+                print("Clock stepped back {} us, holding the time until it catches up".format(-error))
+        else:
+            interval = local_us - self._last_sample_local_us
+            if interval > 0:
+                frequency = self._frequency_ppb + error * 1000000000 // interval // _FREQUENCY_GAIN
+                self._frequency_ppb = max(-_MAX_FREQUENCY_PPB, min(_MAX_FREQUENCY_PPB, frequency))
+            self._base_reference_us = self.to_reference_us(local_us) + error // _PHASE_GAIN
+            self._base_local_us = local_us
+        self._last_sample_local_us = local_us
+        self._source = source
+        return error
+
+    def sync_ntp(self, host: str = "pool.ntp.org", samples: int = 4, timeout: float = 1.0):
+        """
+        Queries an NTP server several times and steers the clock with the lowest delay exchange
+        :param host:
+        :param samples:
+        :param timeout:
+        :return: the phase error before correction in microseconds, None if no reply was received
+        """
+        address = socket.getaddrinfo(host, _NTP_PORT)[0][-1]
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(timeout)
+        query = bytearray(_NTP_PACKET_LENGTH)
+        query[0] = 0x1B  # LI=0, VN=3, Mode=3 (client)
+        best_delay = None
+        best_sample = None
+        try:
+            for _ in range(samples):
+                sent = self.monotonic_us()
+                sock.sendto(query, address)
+                try:
+                    reply = sock.recv(_NTP_PACKET_LENGTH)
+                except OSError:
+                    continue
+                received = self.monotonic_us()
+                if len(reply) < _NTP_PACKET_LENGTH:
+                    continue
+                server_received = self._ntp_to_y2k_us(reply, 32)
+                server_sent = self._ntp_to_y2k_us(reply, 40)
+                delay = (received - sent) - (server_sent - server_received)
+                if best_delay is None or delay < best_delay:
+                    best_delay = delay
+                    best_sample = ((sent + received) // 2, (server_received + server_sent) // 2)
+        finally:
+            sock.close()
+        if best_sample is None:
+            print("No reply from NTP server {}".format(host))
+            return None
+        return self.add_sample(best_sample[0], best_sample[1], SOURCE_NTP)
+
+    @staticmethod
+    def _ntp_to_y2k_us(packet, offset: int) -> int:
+        seconds, fraction = struct.unpack_from("!II", packet, offset)
+        return (seconds - NTP_Y2K_DELTA) * 1000000 + (fraction * 1000000 >> 32)
+
+    def attach_gps(self, parser, pps_pin=None):
+        """
+        Uses fixes from a GPS NMEA parser, and the PPS edge where one is wired, as the time reference
+        :param parser: gps.nmea.NmeaParser
+        :param pps_pin: machine.Pin connected to the GPS PPS output
+        :return:
+        """
+        self._gps_parser = parser
+        if pps_pin is not None:
+            self._pps_pin = pps_pin
+            try:
+                pps_pin.irq(trigger=machine.Pin.IRQ_RISING, handler=self._pps_irq, hard=True)
+            except TypeError:
+                pps_pin.irq(trigger=machine.Pin.IRQ_RISING, handler=self._pps_irq)
+
+    def _pps_irq(self, pin):
+        self._pps_ticks = ticks_us()
+        self._pps_count += 1
+
+    def update_gps(self):
+        """
+        Steers the clock with the latest GPS fix, called after the GPS UART is drained
+        :return: the phase error before correction in microseconds, None if no new sample
+        """
+        if self._gps_parser is None:
+            return None
+        fix = self._gps_fix
+        sequence = self._gps_parser.read_fix(fix)
+        if sequence == self._gps_sequence:
+            return None
+        self._gps_sequence = sequence
+        date = fix[FIX_DATE]
+        if not fix[FIX_VALID] or date == 0:
+            return None
+        millis = fix[FIX_TIME]
+        days = days_since_y2k(2000 + date % 100, (date // 100) % 100, date // 10000)
+        second = days * 86400 + millis // 1000
+        if second == self._gps_second:
+            return None
+        self._gps_second = second
+        sentence_local_us = self.local_from_ticks(fix[FIX_TICKS_US])
+        if self._pps_count:
+            pps_local_us = self.local_from_ticks(self._pps_ticks)
+            if 0 <= sentence_local_us - pps_local_us < _PPS_WINDOW_US:
+                return self.add_sample(pps_local_us, second * 1000000, SOURCE_PPS)
+        return self.add_sample(sentence_local_us, second * 1000000 + (millis % 1000) * 1000, SOURCE_NMEA)
+
+    def get_status(self) -> dict:
+        """
+        Gets the discipline state
+        :return:
+        """
+        return {
+            "synchronized": self.is_synchronized(),
+            "source": self._source,
+            "frequency_ppb": self._frequency_ppb,
+            "samples": self._sample_count,
+            "recent_errors_us": list(self._errors_us),
+            "pps_count": self._pps_count,
+        }
+
+
+class NtpSyncThread(Thread):
+    """
+    Repeats NTP exchanges so the clock frequency keeps being disciplined
+    """
+
+    def __init__(self, clock: ClockDiscipline, host: str = "pool.ntp.org", interval: float = 64):
+        super(NtpSyncThread, self).__init__()
+        self._clock = clock
+        self._host = host
+        self._interval = interval
+
+    def run(self):
+        while self.running:
+            # Started after an initial exchange, the first sample of the thread already measures drift
+            time.sleep(self._interval)
+            try:
+                self._clock.sync_ntp(self._host)
+            except OSError as e:
+                print("NTP sync failed: {}".format(e))
+
+
+CLOCK = ClockDiscipline()
+_ntp_sync = None
+
+
+def start_ntp_sync(host: str = "pool.ntp.org", interval: float = 64):
+    """
+    Starts repeating NTP exchanges on the station clock, once per boot
+    :param host:
+    :param interval: seconds between exchanges
+    :return: the NtpSyncThread
+    """
+    global _ntp_sync
+    if _ntp_sync is None:
+        _ntp_sync = NtpSyncThread(CLOCK, host, interval)
+        _ntp_sync.start()
+    return _ntp_sync
+
+
+def now_us() -> int:
+    """
+    Gets the station's disciplined time
+    :return: microseconds since 2000-01-01 UTC
+    """
+    return CLOCK.now_us()
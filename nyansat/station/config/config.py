@@ -6,12 +6,95 @@ from exceptions import AntennyConfigException
 
 CONFIGS = "configs"
 DEFAULTS = "/configs/defaults.json"
+TEMP_SUFFIX = ".tmp"
+
+# Parsed JSON of the files that are only read, or written through this module: the meta config,
+# help schemas and stock configs
+_json_cache = {}
+# Config type: Config shared by every component of the process
+_shared_configs = {}
+_TYPES = {
+    "int": int,
+    "float": float,
+    "bool": bool,
+}
+
+
+def _read_json(path, cache=True):
+    """
+    Parses a JSON file, once per process if cached
+    :param path:
+    :param cache:
+    :return:
+    """
+    if cache and path in _json_cache:
+        return _json_cache[path]
+    try:
+        fh = open(path, "r")
+    except OSError:
+        # A power cut between removing the old file and renaming the new one leaves only the temp file
+        os.rename(path + TEMP_SUFFIX, path)
+        fh = open(path, "r")
+    with fh:
+        data = json.load(fh)
+    if cache:
+        _json_cache[path] = data
+    return data
+
+
+def _write_json(path, data):
+    """
+    Writes a JSON file atomically, a power cut leaves either the old or the new file
+    :param path:
+    :param data:
+    :return:
+    """
+    temp_path = path + TEMP_SUFFIX
+    with open(temp_path, "w") as fh:
+        json.dump(data, fh)
+    try:
+        os.rename(temp_path, path)
+    except OSError:
+        # FAT can not rename over an existing file
+        os.remove(path)
+        os.rename(temp_path, path)
+    _json_cache.pop(path, None)
+
+
+def _parse_string(value, value_type):
+    """
+    Parses a string into a schema type
+    :param value:
+    :param value_type:
+    :return: the typed value, None if it does not parse
+    """
+    if value_type is bool:
+        return {"true": True, "false": False}.get(value.strip().lower())
+    try:
+        return value_type(value)
+    except ValueError:
+        return None
+
+
+def shared_config(config_type="antenny"):
+    """
+    Gets the process wide instance of a config type, so the API and the components it starts
+    read one parsed copy and see the same loaded config
+    :param config_type:
+    :return: Config
+    """
+    config = _shared_configs.get(config_type)
+    if config is None:
+        config = Config(config_type)
+        _shared_configs[config_type] = config
+    return config
 
 
 class Config:
     def __init__(self, config_type="antenny"):
         self.config_type = config_type
         self._config = None
+        self._schema = None
         self._config_name = self._get_default_config()
         self.load(self._config_name)
 
@@ -35,16 +118,14 @@ class Config:
         Gets the default config form the meta config
         :return:
         """
-        with open(DEFAULTS, "r") as fh:
-            return json.load(fh)[self.config_type]
+        return _read_json(DEFAULTS)[self.config_type]
 
     def _get_original_default_config(self):
         """
         Gets the stock default config from the meta config
         :return:
         """
-        with open(DEFAULTS, "r") as fh:
-            return json.load(fh)["original_{}".format(self.config_type)]
+        return _read_json(DEFAULTS)["original_{}".format(self.config_type)]
 
     def _get_type_path(self):
         """
@@ -112,11 +193,65 @@ class Config:
                 return False
             self._config_name = name
 
-        with open(self._get_this_config_path(), "r") as fh:
+        try:
+            config = _read_json(self._get_this_config_path(), cache=False)
+        except ValueError:
+            print("JSON parse error %s" % (self._get_this_config_path()))
+            return False
+        self._schema = self._load_schema()
+        for key in config:
             try:
-                self._config = json.load(fh)
-            except ValueError:
-                print("JSON parse error %s" % (self._get_this_config_path()))
+                config[key] = self._coerce(key, config[key])
+            except AntennyConfigException:
+                pass
+        self._config = config
+        return True
+
+    def _load_schema(self):
+        """
+        Loads the help schema of the current config, falling back to the one of the stock config
+        :return: key to help entry, None if there is no schema
+        """
+        for name in (self._config_name, self._get_original_default_config()):
+            path = self._get_config_path(name + "_help")
+            if path in _json_cache:
+                schema = _json_cache[path]
+            else:
+                try:
+                    schema = _read_json(path)
+                except OSError:
+                    # Remember configs without a schema so they are not looked up again
+                    schema = _json_cache[path] = None
+            if schema is not None:
+                return schema
+        return None
+
+    def _coerce(self, key, value):
+        """
+        Converts a value to the type the schema gives its key
+        :param key:
+        :param value:
+        :return: typed value
+        """
+        if self._schema is None or value is None or key not in self._schema:
+            return value
+        value_type = _TYPES.get(self._schema[key].get("type"))
+        if value_type is None or type(value) is value_type:
+            return value
+        if isinstance(value, str):
+            # Values typed into the shell arrive as strings
+            value = _parse_string(value, value_type)
+            if value is not None:
+                return value
+        elif value_type is not bool and not isinstance(value, bool) and isinstance(value, (int, float)):
+            if value_type is int and value != int(value):
+                print("Config value {} for {} is not an integer".format(value, key))
+                raise AntennyConfigException("Config value {} for {} is not an integer".format(value, key))
+            return value_type(value)
+        print("Config value {} for {} is not of type {}".format(value, key, self._schema[key]["type"]))
+        raise AntennyConfigException(
+            "Config value {} for {} is not of type {}".format(value, key, self._schema[key]["type"])
+        )
 
     def save(self, name: str = None, force=False):
         """
@@ -135,8 +270,7 @@ class Config:
             elif force:
                 print("Overwriting the config {}".format(name))
             self._config_name = name
-        with open(self._get_this_config_path(), "w") as fh:
-            json.dump(self._config, fh)
+        _write_json(self._get_this_config_path(), self._config)
         return self._config_name
 
     def set(self, key, value):
@@ -149,9 +283,28 @@ class Config:
         if self._config is None:
             print("Trying to set key: {} to value: {} in an empty config".format(key, value))
             raise AntennyConfigException("Trying to set key: {} to value: {} in an empty config".format(key, value))
-        self._config[key] = value
+        self._config[key] = self._coerce(key, value)
         return True
 
+    def remove(self, key):
+        """
+        Remove a config value
+        :param key:
+        :return:
+        """
+        if self._config is None:
+            print("Trying to remove key: {} from an empty config".format(key))
+            raise AntennyConfigException("Trying to remove key: {} from an empty config".format(key))
+        return self._config.pop(key, None)
+
+    def has(self, key):
+        """
+        Checks if the config contains a key
+        :param key:
+        :return:
+        """
+        return self._config is not None and key in self._config
+
     def get(self, key):
         """
         Get a config value
@@ -195,11 +348,9 @@ class Config:
         :return:
         """
         self.save()
-        with open(DEFAULTS, "r") as fh:
-            defaults = json.load(fh)
+        defaults = _read_json(DEFAULTS)
         defaults[self.config_type] = self._config_name
-        with open(DEFAULTS, "w") as fh:
-            json.dump(defaults, fh)
+        _write_json(DEFAULTS, defaults)
 
     def load_default_config(self):
         """
@@ -229,10 +380,7 @@ class Config:
         :return:
         """
         check_flag = True
-        with open(DEFAULTS, "r") as fh:
-            valid_config_path = self._get_config_path(json.load(fh)["original_{}".format(self.config_type)])
-        with open(valid_config_path, "r") as fh:
-            valid_config = json.load(fh)
+        valid_config = _read_json(self._get_config_path(self._get_original_default_config()))
         for key in valid_config:
             if key not in self._config:
                 print("The config {} is missing the key {}".format(self.get_name(), key))
@@ -251,8 +399,7 @@ class Config:
         Gets the help info if available
         :return:
         """
-        with open(self._get_help_path(), "r") as fh:
-            return json.load(fh)
+        return _read_json(self._get_help_path())
 
     def list_configs(self):
         """
@@ -56,6 +56,17 @@ class PlatformController:
         """
         raise NotImplementedError()
 
+    def watch_settle(self, callback, tolerance: float = 1.0, samples: int = 5, timeout_ms: int = 10000):
+        """
+        Reports when the platform has converged on the current setpoint
+        :param callback: called as callback(settled, settle_ms, azimuth_error, elevation_error)
+        :param tolerance: largest pointing error in degrees that counts as converged
+        :param samples: consecutive control iterations the error must stay within tolerance
+        :param timeout_ms: reports settled=False if the platform has not converged by then
+        :return:
+        """
+        raise NotImplementedError()
+
     def auto_calibrate_accelerometer(self):
         """
         Uses the servos to calibrate the accelerometer
@@ -1,17 +1,14 @@
 import random
 import time
-import machine
 from controller.controller import PlatformController
-from config.config import Config
+from scheduler.scheduler import shared_scheduler, PRIORITY_BACKGROUND
 
 class GPSLocationController(PlatformController):
 
-    def __init__(self, gps_controller):
-        self.timer_id = Config('antenny').get('gps_timer_id')
-        print("GPS-UART controller using timer hardware id: %d" % (self.timer_id))
-        self.gps_loop_timer = machine.Timer(self.timer_id) #hardcoded 2. need to fix
+    def __init__(self, gps_controller, period: int = 50, clock=None):
         self.gps_controller = gps_controller
-        self.loop_frequency = 200
+        self.loop_frequency = period
+        self.clock = clock
         
     def start(self):
         self.start_loop()
@@ -21,19 +18,19 @@ class GPSLocationController(PlatformController):
 
     def start_loop(self):
         """
-        Initializes the GPS timer interrupt
+        Schedules GPS polling
         :return:
         """
-        self.gps_loop_timer.init(period=self.loop_frequency, mode=machine.Timer.PERIODIC, \
-                                 callback=lambda a: self._gps_loop())
+        shared_scheduler().add("gps", self._gps_loop, self.loop_frequency, PRIORITY_BACKGROUND)
 
     def stop_loop(self):
         """
-        Stops the PID timer
+        Stops GPS polling
         :return:
         """
-        self.gps_loop_timer.deinit()
+        shared_scheduler().remove("gps")
 
     def _gps_loop(self):
-        self.gps_controller._update_gps_single()
+        if self.gps_controller.update() and self.clock is not None:
+            self.clock.update_gps()
     
@@ -63,6 +63,17 @@ class MockPlatformController(PlatformController):
         """
         pass
 
+    def watch_settle(self, callback, tolerance: float = 1.0, samples: int = 5, timeout_ms: int = 10000):
+        """
+        Reports when the platform has converged on the current setpoint
+        :param callback: called as callback(settled, settle_ms, azimuth_error, elevation_error)
+        :param tolerance:
+        :param samples:
+        :param timeout_ms:
+        :return:
+        """
+        callback(True, 0, 0, 0)
+
     def auto_calibrate_accelerometer(self):
         """
         Uses the servos to calibrate the accelerometer
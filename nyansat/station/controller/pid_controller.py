@@ -1,11 +1,15 @@
 import random
 import time
-import machine
+from utime import ticks_ms, ticks_diff
 from simple_pid.PID import PID
 from controller.controller import PlatformController
 from imu.imu import ImuController
 from motor.motor import ServoController
-from config.config import Config
+from scheduler.scheduler import shared_scheduler, PRIORITY_CONTROL
+from profiler.profiler import profile, section
+
+_IMU_READ = section("imu_read")
+_SERVO_WRITE = section("servo_write")
 
 class PIDPlatformController(PlatformController):
     """
@@ -29,13 +33,14 @@ class PIDPlatformController(PlatformController):
         self._motion_started = False
         self.pin_interrupt = True
         self.deadzone = None
-        self.timer_id = Config('antenny').get('pid_timer_id')
-        print("PID controller using timer hardware id: %d" % (self.timer_id))
-        self.pid_loop_timer = machine.Timer(self.timer_id)
         self.elevation.set_position(int((self.elevation.get_max_position() - self.elevation.get_min_position()) / 2))
         self.azimuth.set_position(int((self.azimuth.get_max_position() - self.azimuth.get_min_position()) / 2))
         self.new_elevation = 0
         self.new_azimuth = 0
+        self.last_elevation = None
+        self.last_azimuth = None
+        # ticks_ms of the latest IMU reading, so readers of last_* can tell a stalled IMU
+        self.last_reading_ms = None
         self.pid_output_limits = pid_output_limits
         self.pid_frequency = pid_frequency
         self.p = p
@@ -43,6 +48,12 @@ class PIDPlatformController(PlatformController):
         self.d = d
         self.elevation_pid = None
         self.azimuth_pid = None
+        self._settle_callback = None
+        self._settle_tolerance = 0
+        self._settle_samples = 0
+        self._settle_timeout_ms = 0
+        self._settle_started = 0
+        self._settle_count = 0
         self.init_pid()
 
     def init_pid(self):
@@ -107,21 +118,21 @@ class PIDPlatformController(PlatformController):
 
     def start_pid_loop(self):
         """
-        Initializes the PID timer interrupt
+        Schedules the PID loop
         :return:
         """
         self.new_elevation = self.imu.get_elevation()
         self.new_azimuth = self.imu.get_azimuth()
         self.azimuth_pid.setpoint = self.new_azimuth
         self.elevation_pid.setpoint = self.new_elevation
-        self.pid_loop_timer.init(period=self.pid_frequency, mode=machine.Timer.PERIODIC, callback=self.__pid_loop)
+        shared_scheduler().add("pid", lambda: self.__pid_loop(None), self.pid_frequency, PRIORITY_CONTROL)
 
     def stop_pid_loop(self):
         """
-        Stops the PID timer
+        Stops the PID loop
         :return:
         """
-        self.pid_loop_timer.deinit()
+        shared_scheduler().remove("pid")
 
     def set_coordinates(self, azimuth, elevation):
         """
@@ -134,6 +145,7 @@ class PIDPlatformController(PlatformController):
         self.set_elevation(elevation)
         self.set_azimuth(azimuth)
 
+    @profile("pid_loop")
     def __pid_loop(self, timer):
         """
         PID ISR
@@ -141,12 +153,19 @@ class PIDPlatformController(PlatformController):
         """
         self.elevation_pid.setpoint = self.new_elevation
         self.azimuth_pid.setpoint = self.new_azimuth
-        _elevation = self.get_elevation()
-        _azimuth = self.get_azimuth()
+        with _IMU_READ:
+            _elevation = self.get_elevation()
+            _azimuth = self.get_azimuth()
+        self.last_elevation = _elevation
+        self.last_azimuth = _azimuth
+        self.last_reading_ms = ticks_ms()
+        if self._settle_callback is not None:
+            self._check_settle(_azimuth, _elevation)
         el_duty = int(self.elevation_pid(_elevation))
         az_duty = int(self.azimuth_pid(_azimuth)) * -1
-        self.elevation.step(el_duty)
-        self.azimuth.step(az_duty)
+        with _SERVO_WRITE:
+            self.elevation.step(el_duty)
+            self.azimuth.step(az_duty)
         # print("""
         # azimuth: {}
         # azimuth_duty: {}
@@ -154,6 +173,36 @@ class PIDPlatformController(PlatformController):
         # elevation_duty: {}
         # """.format(_azimuth, az_duty, _elevation, el_duty))
 
+    def watch_settle(self, callback, tolerance: float = 1.0, samples: int = 5, timeout_ms: int = 10000):
+        """
+        Reports when the platform has converged on the current setpoint
+        :param callback: called from the PID loop as callback(settled, settle_ms, azimuth_error, elevation_error)
+        :param tolerance: largest pointing error in degrees that counts as converged
+        :param samples: consecutive PID iterations the error must stay within tolerance
+        :param timeout_ms: reports settled=False if the platform has not converged by then
+        :return:
+        """
+        self._settle_tolerance = tolerance
+        self._settle_samples = samples
+        self._settle_timeout_ms = timeout_ms
+        self._settle_started = ticks_ms()
+        self._settle_count = 0
+        self._settle_callback = callback
+
+    def _check_settle(self, azimuth, elevation):
+        azimuth_error = self.get_delta(azimuth, self.new_azimuth)
+        elevation_error = abs(elevation - self.new_elevation)
+        elapsed = ticks_diff(ticks_ms(), self._settle_started)
+        if azimuth_error <= self._settle_tolerance and elevation_error <= self._settle_tolerance:
+            self._settle_count += 1
+        else:
+            self._settle_count = 0
+        settled = self._settle_count >= self._settle_samples
+        if settled or elapsed >= self._settle_timeout_ms:
+            callback = self._settle_callback
+            self._settle_callback = None
+            callback(settled, elapsed, azimuth_error, elevation_error)
+
     def auto_calibrate_accelerometer(self):
         """
         Uses the servos to calibrate the accelerometer
@@ -6,25 +6,46 @@ from ssd1306 import SSD1306_I2C
 import machine
 
 from screen.screen import ScreenController
-from config.config import Config
+from scheduler.scheduler import shared_scheduler, PRIORITY_DISPLAY
 
 MAX_CHAR_LINES = 4
 MAX_CHAR_WIDTH = 16
+CHAR_HEIGHT = 8
+
+# SSD1306 horizontal addressing commands, see datasheet section 10.1
+SET_COL_ADDR = 0x21
+SET_PAGE_ADDR = 0x22
+
+# One string per ASCII code, built once so drawing a character never allocates
+_GLYPHS = tuple(chr(code) for code in range(128))
+_UNKNOWN_CHAR = 0xFF
+
 
 class Ssd1306ScreenController(ScreenController):
     """Controller for SSD1306 OLED screen display."""
 
-    def __init__(self, i2c: machine.I2C, width: int = 128, height: int = 32):
+    def __init__(self, i2c: machine.I2C, width: int = 128, height: int = 32, period: int = 100):
         """Initialize the SSD1306 screen with a given width, height, and I2C
         connection.
         """
         self.ssd_screen = SSD1306_I2C(width, height, i2c)
-        self._line_buffers = ['a: ', 'b: ', 'c: ', 'd: ']
-        self.timer_id = Config('antenny').get('screen_timer_id')
-        print("Screen controller using timer hardware id: %d" % (self.timer_id))
-        self.screen_loop_timer = machine.Timer(self.timer_id) #hardcoded 2. need to fix
-        self.loop_frequency = 1000
-        
+        self.width = width
+        self.num_lines = min(MAX_CHAR_LINES, height // CHAR_HEIGHT)
+        self._line_buffers = ['a: ', 'b: ', 'c: ', 'd: '][:self.num_lines]
+        self._dirty_lines = [True] * self.num_lines
+        self._dirty_pages = [True] * self.num_lines
+        self._dirty = True
+        # Characters currently drawn by update_line_bytes, per line
+        self._line_chars = [bytearray(_UNKNOWN_CHAR for _ in range(MAX_CHAR_WIDTH)) for _ in range(self.num_lines)]
+        self._dashboard = None
+        # Copy of the display RAM as last transmitted, pages are diffed against it
+        self._sent_buffer = bytearray(len(self.ssd_screen.buffer))
+        self._frame_view = memoryview(self.ssd_screen.buffer)
+        self._page_command = bytearray(1)
+        self.loop_frequency = period
+        self.frames_sent = 0
+        self.frames_skipped = 0
+
     def start(self):
         self.start_loop()
 
@@ -33,42 +54,147 @@ class Ssd1306ScreenController(ScreenController):
 
     def start_loop(self):
         """
-        Initializes the screen timer interrupt
+        Schedules the screen refresh
         :return:
         """
-        self.screen_loop_timer.init(period=self.loop_frequency, mode=machine.Timer.PERIODIC, \
-                                 callback=lambda a: self.update())
+        shared_scheduler().add("screen", self.update, self.loop_frequency, PRIORITY_DISPLAY)
 
     def stop_loop(self):
         """
-        Stops the PID timer
+        Stops the screen refresh
         :return:
         """
-        self.screen_loop_timer.deinit()
-
+        shared_scheduler().remove("screen")
 
     def update_line(self, str_data, line_num):
         line_num = abs(line_num)
-        assert line_num < MAX_CHAR_LINES
+        assert line_num < self.num_lines
         str_data = str_data[0:MAX_CHAR_WIDTH]
+        if str_data == self._line_buffers[line_num]:
+            return
         self._line_buffers[line_num] = str_data
-        
+        self._dirty_lines[line_num] = True
+        self._dirty_pages[line_num] = True
+        self._dirty = True
+
+    def update_line_bytes(self, char_data, line_num):
+        """
+        Draws a line from a buffer of ASCII codes, only the characters that changed are redrawn
+        :param char_data: bytes or bytearray, at most MAX_CHAR_WIDTH long
+        :param line_num:
+        :return:
+        """
+        drawn = self._line_chars[line_num]
+        y = line_num * CHAR_HEIGHT
+        changed = False
+        for i in range(min(len(char_data), MAX_CHAR_WIDTH)):
+            code = char_data[i]
+            if code == drawn[i]:
+                continue
+            drawn[i] = code
+            x = i * CHAR_HEIGHT
+            self.ssd_screen.fill_rect(x, y, CHAR_HEIGHT, CHAR_HEIGHT, 0)
+            if code < 128:
+                self.ssd_screen.text(_GLYPHS[code], x, y)
+            changed = True
+        if changed:
+            # The line is no longer described by a string, drop any pending string redraw
+            self._line_buffers[line_num] = None
+            self._dirty_lines[line_num] = False
+            self._dirty_pages[line_num] = True
+            self._dirty = True
+
+    def set_dashboard(self, dashboard):
+        """
+        Renders a ScreenDashboard on every refresh
+        :param dashboard: screen.screen_pages.ScreenDashboard
+        :return:
+        """
+        self._dashboard = dashboard
+
     def update(self):
+        """
+        Renders the changed lines and transmits only the columns that differ from the display RAM
+        :return:
+        """
+        if self._dashboard is not None:
+            self._dashboard.tick()
+        if not self._dirty:
+            self.frames_skipped += 1
+            return
+        self._dirty = False
+        sent = False
+        for line_num in range(self.num_lines):
+            if self._dirty_lines[line_num]:
+                self._dirty_lines[line_num] = False
+                y = line_num * CHAR_HEIGHT
+                self.ssd_screen.fill_rect(0, y, self.width, CHAR_HEIGHT, 0)
+                self.ssd_screen.text(self._line_buffers[line_num], 0, y)
+                drawn = self._line_chars[line_num]
+                for i in range(MAX_CHAR_WIDTH):
+                    drawn[i] = _UNKNOWN_CHAR
+            if self._dirty_pages[line_num]:
+                self._dirty_pages[line_num] = False
+                sent = self._send_page(line_num) or sent
+        if sent:
+            self.frames_sent += 1
+        else:
+            self.frames_skipped += 1
+
+    def _send_page(self, page):
+        """
+        Transmits the changed column range of a single page
+        :param page: page index, one 8 pixel tall text line
+        :return: True if anything was transmitted
+        """
+        width = self.width
+        start = page * width
+        end = start + width
+        frame = self.ssd_screen.buffer
+        sent = self._sent_buffer
+        first = start
+        while first < end and frame[first] == sent[first]:
+            first += 1
+        if first == end:
+            return False
+        last = end - 1
+        while frame[last] == sent[last]:
+            last -= 1
+        write_cmd = self.ssd_screen.write_cmd
+        write_cmd(SET_COL_ADDR)
+        write_cmd(first - start)
+        write_cmd(last - start)
+        write_cmd(SET_PAGE_ADDR)
+        write_cmd(page)
+        write_cmd(page)
+        self.ssd_screen.write_data(self._frame_view[first:last + 1])
+        sent[first:last + 1] = self._frame_view[first:last + 1]
+        return True
+
+    def refresh(self):
+        """
+        Redraws and transmits the whole display
+        :return:
+        """
+        for line_num in range(self.num_lines):
+            if self._line_buffers[line_num] is None:
+                self._line_buffers[line_num] = ''
+            self._dirty_lines[line_num] = True
+            self._dirty_pages[line_num] = True
         self.ssd_screen.fill(0)
-        self.ssd_screen.text(self._line_buffers[0], 0, 0)
-        self.ssd_screen.text(self._line_buffers[1], 0, 8)
-        self.ssd_screen.text(self._line_buffers[2], 0, 16)
-        self.ssd_screen.text(self._line_buffers[3], 0, 24)
         self.ssd_screen.show()
-        
+        self._sent_buffer[:] = self.ssd_screen.buffer
+        self._dirty = True
+        self.update()
+
     def display(self, data) -> None:
         """Display a 3-tuple of numeric data, e.g. a tuple of Euler headings"""
         if len(data) != 3:
             raise ValueError("SSD1306 screen only configured to accept 3 numbers.")
 
-        self.ssd_screen.fill(0)
-        self.ssd_screen.text("{:08.3f}".format(data[0]), 0, 0)
-        self.ssd_screen.text("{:08.3f}".format(data[1]), 0, 8)
-        self.ssd_screen.text("{:08.3f}".format(data[2]), 0, 16)
-        self.ssd_screen.show()
-
+        self.update_line("{:08.3f}".format(data[0]), 0)
+        self.update_line("{:08.3f}".format(data[1]), 1)
+        self.update_line("{:08.3f}".format(data[2]), 2)
+        for line_num in range(3, self.num_lines):
+            self.update_line("", line_num)
+        self.update()
@@ -16,5 +16,8 @@ class GPSController(object):
     def run(self):
         raise NotImplementedError()
 
+    def update(self):
+        raise NotImplementedError()
+
     def get_status(self):
         raise NotImplementedError
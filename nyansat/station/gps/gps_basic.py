@@ -1,66 +1,68 @@
 import machine
 import time
 
-from micropyGPS import MicropyGPS
-
 from gps.gps import GPSController, GPSStatus
+from profiler.profiler import profile
+from gps.nmea import (
+    NmeaParser, new_fix, FIX_VALID, FIX_LATITUDE, FIX_LONGITUDE, FIX_ALTITUDE, FIX_SPEED, FIX_COURSE, FIX_TIME,
+)
+
+_RX_BUFFER_SIZE = 128
+_UART_RX_BUFFER_SIZE = 1024
 
 
 class BasicGPSController(GPSController):
-    def __init__(self, tx, rx):
+    def __init__(self, tx, rx, baudrate: int = 9600):
         #hardcoded 2, please fix
-        self._gps_uart = machine.UART(2, 9600, rx=rx, tx=tx,
-                                      timeout=10)
-        self._gps_uart.init()
-        self._gps = MicropyGPS()
-        self._model = None
-        
+        self._gps_uart = machine.UART(2, baudrate, rx=rx, tx=tx, timeout=0, rxbuf=_UART_RX_BUFFER_SIZE)
+        self._rx_buffer = bytearray(_RX_BUFFER_SIZE)
+        self._parser = NmeaParser()
+        self._fix = new_fix()
+        # Refreshed in place by get_status, callers read it right away rather than keeping it
+        self._model = GPSStatus(False, 0., 0., 0., 0., 0., 0.)
+
     def run(self):
-        # TODO: Why do we need to constantly update the GPS values here?
         while True:
             try:
-                self._update_gps()
+                self.update()
             except Exception as e:
                 print(e)
-            time.sleep(1)
+            time.sleep(0.05)
 
     def get_status(self) -> GPSStatus:
-        self._model = GPSStatus(
-            self._gps.valid,
-            self._gps.latitude,
-            self._gps.longitude,
-            self._gps.altitude,
-            self._gps.speed,
-            self._gps.course,
-            self._gps.timestamp,
-        )
-        return self._model
+        fix = self._fix
+        self._parser.read_fix(fix)
+        model = self._model
+        model.valid = bool(fix[FIX_VALID])
+        model.latitude = fix[FIX_LATITUDE] / 1000000
+        model.longitude = fix[FIX_LONGITUDE] / 1000000
+        model.altitude = fix[FIX_ALTITUDE] / 100
+        model.speed = fix[FIX_SPEED] / 1000
+        model.course = fix[FIX_COURSE] / 100
+        model.timestamp = fix[FIX_TIME] / 1000
+        return model
 
-    def _update_gps_single(self):
-        g_sentence = self._gps_uart.readline()
-        if g_sentence:
-            g_sentence = g_sentence.decode("ascii")
-            #print(g_sentence)
-            for g_word in g_sentence:
-                self._gps.update(g_word)
-            
-    def _update_gps(self):
-        print("Starting update GPS")
-        g_sentence = self._gps_uart.readline()
-        while True:
-            while g_sentence:
-                print(g_sentence)
-                g_sentence = g_sentence.decode("ascii")
-                for g_word in g_sentence:
-                    self._gps.update(g_word)
-                self._model = GPSStatus(
-                    self._gps.valid,
-                    self._gps.latitude,
-                    self._gps.longitude,
-                    self._gps.altitude,
-                    self._gps.speed,
-                    self._gps.course,
-                    self._gps.timestamp,
-                )
-                g_sentence = self._gps_uart.readline()
-            time.sleep(1)
+    def get_parser(self) -> NmeaParser:
+        """
+        Gets the NMEA parser holding the latest published fix
+        :return:
+        """
+        return self._parser
+
+    @profile("gps_parse")
+    def update(self):
+        """
+        Drains everything the UART has received and feeds it to the NMEA parser
+        :return: number of fixes published
+        """
+        uart = self._gps_uart
+        rx_buffer = self._rx_buffer
+        published = 0
+        available = uart.any()
+        while available:
+            read = uart.readinto(rx_buffer, min(available, _RX_BUFFER_SIZE))
+            if not read:
+                break
+            published += self._parser.feed(rx_buffer, read)
+            available = uart.any()
+        return published
@@ -8,6 +8,9 @@ class MockGPSController(GPSController):
     def run(self):
         pass
 
+    def update(self):
+        return 0
+
     def get_status(self):
         return GPSStatus(
                 valid=True,
@@ -0,0 +1,320 @@
+from array import array
+
+try:
+    from utime import ticks_us
+except ImportError:
+    import time
+
+    def ticks_us():
+        return int(time.monotonic() * 1000000) & 0x3FFFFFFF
+
+# Indexes into a fix array. Everything is kept as fixed point integers so that
+# parsing a sentence never allocates a float on the heap.
+FIX_VALID = 0
+FIX_LATITUDE = 1  # microdegrees, north positive
+FIX_LONGITUDE = 2  # microdegrees, east positive
+FIX_ALTITUDE = 3  # centimeters above mean sea level
+FIX_SPEED = 4  # thousandths of a knot
+FIX_COURSE = 5  # hundredths of a degree
+FIX_TIME = 6  # UTC milliseconds since midnight
+FIX_DATE = 7  # UTC date as ddmmyy
+FIX_SATELLITES = 8
+FIX_TICKS_US = 9  # ticks_us() when the first byte of the sentence was received
+FIX_LENGTH = 10
+
+_MAX_SENTENCE_LENGTH = 96  # NMEA 0183 limits sentences to 82 characters
+_MAX_FIELDS = 20
+
+_DOLLAR = 0x24
+_STAR = 0x2A
+_COMMA = 0x2C
+_DOT = 0x2E
+_MINUS = 0x2D
+_CR = 0x0D
+_LF = 0x0A
+_ZERO = 0x30
+_CHAR_A = 0x41
+_CHAR_C = 0x43
+_CHAR_G = 0x47
+_CHAR_M = 0x4D
+_CHAR_R = 0x52
+_CHAR_S = 0x53
+_CHAR_W = 0x57
+
+
+def new_fix():
+    """
+    Creates an empty fix array to be filled by NmeaParser.read_fix
+    :return:
+    """
+    return array('i', [0] * FIX_LENGTH)
+
+
+class NmeaParser(object):
+    """
+    Incremental NMEA 0183 parser for the GGA and RMC sentences. Bytes are fed
+    in as they are read from the UART, every other sentence type is dropped
+    without being decoded. Completed fixes are published with a sequence
+    counter so a reader never sees a half-written fix.
+    """
+
+    def __init__(self):
+        self._sentence = bytearray(_MAX_SENTENCE_LENGTH)
+        self._length = 0
+        self._in_sentence = False
+        self._sentence_ticks_us = 0
+        self._fields = [0] * (_MAX_FIELDS + 1)
+        self._field_count = 0
+        self._fix = new_fix()
+        self._published = new_fix()
+        self._sequence = 0
+        self.sentence_count = 0
+        self.checksum_errors = 0
+
+    def feed(self, buf, length: int):
+        """
+        Feeds received bytes to the parser
+        :param buf: buffer holding the received bytes
+        :param length: number of valid bytes in buf
+        :return: number of fixes published
+        """
+        published = 0
+        sentence = self._sentence
+        for i in range(length):
+            byte = buf[i]
+            if byte == _DOLLAR:
+                self._in_sentence = True
+                self._length = 0
+                self._sentence_ticks_us = ticks_us()
+            elif not self._in_sentence:
+                continue
+            elif byte == _CR or byte == _LF:
+                self._in_sentence = False
+                if self._parse_sentence():
+                    published += 1
+            elif self._length >= _MAX_SENTENCE_LENGTH:
+                self._in_sentence = False
+            else:
+                sentence[self._length] = byte
+                self._length += 1
+        return published
+
+    def read_fix(self, fix) -> int:
+        """
+        Copies the most recently published fix
+        :param fix: an array created by new_fix()
+        :return: the sequence number of the fix, 0 if nothing was published yet
+        """
+        published = self._published
+        while True:
+            sequence = self._sequence
+            if sequence & 1:
+                continue
+            for i in range(FIX_LENGTH):
+                fix[i] = published[i]
+            if sequence == self._sequence:
+                return sequence >> 1
+
+    def _publish(self):
+        """
+        Publishes the working fix
+        :return:
+        """
+        self._sequence += 1
+        published = self._published
+        fix = self._fix
+        for i in range(FIX_LENGTH):
+            published[i] = fix[i]
+        self._sequence += 1
+
+    def _parse_sentence(self):
+        """
+        Validates the buffered sentence and decodes it if it is a GGA or RMC sentence
+        :return: True if a fix was published
+        """
+        sentence = self._sentence
+        length = self._length
+        # Shortest useful sentence is "GPxxx,*hh"
+        if length < 9 or sentence[length - 3] != _STAR:
+            return False
+        checksum = 0
+        for i in range(length - 3):
+            checksum ^= sentence[i]
+        if checksum != (self._hex(sentence[length - 2]) << 4 | self._hex(sentence[length - 1])):
+            self.checksum_errors += 1
+            return False
+        self.sentence_count += 1
+        self._split_fields(length - 3)
+        if sentence[2] == _CHAR_G and sentence[3] == _CHAR_G and sentence[4] == _CHAR_A:
+            self._parse_gga()
+        elif sentence[2] == _CHAR_R and sentence[3] == _CHAR_M and sentence[4] == _CHAR_C:
+            self._parse_rmc()
+        else:
+            return False
+        self._fix[FIX_TICKS_US] = self._sentence_ticks_us
+        self._publish()
+        return True
+
+    def _split_fields(self, end: int):
+        """
+        Records the start offset of each comma separated field, field 0 is the sentence id
+        :param end:
+        :return:
+        """
+        fields = self._fields
+        count = 0
+        fields[0] = 0
+        for i in range(end):
+            if self._sentence[i] == _COMMA and count < _MAX_FIELDS - 1:
+                count += 1
+                fields[count] = i + 1
+        fields[count + 1] = end + 1
+        self._field_count = count + 1
+
+    def _field_start(self, index: int):
+        return self._fields[index]
+
+    def _field_end(self, index: int):
+        return self._fields[index + 1] - 1
+
+    def _field_empty(self, index: int):
+        return index >= self._field_count or self._field_start(index) >= self._field_end(index)
+
+    def _field_char(self, index: int):
+        if self._field_empty(index):
+            return 0
+        return self._sentence[self._field_start(index)]
+
+    def _parse_gga(self):
+        """
+        $--GGA,hhmmss.ss,llll.ll,a,yyyyy.yy,a,q,nn,h.h,a.a,M,...
+        :return:
+        """
+        fix = self._fix
+        quality = self._parse_int(6)
+        fix[FIX_VALID] = 1 if quality > 0 else 0
+        if self._field_empty(1):
+            return
+        fix[FIX_TIME] = self._parse_time(1)
+        if quality > 0:
+            fix[FIX_LATITUDE] = self._parse_coordinate(2, 3)
+            fix[FIX_LONGITUDE] = self._parse_coordinate(4, 5)
+            fix[FIX_ALTITUDE] = self._parse_fixed(9, 2)
+        fix[FIX_SATELLITES] = self._parse_int(7)
+
+    def _parse_rmc(self):
+        """
+        $--RMC,hhmmss.ss,A,llll.ll,a,yyyyy.yy,a,x.x,x.x,ddmmyy,...
+        :return:
+        """
+        fix = self._fix
+        valid = self._field_char(2) == _CHAR_A
+        fix[FIX_VALID] = 1 if valid else 0
+        if not self._field_empty(1):
+            fix[FIX_TIME] = self._parse_time(1)
+        if not self._field_empty(9):
+            fix[FIX_DATE] = self._parse_int(9)
+        if valid:
+            fix[FIX_LATITUDE] = self._parse_coordinate(3, 4)
+            fix[FIX_LONGITUDE] = self._parse_coordinate(5, 6)
+            fix[FIX_SPEED] = self._parse_fixed(7, 3)
+            fix[FIX_COURSE] = self._parse_fixed(8, 2)
+
+    @staticmethod
+    def _hex(byte: int):
+        if byte >= _CHAR_A:
+            return (byte & 0xDF) - _CHAR_A + 10
+        return byte - _ZERO
+
+    def _parse_int(self, index: int):
+        """
+        Parses the integer part of a field
+        :param index:
+        :return:
+        """
+        if self._field_empty(index):
+            return 0
+        return self._parse_digits(self._field_start(index), self._field_end(index))
+
+    def _parse_digits(self, start: int, end: int):
+        """
+        Parses unsigned digits up to the end of the field or the first non-digit
+        :param start:
+        :param end:
+        :return:
+        """
+        sentence = self._sentence
+        value = 0
+        for i in range(start, end):
+            byte = sentence[i] - _ZERO
+            if byte < 0 or byte > 9:
+                break
+            value = value * 10 + byte
+        return value
+
+    def _parse_fraction(self, index: int, digits: int):
+        """
+        Parses the fractional part of a field, scaled to the given number of digits
+        :param index:
+        :param digits:
+        :return:
+        """
+        if self._field_empty(index):
+            return 0
+        sentence = self._sentence
+        end = self._field_end(index)
+        i = self._field_start(index)
+        while i < end and sentence[i] != _DOT:
+            i += 1
+        i += 1
+        value = 0
+        for _ in range(digits):
+            value *= 10
+            if i < end:
+                value += sentence[i] - _ZERO
+                i += 1
+        return value
+
+    def _parse_fixed(self, index: int, digits: int):
+        """
+        Parses a signed decimal field to a fixed point integer
+        :param index:
+        :param digits: number of decimal digits to keep
+        :return:
+        """
+        if self._field_empty(index):
+            return 0
+        start = self._field_start(index)
+        negative = self._sentence[start] == _MINUS
+        value = self._parse_digits(start + 1 if negative else start, self._field_end(index))
+        for _ in range(digits):
+            value *= 10
+        value += self._parse_fraction(index, digits)
+        if negative:
+            return -value
+        return value
+
+    def _parse_time(self, index: int):
+        """
+        Parses hhmmss.sss to milliseconds since midnight
+        :param index:
+        :return:
+        """
+        hhmmss = self._parse_int(index)
+        seconds = (hhmmss // 10000) * 3600 + ((hhmmss // 100) % 100) * 60 + hhmmss % 100
+        return seconds * 1000 + self._parse_fraction(index, 3)
+
+    def _parse_coordinate(self, index: int, hemisphere_index: int):
+        """
+        Parses a (d)ddmm.mmmm coordinate to signed microdegrees
+        :param index:
+        :param hemisphere_index:
+        :return:
+        """
+        dddmm = self._parse_int(index)
+        minutes = (dddmm % 100) * 100000 + self._parse_fraction(index, 5)
+        microdegrees = (dddmm // 100) * 1000000 + minutes * 10 // 60
+        hemisphere = self._field_char(hemisphere_index)
+        if hemisphere == _CHAR_S or hemisphere == _CHAR_W:
+            return -microdegrees
+        return microdegrees
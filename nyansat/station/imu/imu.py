@@ -161,3 +161,18 @@ class ImuController(object):
         :return:
         """
         raise NotImplementedError()
+
+    def set_calibration_profile(self, profile):
+        """
+        Sets the full calibration profile to be uploaded to the device
+        :param profile:
+        :return:
+        """
+        raise NotImplementedError()
+
+    def get_calibration_profile(self):
+        """
+        Gets the full calibration profile
+        :return:
+        """
+        raise NotImplementedError()
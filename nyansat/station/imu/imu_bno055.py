@@ -1,7 +1,15 @@
 from bno055 import BNO055, CONFIG_MODE, NDOF_MODE
 import machine
+
+from exceptions import AntennyIMUException
 from imu.imu import ImuController
 
+# Registers 0x55 through 0x6A are used for storing calibration data, which
+# includes sensor and offset data for each sensor. Address reference can be
+# found in BNO055 datasheet, section 4.3 "Register Description"
+CALIBRATION_REGISTER_START = 0x55
+CALIBRATION_PROFILE_LENGTH = 22
+
 
 class Bno055ImuController(ImuController):
     """Controller for the Bosch BNO055 orientation sensor for antenny. This
@@ -9,9 +17,8 @@ class Bno055ImuController(ImuController):
     accelerometer, magnetometer, and temperature data.
     """
 
-    # Registers 0x55 through 0x6A are used for storing calibration data, which
-    # includes sensor and offset data for each sensor. Address reference can be
-    # found in BNO055 datasheet, section 4.3 "Register Description"
+    # Named views into the calibration profile, kept for the per-sensor API and
+    # for migrating configs saved before the profile was stored as one blob
     ACCELEROMETER_CALIBRATION_REGISTERS = {
         "acc_offset_x_lsb": 0x55,
         "acc_offset_x_msb": 0x56,
@@ -46,9 +53,9 @@ class Bno055ImuController(ImuController):
         object, I2C device address, and an orientation sign integer 3-tuple.
         """
         self.bno = BNO055(i2c, address=address, crystal=crystal, sign=sign)
-        self.accel_calibration: dict = {}
-        self.magnet_calibration: dict = {}
-        self.gyro_calibration: dict = {}
+        self._i2c = i2c
+        self._address = address
+        self.calibration = bytearray(CALIBRATION_PROFILE_LENGTH)
 
     def get_elevation(self):
         """
@@ -132,66 +139,66 @@ class Bno055ImuController(ImuController):
         Sets the accelerometer calibration values to what is on the device
         :return:
         """
-        self.accel_calibration = calibration
+        self._set_registers(calibration, self.ACCELEROMETER_CALIBRATION_REGISTERS)
 
     def get_accelerometer_calibration(self):
         """
         Gets the current calibration registers
         :return:
         """
-        return self.accel_calibration
+        return self._get_registers(self.ACCELEROMETER_CALIBRATION_REGISTERS)
 
     def save_accelerometer_calibration(self):
         """
         Downloads the calibration registers from the device
         :return:
         """
-        self.accel_calibration = self.get_calibration_profile(self.ACCELEROMETER_CALIBRATION_REGISTERS)
-        return self.accel_calibration
+        self.download_calibration_profile()
+        return self._get_registers(self.ACCELEROMETER_CALIBRATION_REGISTERS)
 
     def set_magnetometer_calibration(self, calibration):
         """
         Sets the magnetometer calibration values to what is on the device
         :return:
         """
-        self.magnet_calibration = calibration
+        self._set_registers(calibration, self.MAGNETOMETER_CALIBRATION_REGISTERS)
 
     def get_magnetometer_calibration(self):
         """
         Gets the current magnetometer calibration registers
         :return:
         """
-        return self.magnet_calibration
+        return self._get_registers(self.MAGNETOMETER_CALIBRATION_REGISTERS)
 
     def save_magnetometer_calibration(self):
         """
         Downloads the calibration registers from the device
         :return:
         """
-        self.magnet_calibration = self.get_calibration_profile(self.MAGNETOMETER_CALIBRATION_REGISTERS)
-        return self.magnet_calibration
+        self.download_calibration_profile()
+        return self._get_registers(self.MAGNETOMETER_CALIBRATION_REGISTERS)
 
     def set_gyroscope_calibration(self, calibration):
         """
         Sets the gyroscope config calibration values to what is on the device
         :return:
         """
-        self.gyro_calibration = calibration
+        self._set_registers(calibration, self.GYROSCOPE_CALIBRATION_REGISTERS)
 
     def get_gyroscope_calibration(self):
         """
         Gets the current gyroscope calibration registers
         :return:
         """
-        return self.gyro_calibration
+        return self._get_registers(self.GYROSCOPE_CALIBRATION_REGISTERS)
 
     def save_gyroscope_calibration(self):
         """
         Downloads the calibration registers from the device
         :return:
         """
-        self.gyro_calibration = self.get_calibration_profile(self.GYROSCOPE_CALIBRATION_REGISTERS)
-        return self.gyro_calibration
+        self.download_calibration_profile()
+        return self._get_registers(self.GYROSCOPE_CALIBRATION_REGISTERS)
 
     def calibrate_accelerometer(self):
         """
@@ -264,48 +271,85 @@ class Bno055ImuController(ImuController):
         self.bno.reset()  # reset will put the system into NDOF mode at the end
         self.bno.mode(old_mode)
 
-    def upload_calibration_profile(self) -> None:
+    def set_calibration_profile(self, profile):
         """
-        Uploads the current calibration profile to the device
+        Sets the full 22 byte calibration profile, uploaded with upload_calibration_profile
+        :param profile: bytes or list of ints in register order starting at 0x55
         :return:
         """
-        self._set_calibration_profile(
-            self.accel_calibration,
-            self.ACCELEROMETER_CALIBRATION_REGISTERS
-        )
-        self._set_calibration_profile(
-            self.gyro_calibration,
-            self.GYROSCOPE_CALIBRATION_REGISTERS
-        )
-        self._set_calibration_profile(
-            self.magnet_calibration,
-            self.MAGNETOMETER_CALIBRATION_REGISTERS
-        )
-
-    def get_calibration_profile(self, registers):
-        """
-        Receives the calibration registers from the device
-        :param registers:
+        if len(profile) != CALIBRATION_PROFILE_LENGTH:
+            raise AntennyIMUException("Calibration profile must be {} bytes, got {}".format(
+                CALIBRATION_PROFILE_LENGTH, len(profile)))
+        self.calibration[:] = bytes(profile)
+
+    def get_calibration_profile(self):
+        """
+        Gets the full calibration profile as a list of register values
+        :return:
+        """
+        return list(self.calibration)
+
+    def download_calibration_profile(self):
+        """
+        Reads the whole calibration profile from the device in a single I2C transaction
         :return:
         """
         # In order to read or write to the calibration registers, we have to
         # switch into the BNO's config mode, read/write, then switch out
         previous_mode = self.bno.mode(CONFIG_MODE)
-        result = {
-            register_name: self.bno._read(register_address)
+        try:
+            self._i2c.readfrom_mem_into(self._address, CALIBRATION_REGISTER_START, self.calibration)
+        finally:
+            self.bno.mode(previous_mode)
+        return self.get_calibration_profile()
+
+    def upload_calibration_profile(self) -> None:
+        """
+        Uploads the current calibration profile to the device in a single I2C transaction
+        :return:
+        """
+        old_mode = self.bno.mode(CONFIG_MODE)
+        try:
+            self._i2c.writeto_mem(self._address, CALIBRATION_REGISTER_START, self.calibration)
+        finally:
+            self.bno.mode(old_mode)
+
+    @classmethod
+    def calibration_profile_from_registers(cls, accelerometer: dict, magnetometer: dict, gyroscope: dict):
+        """
+        Builds a calibration profile from the legacy per-register config format
+        :param accelerometer:
+        :param magnetometer:
+        :param gyroscope:
+        :return: list of register values
+        """
+        profile = bytearray(CALIBRATION_PROFILE_LENGTH)
+        for calibration, registers in (
+                (accelerometer, cls.ACCELEROMETER_CALIBRATION_REGISTERS),
+                (magnetometer, cls.MAGNETOMETER_CALIBRATION_REGISTERS),
+                (gyroscope, cls.GYROSCOPE_CALIBRATION_REGISTERS),
+        ):
+            for register_name, register_address in registers.items():
+                profile[register_address - CALIBRATION_REGISTER_START] = calibration.get(register_name, 0)
+        return list(profile)
+
+    def _get_registers(self, registers):
+        """
+        Gets the named registers from the cached calibration profile
+        :param registers:
+        :return:
+        """
+        return {
+            register_name: self.calibration[register_address - CALIBRATION_REGISTER_START]
             for register_name, register_address in registers.items()
         }
-        self.bno.mode(previous_mode)
-        return result
 
-    def _set_calibration_profile(self, register_results, registers):
+    def _set_registers(self, register_results, registers):
         """
-        Sets the calibration registers on the device
+        Sets the named registers in the cached calibration profile
         :param register_results:
         :param registers:
         :return:
         """
-        old_mode = self.bno.mode(CONFIG_MODE)
         for register_name, register_address in registers.items():
-            self.bno._write(register_address, register_results[register_name])
-        self.bno.mode(old_mode)
+            self.calibration[register_address - CALIBRATION_REGISTER_START] = register_results[register_name]
@@ -236,3 +236,18 @@ class Bno08xImuController(ImuController):
         :return:
         """
         pass
+
+    def set_calibration_profile(self, profile):
+        """
+        Sets the full calibration profile to be uploaded to the device
+        :param profile:
+        :return:
+        """
+        pass
+
+    def get_calibration_profile(self):
+        """
+        Gets the full calibration profile
+        :return:
+        """
+        pass
@@ -3,7 +3,7 @@ import machine
 
 from adafruit_bno08x_rvc import BNO08x_RVC
 from imu.imu import ImuController
-from config.config import Config
+from scheduler.scheduler import shared_scheduler, PRIORITY_SENSOR
 
 _BNO08X_DEFAULT_ADDRESS = 0x4B
 
@@ -21,15 +21,12 @@ class Bno08xUARTImuController(ImuController):
         self._is_calibrated = True
         self.reset = reset
         self.euler = None
-        self.timer_id = Config('antenny').get('imu_timer_id')
-        print("IMU-UARTD controller using timer hardware id: %d" % (self.timer_id))
-        self.read_timer = machine.Timer(self.timer_id)
 
     def start(self):
-        self.read_timer.init(period=10, mode=machine.Timer.PERIODIC, callback=self.__collect_euler)
+        shared_scheduler().add("imu", lambda: self.__collect_euler(None), 10, PRIORITY_SENSOR)
 
     def stop(self):
-        self.read_timer.deinit()
+        shared_scheduler().remove("imu")
 
     def __collect_euler(self, timer):
         try:
@@ -219,3 +216,18 @@ class Bno08xUARTImuController(ImuController):
         :return:
         """
         pass
+
+    def set_calibration_profile(self, profile):
+        """
+        Sets the full calibration profile to be uploaded to the device
+        :param profile:
+        :return:
+        """
+        pass
+
+    def get_calibration_profile(self):
+        """
+        Gets the full calibration profile
+        :return:
+        """
+        pass
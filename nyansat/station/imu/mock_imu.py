@@ -161,3 +161,18 @@ class MockImuController(ImuController):
         as that used by save_calibration_profile.
         """
         pass
+
+    def set_calibration_profile(self, profile):
+        """
+        Sets the full calibration profile to be uploaded to the device
+        :param profile:
+        :return:
+        """
+        pass
+
+    def get_calibration_profile(self):
+        """
+        Gets the full calibration profile
+        :return:
+        """
+        pass
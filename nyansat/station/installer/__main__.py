@@ -14,6 +14,8 @@ from mp.mpfexp import RemoteIOError, ConError
 from mp.pyboard import PyboardError
 from typing import List
 
+from nyansat.host.device_sync import DeviceSync, collect_library_files, collect_station_files, plan_sync
+from nyansat.host.mpy_build import MpyCompiler, compile_files, shadowed_sources
 from nyansat.host.exceptions import AntennyFilesystemException, AntennyHardwareException, AntennyInstallationException
 from nyansat.host.mp_extensions import AntennyMpFileExplorer
 
@@ -25,6 +27,7 @@ REPO_NAME = 'antenny'
 UP_ONE_DIRECTORY = '..'
 cwd = os.getcwd()
 STATION_CODE_RELATIVE_PATH = os.path.join(cwd, 'nyansat/station')
+LIBRARY_RELATIVE_PATH = os.path.join(cwd, 'lib')
 
 
 PACKAGES_TO_INSTALL = [
@@ -377,6 +380,66 @@ class AntennyInstaller(object):
             return False
         return True
 
+    def sync(
+            self,
+            ignore_lib: bool = False,
+            ignore_configs: bool = False,
+            components: list = None,
+            verify: bool = False,
+            compiler: MpyCompiler = None,
+    ):
+        """
+        Incrementally update the antenny code on the device. Only new and changed files are uploaded, files the
+        installer put on the device that no longer exist on the host are deleted, everything else is left alone.
+        With a compiler, python modules are uploaded as .mpy bytecode and their sources are removed from the device.
+        """
+        start = time.time()
+        host_files = {}
+        if not ignore_lib:
+            host_files.update(collect_library_files(LIBRARY_RELATIVE_PATH, components=components))
+        host_files.update(collect_station_files(
+                STATION_CODE_RELATIVE_PATH, ignore_configs=ignore_configs, components=components))
+        if compiler is not None:
+            host_files = compile_files(host_files, compiler)
+        station_names = set(os.listdir(STATION_CODE_RELATIVE_PATH))
+
+        def in_scope(device_path: str) -> bool:
+            top_level = device_path.split('/')[1]
+            if ignore_configs and top_level == 'configs':
+                return False
+            if components is not None and top_level not in components:
+                return False
+            return not (ignore_lib and top_level not in station_names)
+
+        device_sync = DeviceSync(self._file_explorer)
+        manifest = device_sync.read_manifest()
+        if manifest is None or verify:
+            LOG.info("Hashing the files on the device")
+            try:
+                device_hashes = device_sync.hash_device_files()
+            except (PyboardError, ValueError):
+                LOG.error("Failed to hash the files on the device", exc_info=True)
+                raise AntennyHardwareException("Failed to hash the files on the device")
+        else:
+            device_hashes = manifest
+        managed_paths = dict(manifest or {})
+        if compiler is not None:
+            # A source left on the device would be imported instead of its compiled module
+            managed_paths.update(shadowed_sources(host_files, device_hashes))
+        plan = plan_sync(host_files, device_hashes, managed_paths=managed_paths, in_scope=in_scope)
+        LOG.info(f"{plan.unchanged} file(s) up to date, uploading {len(plan.upload)} and deleting "
+                 f"{len(plan.delete)}")
+        try:
+            device_sync.apply(plan)
+        except RemoteIOError:
+            LOG.error("Failed to sync files to the antenny board", exc_info=True)
+            raise AntennyFilesystemException("Failed to sync files to the antenny board")
+        except PyboardError:
+            LOG.error("A problem was detected with the antenny board while syncing files", exc_info=True)
+            raise AntennyHardwareException("A problem was detected with the antenny board while syncing files")
+        LOG.info(f"Sync finished in {time.time() - start:.1f}s")
+        return plan
+
     def install(
             self,
             package_install_retry: int = 3,
@@ -427,6 +490,32 @@ if __name__ == '__main__':
             action="store_true",
             help="Install only core antenny code, no libraries"
     )
+    parser.add_argument(
+            "-s",
+            "--sync",
+            action="store_true",
+            help="Only upload files that changed since the last installation or sync"
+    )
+    parser.add_argument(
+            "--ignore-configs",
+            action="store_true",
+            help="With --sync, leave the configs directory on the device untouched"
+    )
+    parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="With --sync, hash the files on the device instead of trusting its manifest"
+    )
+    parser.add_argument(
+            "--mpy",
+            action="store_true",
+            help="Sync, uploading python modules cross-compiled to .mpy bytecode"
+    )
+    parser.add_argument(
+            "--mpy-cross",
+            default=None,
+            help="mpy-cross compatible compiler to use, defaults to $MPY_CROSS or mpy-cross on the PATH"
+    )
     parser.add_argument(
             'serial_path',
             help='Path to the ESP serial device',
@@ -437,6 +526,16 @@ if __name__ == '__main__':
     installer = AntennyInstaller(args.serial_path)
     installer.connect()
     LOG.info("Connected, welcome to the Antenny installer!")
+    if args.sync or args.mpy:
+        compiler = MpyCompiler(args.mpy_cross) if args.mpy else None
+        installer.sync(
+                ignore_lib=args.core_install,
+                ignore_configs=args.ignore_configs,
+                verify=args.verify,
+                compiler=compiler,
+        )
+        LOG.info("Sync complete!")
+        sys.exit(0)
     fresh_install = input("Do you want to do an installation of all components and libraries?(Y/n)").strip().lower() \
                     in ('y', '')
     if fresh_install:
@@ -0,0 +1,147 @@
+"""
+Keeps MicroPython's stop-the-world garbage collection out of the control loop. Collections are
+run by the scheduler right after the PID job, where the whole PID period is left before the
+next control update. The automatic collection threshold only acts as a safety net: it is set a
+margin above the heap allocated between two scheduled collections, measured as the policy runs,
+so MicroPython only collects on its own when allocation outpaces the schedule. The duration of
+every scheduled collection is recorded.
+"""
+import gc
+from array import array
+
+try:
+    from utime import ticks_us, ticks_diff
+except ImportError:
+    import time
+
+    def ticks_us():
+        return time.monotonic_ns() // 1000
+
+    def ticks_diff(new, old):
+        return new - old
+
+from scheduler.scheduler import shared_scheduler, PRIORITY_IDLE
+
+DEFAULT_PERIOD_MS = 1000
+# Collections that land right after this job leave the longest quiet window
+DEFAULT_AFTER_JOB = "pid"
+_PAUSE_HISTORY = 16
+# Automatic collection threshold as a multiple of the most allocated in one period
+_THRESHOLD_MARGIN = 2
+_MIN_THRESHOLD = 4096
+
+
+class GcPolicy:
+    """
+    Scheduled collections and their pause statistics
+    """
+
+    def __init__(self, period_ms: int = DEFAULT_PERIOD_MS, threshold: int = None, after: str = DEFAULT_AFTER_JOB):
+        """
+        :param period_ms: time between scheduled collections
+        :param threshold: bytes allocated before MicroPython collects on its own, follows the measured
+        allocation per period by default, -1 leaves the firmware default
+        :param after: scheduler job the collections follow
+        """
+        self.period_ms = period_ms
+        self.threshold = threshold
+        self.after = after
+        self.installed = False
+        self.collections = 0
+        self.total_us = 0
+        self.max_us = 0
+        self.last_us = 0
+        self.free_after = 0
+        self.period_alloc = 0
+        self.max_period_alloc = 0
+        self._auto_threshold = threshold is None
+        self._alloc_after = 0
+        # Ring of the latest pauses, preallocated so recording one never allocates
+        self._history = array('l', [0] * _PAUSE_HISTORY)
+        self._history_index = 0
+
+    def install(self):
+        """
+        Sets the collection threshold and schedules the collections
+        :return:
+        """
+        # Start from a clean heap so the first period's allocation is measured from here
+        self.collect()
+        if hasattr(gc, "threshold") and self.threshold != -1:
+            threshold = self.threshold
+            if threshold is None:
+                # Nothing measured yet, a quarter of the free heap until the first period is known
+                threshold = gc.mem_free() // 4
+            gc.threshold(threshold)
+            self.threshold = threshold
+        shared_scheduler().add("gc", self.collect, self.period_ms, PRIORITY_IDLE, after=self.after)
+        self.installed = True
+
+    def uninstall(self):
+        shared_scheduler().remove("gc")
+        if hasattr(gc, "threshold"):
+            gc.threshold(-1)
+        self.installed = False
+
+    def collect(self):
+        """
+        Runs a collection and records its pause
+        :return: pause in microseconds
+        """
+        measure = hasattr(gc, "mem_alloc")
+        if measure and self.installed:
+            # An automatic collection within the period makes this an undercount, the margin covers it
+            self.period_alloc = max(gc.mem_alloc() - self._alloc_after, 0)
+            if self.period_alloc > self.max_period_alloc:
+                self.max_period_alloc = self.period_alloc
+                if self._auto_threshold and hasattr(gc, "threshold"):
+                    self.threshold = max(self.max_period_alloc * _THRESHOLD_MARGIN, _MIN_THRESHOLD)
+                    gc.threshold(self.threshold)
+        start = ticks_us()
+        gc.collect()
+        pause = ticks_diff(ticks_us(), start)
+        self.collections += 1
+        self.total_us += pause
+        self.last_us = pause
+        if pause > self.max_us:
+            self.max_us = pause
+        self._history[self._history_index] = pause
+        self._history_index = (self._history_index + 1) % _PAUSE_HISTORY
+        if hasattr(gc, "mem_free"):
+            self.free_after = gc.mem_free()
+        if measure:
+            self._alloc_after = gc.mem_alloc()
+        return pause
+
+    def recent_pauses(self):
+        """
+        :return: the latest pauses in microseconds, oldest first
+        """
+        count = min(self.collections, _PAUSE_HISTORY)
+        start = (self._history_index - count) % _PAUSE_HISTORY
+        return [self._history[(start + i) % _PAUSE_HISTORY] for i in range(count)]
+
+    def reset_stats(self):
+        self.collections = 0
+        self.total_us = 0
+        self.max_us = 0
+        self.last_us = 0
+        self._history_index = 0
+
+    def report(self):
+        """
+        :return: dictionary with the collection count and pause statistics
+        """
+        return {
+            "installed": self.installed,
+            "period_ms": self.period_ms,
+            "threshold": self.threshold,
+            "period_alloc": self.period_alloc,
+            "max_period_alloc": self.max_period_alloc,
+            "collections": self.collections,
+            "avg_pause_us": self.total_us // self.collections if self.collections else 0,
+            "max_pause_us": self.max_us,
+            "last_pause_us": self.last_us,
+            "recent_pauses_us": self.recent_pauses(),
+            "free_after": self.free_after,
+        }
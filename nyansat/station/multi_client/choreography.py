@@ -0,0 +1,301 @@
+import time
+
+from antenny_threading import Thread
+from multi_client.common import common_time
+
+_DEFAULT_RATE = 5
+# Slack on top of the measured latency when deciding how early to send a frame
+_DEFAULT_MARGIN = 0.05
+# One way delays budgeted per frame so the leader has time to retransmit
+_RETRANSMIT_ALLOWANCE = 4
+_MIN_LEAD_TIME = 0.1
+# Keeps the number of frames queued on a follower well under its scheduler capacity
+_MAX_LEAD_TIME = 2.0
+
+
+class Keyframe(object):
+
+    def __init__(
+            self,
+            offset: float,
+            azimuth: float,
+            elevation: float,
+    ):
+        self.offset = offset
+        self.azimuth = azimuth
+        self.elevation = elevation
+
+    def __repr__(self):
+        return "<Keyframe offset={} azimuth={} elevation={}>".format(self.offset, self.azimuth, self.elevation)
+
+
+class Timeline(object):
+    """
+    Pointing keyframes for a device or group. Offsets are seconds from the start of the
+    choreography, positions in between keyframes are linearly interpolated and the last
+    keyframe is held once the timeline ends.
+    """
+
+    def __init__(self, keyframes=None):
+        """
+        :param keyframes: list of (offset, azimuth, elevation)
+        """
+        self._keyframes = []
+        for offset, azimuth, elevation in keyframes or []:
+            self.add(offset, azimuth, elevation)
+
+    def add(self, offset: float, azimuth: float, elevation: float):
+        """
+        Adds a keyframe
+        :param offset: seconds from the start of the choreography
+        :param azimuth:
+        :param elevation:
+        :return: self, so calls can be chained
+        """
+        self._keyframes.append(Keyframe(offset, azimuth, elevation))
+        self._keyframes.sort(key=lambda keyframe: keyframe.offset)
+        return self
+
+    def keyframes(self):
+        return list(self._keyframes)
+
+    def duration(self) -> float:
+        if not self._keyframes:
+            return 0
+        return self._keyframes[-1].offset
+
+    def sample(self, offset: float):
+        """
+        Interpolates the position at a point in time
+        :param offset: seconds from the start of the choreography
+        :return: (azimuth, elevation), None before the first keyframe
+        """
+        keyframes = self._keyframes
+        if not keyframes or offset < keyframes[0].offset:
+            return None
+        for i in range(1, len(keyframes)):
+            after = keyframes[i]
+            if offset <= after.offset:
+                before = keyframes[i - 1]
+                span = after.offset - before.offset
+                if span <= 0:
+                    return after.azimuth, after.elevation
+                fraction = (offset - before.offset) / span
+                return (
+                    before.azimuth + (after.azimuth - before.azimuth) * fraction,
+                    before.elevation + (after.elevation - before.elevation) * fraction,
+                )
+        last = keyframes[-1]
+        return last.azimuth, last.elevation
+
+
+class Choreography(object):
+    """
+    Timelines for devices and named groups of devices. A device's own timeline takes
+    precedence over the timelines of the groups it belongs to.
+    """
+
+    def __init__(self):
+        self._groups = {}
+        self._group_timelines = {}
+        self._device_timelines = {}
+
+    def add_group(self, name: str, device_ids):
+        self._groups[name] = list(device_ids)
+        return self
+
+    def set_device_timeline(self, device_id: int, timeline: Timeline):
+        self._device_timelines[device_id] = timeline
+        return self
+
+    def set_group_timeline(self, name: str, timeline: Timeline):
+        if name not in self._groups:
+            raise ValueError("Unknown group '{}'".format(name))
+        self._group_timelines[name] = timeline
+        return self
+
+    def device_ids(self):
+        device_ids = set(self._device_timelines)
+        for name in self._group_timelines:
+            device_ids.update(self._groups[name])
+        return sorted(device_ids)
+
+    def duration(self) -> float:
+        durations = [timeline.duration() for timeline in self._device_timelines.values()]
+        durations += [timeline.duration() for timeline in self._group_timelines.values()]
+        return max(durations) if durations else 0
+
+    def setpoints(self, offset: float):
+        """
+        Samples every timeline
+        :param offset: seconds from the start of the choreography
+        :return: dictionary of device ID to (azimuth, elevation)
+        """
+        setpoints = {}
+        for name, timeline in self._group_timelines.items():
+            position = timeline.sample(offset)
+            if position is None:
+                continue
+            for device_id in self._groups[name]:
+                setpoints[device_id] = position
+        for device_id, timeline in self._device_timelines.items():
+            position = timeline.sample(offset)
+            if position is not None:
+                setpoints[device_id] = position
+        return setpoints
+
+
+def raster_scan(
+        azimuth_start: float,
+        azimuth_end: float,
+        elevation_start: float,
+        elevation_end: float,
+        rows: int,
+        row_duration: float,
+        start: float = 0,
+) -> Timeline:
+    """
+    Builds a boustrophedon scan, sweeping azimuth back and forth while stepping elevation
+    :param azimuth_start:
+    :param azimuth_end:
+    :param elevation_start:
+    :param elevation_end:
+    :param rows: number of azimuth sweeps
+    :param row_duration: seconds per sweep
+    :param start: offset of the first keyframe
+    :return:
+    """
+    timeline = Timeline()
+    offset = start
+    for row in range(rows):
+        elevation = elevation_start
+        if rows > 1:
+            elevation += (elevation_end - elevation_start) * row / (rows - 1)
+        if row % 2:
+            timeline.add(offset, azimuth_end, elevation)
+            timeline.add(offset + row_duration, azimuth_start, elevation)
+        else:
+            timeline.add(offset, azimuth_start, elevation)
+            timeline.add(offset + row_duration, azimuth_end, elevation)
+        offset += row_duration
+    return timeline
+
+
+def beam_sweep(
+        choreography: Choreography,
+        device_ids,
+        azimuth_start: float,
+        azimuth_end: float,
+        elevation: float,
+        duration: float,
+        stagger: float,
+        start: float = 0,
+) -> Choreography:
+    """
+    Sweeps a beam across an array: every device performs the same azimuth sweep, each
+    starting stagger seconds after the previous device in device_ids
+    :param choreography: choreography to add the device timelines to
+    :param device_ids: devices in array order
+    :param azimuth_start:
+    :param azimuth_end:
+    :param elevation:
+    :param duration: seconds per device sweep
+    :param stagger: delay between neighbouring devices
+    :param start: offset of the first device's sweep
+    :return: choreography
+    """
+    for index in range(len(device_ids)):
+        offset = start + index * stagger
+        timeline = Timeline()
+        if offset > 0:
+            timeline.add(0, azimuth_start, elevation)
+        timeline.add(offset, azimuth_start, elevation)
+        timeline.add(offset + duration, azimuth_end, elevation)
+        choreography.set_device_timeline(device_ids[index], timeline)
+    return choreography
+
+
+class ChoreographyEngine(Thread):
+    """
+    Plays a choreography through an AntennyLeader. Timelines are sampled at a fixed rate
+    and each frame is sent as one MultiMoveRequest, ahead of its move time by the measured
+    delay of the slowest device in the frame plus room for retransmissions. Devices whose
+    rounded setpoint did not change are left out of the frame.
+    """
+
+    def __init__(
+            self,
+            leader,
+            choreography: Choreography,
+            rate: float = _DEFAULT_RATE,
+            margin: float = _DEFAULT_MARGIN,
+    ):
+        """
+        :param leader: AntennyLeader
+        :param choreography:
+        :param rate: frames per second
+        :param margin: seconds of slack added to the measured latency
+        """
+        super(ChoreographyEngine, self).__init__()
+        self.leader = leader
+        self.choreography = choreography
+        self.rate = rate
+        self.margin = margin
+        self.start_time = None
+        self.frames_sent = 0
+        self.frames_late = 0
+        self.last_sequence = None
+
+    def lead_time(self, device_ids) -> float:
+        """
+        How long before its move time a frame for these devices has to be sent
+        :param device_ids:
+        :return: seconds
+        """
+        delay_us = 0
+        for device_id in device_ids:
+            device_info = self.leader.heartbeat.get_device_info(device_id)
+            if device_info is not None:
+                delay_us = max(delay_us, device_info.one_way_delay_us())
+        lead = delay_us * _RETRANSMIT_ALLOWANCE / 1000000 + self.margin
+        return min(max(lead, _MIN_LEAD_TIME), _MAX_LEAD_TIME)
+
+    def run(self):
+        choreography = self.choreography
+        step = 1 / self.rate
+        frames = int(choreography.duration() * self.rate) + 1
+        self.start_time = common_time() + self.lead_time(choreography.device_ids())
+        last_positions = {}
+        for frame in range(frames):
+            if not self.running:
+                break
+            move_at = self.start_time + frame * step
+            moves = []
+            for device_id, position in choreography.setpoints(frame * step).items():
+                azimuth = int(round(position[0]))
+                elevation = int(round(position[1]))
+                if last_positions.get(device_id) != (azimuth, elevation):
+                    moves.append((device_id, azimuth, elevation))
+            if not moves:
+                continue
+            send_delay = move_at - self.lead_time([move[0] for move in moves]) - common_time()
+            if send_delay > 0:
+                time.sleep(send_delay)
+            elif common_time() >= move_at:
+                # Too late for this frame, its changes are carried into the next one
+                self.frames_late += 1
+                continue
+            sequence = self.leader.move_many(moves, move_at)
+            if sequence is not None:
+                self.last_sequence = sequence
+                self.frames_sent += 1
+                for device_id, azimuth, elevation in moves:
+                    last_positions[device_id] = (azimuth, elevation)
+        self.running = False
+
+    def get_status(self) -> dict:
+        return {
+            "start_time": self.start_time,
+            "frames_sent": self.frames_sent,
+            "frames_late": self.frames_late,
+        }
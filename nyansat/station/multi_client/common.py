@@ -1,18 +1,27 @@
-import time
-
-try:
-    import machine
-
-    RTC = machine.RTC()
-except ImportError:
-    machine = None
-    RTC = None
+from clock.clock import CLOCK, ticks_us
 
 
 def common_time():
     """
     Common python/micropython time wrapper.
+    :return: disciplined seconds since 2000-01-01 UTC
+    """
+    return CLOCK.now()
+
+
+def common_time_us():
+    """
+    Common python/micropython time wrapper with integer precision.
+    :return: disciplined microseconds since 2000-01-01 UTC
+    """
+    return CLOCK.now_us()
+
+
+def common_time_from_ticks_us(ticks: int) -> int:
+    """
+    Converts a recent ticks_us() reading, a small int that is cheap to take on every packet,
+    to disciplined time.
+    :param ticks:
+    :return: disciplined microseconds since 2000-01-01 UTC
     """
-    if machine is None:
-        return time.time()
-    return time.time() + RTC.datetime()[-1] / 1000000
+    return CLOCK.to_reference_us(CLOCK.local_from_ticks(ticks))
@@ -1,29 +1,58 @@
+import struct
+import socket
+import time
+from array import array
+
 try:
-    import machine
-    import utime
+    import uselect as select
+except ImportError:
+    import select
 
-    RTC = machine.RTC()
+try:
+    from utime import ticks_ms, ticks_diff
 except ImportError:
-    RTC = None
+    def ticks_ms():
+        return int(time.monotonic() * 1000)
 
-import struct
-import socket
-import time
+    def ticks_diff(new, old):
+        return new - old
 
-from api.api import AntennyAPI
-from main import start
 from antenny_threading import Thread, Queue, Empty
-from multi_client.protocol.constants import HEARTBEAT_PAYLOAD_ACK_TYPE, MOVE_RESPONSE_PAYLOAD_TYPE
+from multi_client.common import common_time_from_ticks_us, common_time_us, ticks_us
+from multi_client.move_scheduler import MoveScheduler
+from multi_client.poller import POLL_TIMEOUT_MS, Waker, drain_queue, is_socket_event
+from multi_client.protocol.constants import (
+    HEARTBEAT_PAYLOAD_ACK_TYPE, MOVE_RESPONSE_PAYLOAD_TYPE, MOVE_STATUS_PAYLOAD_TYPE, SEQUENCE_MODULUS,
+)
+from multi_client.protocol.codec import PacketCodec
 from multi_client.protocol.heartbeat import HeartbeatRequest, HeartbeatResponse
-from multi_client.protocol.move import MoveRequest, MoveResponse
-from multi_client.protocol.packet import MultiAntennyPacket, MultiAntennyPacketHeader
+from multi_client.protocol.move import MoveRequest, MoveResponse, MultiMoveRequest
+from multi_client.protocol.status import IMU_STATUS_UNKNOWN, MoveStatusReport, pack_imu_status
+from multi_client.protocol.packet import (
+    MultiAntennyPacket, MultiAntennyPacketHeader, SequenceCounter, sequence_newer,
+)
 
 MCAST_GRP = '224.11.11.11'
 MCAST_PORT = 31337
 IS_ALL_GROUPS = False
 
 MAX_MESSAGE_SIZE = 1024
-_DEFAULT_TIMEOUT = 0.0001
+# Preallocated receive buffers, datagrams arriving while all of them wait to be handled are dropped
+_RECEIVE_SLOTS = 4
+# Without recvfrom_into the sender address is only read every this many datagrams, in between it is
+# looked up from the leader's board id
+_ADDRESS_REFRESH_READS = 256
+# How long the node thread blocks waiting for a message before checking if it was stopped
+_RECEIVE_TIMEOUT = 0.5
+# Older sequence numbers within this distance of the last accepted move are late retransmissions,
+# anything further back means the leader restarted
+_SEQUENCE_REORDER_WINDOW = 256
+# Results of this many recent moves per leader are kept to answer retransmissions whose ack was lost
+_MOVE_HISTORY = 32
+# Calibration levels change slowly, they are read from the IMU at most this often
+_IMU_STATUS_REFRESH_MS = 5000
+# The IMU is reported as unknown once the PID loop has not read it for this long
+_IMU_STALE_MS = 1000
 
 try:
     import ujson as json
@@ -42,17 +71,39 @@ def socket_inet_aton(ip_address: str):
     return result
 
 
-def create_heartbeat_response_packet(board_id: int):
+def create_heartbeat_response_packet(
+        board_id: int,
+        sequence: int,
+        leader_send_us: int,
+        follower_receive_us: int,
+        follower_send_us: int,
+):
     return MultiAntennyPacket(
-            MultiAntennyPacketHeader(board_id, HEARTBEAT_PAYLOAD_ACK_TYPE, MCAST_PORT),
-            HeartbeatResponse(),
+            MultiAntennyPacketHeader(board_id, HEARTBEAT_PAYLOAD_ACK_TYPE, MCAST_PORT, sequence),
+            HeartbeatResponse(leader_send_us, follower_receive_us, follower_send_us),
     )
 
 
-def create_move_response_packet(board_id: int, move_ok: bool):
+def create_move_response_packet(board_id: int, move_ok: bool, ack_sequence: int, sequence: int):
     return MultiAntennyPacket(
-            MultiAntennyPacketHeader(board_id, MOVE_RESPONSE_PAYLOAD_TYPE, MCAST_PORT),
-            MoveResponse(move_ok),
+            MultiAntennyPacketHeader(board_id, MOVE_RESPONSE_PAYLOAD_TYPE, MCAST_PORT, sequence),
+            MoveResponse(move_ok, ack_sequence),
+    )
+
+
+def create_move_status_packet(
+        board_id: int,
+        sequence: int,
+        move_sequence: int,
+        settled: bool,
+        settle_ms: int,
+        azimuth_error: float,
+        elevation_error: float,
+        imu_status: int,
+):
+    return MultiAntennyPacket(
+            MultiAntennyPacketHeader(board_id, MOVE_STATUS_PAYLOAD_TYPE, MCAST_PORT, sequence),
+            MoveStatusReport(move_sequence, settled, settle_ms, azimuth_error, elevation_error, imu_status),
     )
 
 
@@ -60,8 +111,17 @@ class FollowerMessage(object):
     def __init__(
             self,
             raw_message: bytes,
+            received_ticks: int = None,
+            length: int = None,
     ):
+        """
+        :param raw_message: received bytes, or a reused buffer holding them
+        :param received_ticks: ticks_us() at reception, converted to disciplined time only when needed
+        :param length: number of valid bytes in raw_message, all of them by default
+        """
         self.raw_message = raw_message
+        self.received_ticks = received_ticks
+        self.length = len(raw_message) if length is None else length
 
 
 class UDPFollowerMessage(FollowerMessage):
@@ -71,8 +131,10 @@ class UDPFollowerMessage(FollowerMessage):
             raw_message: bytes,
             sender_hostname: str,
             sender_port: int,
+            received_ticks: int = None,
+            length: int = None,
     ):
-        super(UDPFollowerMessage, self).__init__(raw_message)
+        super(UDPFollowerMessage, self).__init__(raw_message, received_ticks, length)
         self.sender_hostname = sender_hostname
         self.sender_port = sender_port
 
@@ -89,21 +151,34 @@ class FollowerClient(Thread):
 
     def receive(self):
         try:
-            return self.inbound_queue.get(timeout=_DEFAULT_TIMEOUT)
+            return self.inbound_queue.get(timeout=_RECEIVE_TIMEOUT)
         except Empty:
             return None
 
+    def release(self, message: FollowerMessage):
+        """
+        Hands a message back once it was handled, clients that reuse their messages override this
+        :param message:
+        :return:
+        """
+        pass
+
     def send(self, message):
         self.outbound_queue.put(message)
 
 
 class UDPFollowerClient(FollowerClient):
+    """
+    Receives from the multicast group and sends responses from a single thread
+    blocked in poll() on the socket and on a wakeup socket signalled by send()
+    """
 
     def __init__(
             self,
             inbound_queue: Queue,
             outbound_queue: Queue,
-            listen_port: int
+            listen_port: int,
+            wakeup_port: int = None,
     ):
         super(UDPFollowerClient, self).__init__(inbound_queue, outbound_queue)
         self._multicast_listen_sock = socket.socket(
@@ -115,31 +190,138 @@ class UDPFollowerClient(FollowerClient):
         self._multicast_listen_sock.bind((MCAST_GRP, listen_port))
         mreq = struct.pack("4sl", socket_inet_aton(MCAST_GRP), INADDR_ANY)
         self._multicast_listen_sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
-        self._multicast_listen_sock.settimeout(_DEFAULT_TIMEOUT)
+        self._multicast_listen_sock.setblocking(False)
         self._multicast_send_socket = socket.socket(
                 socket.AF_INET,
                 socket.SOCK_DGRAM,
                 socket.IPPROTO_UDP
         )
+        self._waker = Waker(wakeup_port if wakeup_port is not None else listen_port + 1)
+        # Datagrams are read into a ring of preallocated messages that the node hands back when done
+        self._free = Queue()
+        for _ in range(_RECEIVE_SLOTS):
+            self._free.put(UDPFollowerMessage(bytearray(MAX_MESSAGE_SIZE), None, 0, length=0))
+        self._scratch = bytearray(MAX_MESSAGE_SIZE)
+        self._recvfrom_into = getattr(self._multicast_listen_sock, "recvfrom_into", None)
+        # Leader board id to its (hostname, port), for datagrams read without their address
+        self._addresses = {}
+        self._reads_since_address = _ADDRESS_REFRESH_READS
+
+    def send(self, message):
+        self.outbound_queue.put(message)
+        self._waker.wake()
+
+    def release(self, message: FollowerMessage):
+        self._free.put(message)
 
     def run(self):
+        poller = select.poll()
+        poller.register(self._multicast_listen_sock, select.POLLIN)
+        self._waker.register(poller)
         while self.running:
-            self._recv_from_multicast()
-            self._send()
+            for event in poller.poll(POLL_TIMEOUT_MS):
+                if is_socket_event(event[0], self._multicast_listen_sock):
+                    self._recv_from_multicast()
+                else:
+                    self._waker.clear()
+                    self._send()
 
     def _send(self):
-        try:
-            message, addr = self.outbound_queue.get(timeout=_DEFAULT_TIMEOUT)
-        except Empty:
-            return
-        self._multicast_send_socket.sendto(message, addr)
+        for message, addr in drain_queue(self.outbound_queue):
+            try:
+                self._multicast_send_socket.sendto(message, addr)
+            except OSError as e:
+                print("Failed to send to {}: {}".format(addr, e))
 
     def _recv_from_multicast(self):
-        try:
-            message, (hostname, port) = self._multicast_listen_sock.recvfrom(MAX_MESSAGE_SIZE)
-        except OSError:
-            return
-        self.inbound_queue.put(UDPFollowerMessage(message, hostname, port))
+        """
+        Reads every datagram waiting on the socket
+        """
+        while True:
+            try:
+                message = self._free.get_nowait()
+            except Empty:
+                # The node is behind, the datagram is read into scratch space and dropped
+                message = None
+            buffer = self._scratch if message is None else message.raw_message
+            try:
+                length, address = self._read_into(buffer)
+            except OSError:
+                if message is not None:
+                    self._free.put(message)
+                return
+            if message is None:
+                continue
+            if address is None:
+                # From a leader whose address is not known yet, the next read learns it
+                self._free.put(message)
+                continue
+            message.received_ticks = ticks_us()
+            message.length = length
+            message.sender_hostname, message.sender_port = address
+            self.inbound_queue.put(message)
+
+    def _read_into(self, buffer: bytearray):
+        """
+        Reads one datagram into a buffer. MicroPython has no recvfrom_into, so the address is read
+        with an allocating recvfrom only for unknown leaders and now and then to follow address
+        changes, otherwise the datagram goes straight into the buffer with readinto.
+        :param buffer:
+        :return: (length, (hostname, port)), the address is None if the sender is unknown
+        """
+        sock = self._multicast_listen_sock
+        if self._recvfrom_into is not None:
+            return self._recvfrom_into(buffer)
+        if self._reads_since_address >= _ADDRESS_REFRESH_READS:
+            data, address = sock.recvfrom(MAX_MESSAGE_SIZE)
+            length = len(data)
+            buffer[:length] = data
+            self._reads_since_address = 0
+            if length >= 3:
+                board_id = buffer[1] << 8 | buffer[2]
+                known = self._addresses.get(board_id)
+                if known is None or known[0] != address[0] or known[1] != address[1]:
+                    self._addresses[board_id] = address
+            return length, address
+        length = sock.readinto(buffer)
+        if length is None:
+            # Non blocking read with nothing waiting
+            raise OSError("No datagram waiting")
+        self._reads_since_address += 1
+        if length < 3:
+            return length, None
+        address = self._addresses.get(buffer[1] << 8 | buffer[2])
+        if address is None:
+            self._reads_since_address = _ADDRESS_REFRESH_READS
+        return length, address
+
+
+class _MoveHistory(object):
+    """
+    Ring of the latest (sequence, move_ok) results of one leader, preallocated so recording a
+    move never allocates
+    """
+
+    def __init__(self, size: int = _MOVE_HISTORY):
+        self._sequences = array('l', [-1] * size)
+        self._results = bytearray(size)
+        self._index = 0
+
+    def record(self, sequence: int, move_ok: bool):
+        self._sequences[self._index] = sequence
+        self._results[self._index] = move_ok
+        self._index = (self._index + 1) % len(self._sequences)
+
+    def lookup(self, sequence: int):
+        """
+        :param sequence:
+        :return: the move's result, None if it is not in the ring
+        """
+        sequences = self._sequences
+        for i in range(len(sequences)):
+            if sequences[i] == sequence:
+                return bool(self._results[i])
+        return None
 
 
 class AntennyFollowerNode(Thread):
@@ -148,28 +330,73 @@ class AntennyFollowerNode(Thread):
             self,
             board_id: int,
             follower_client: FollowerClient,
-            api: AntennyAPI,
+            api,
+            scheduler: MoveScheduler = None,
     ):
+        """
+        :param board_id:
+        :param follower_client:
+        :param api: AntennyAPI, or anything with a platform and an imu
+        :param scheduler:
+        """
         super(AntennyFollowerNode, self).__init__()
         self.board_id = board_id
         self.follower_client = follower_client
         self.api = api
+        if scheduler is None:
+            config = api.antenny_config
+            reserved = [
+                config.get(key) for key in config.get_config()
+                if key.endswith("_timer_id") and key != "move_timer_id"
+            ]
+            scheduler = MoveScheduler(api.platform, config.get("move_timer_id"), reserved_timer_ids=reserved)
+        scheduler.on_move = self._on_move_applied
+        self.scheduler = scheduler
+        # (move sequence, leader address) of the move whose convergence is being watched
+        self._settle_token = None
         self.following_id = None
         self._leaders = set()
+        self._sequence = SequenceCounter()
+        # Packets are decoded into, and responses encoded from, reused objects
+        self._codec = PacketCodec()
+        self._heartbeat_response = create_heartbeat_response_packet(board_id, 0, 0, 0, 0)
+        self._move_response = create_move_response_packet(board_id, False, 0, 0)
+        # Newest handled move sequence number and the recent move results, per leader
+        self._last_move_sequence = {}
+        self._move_history = {}
+        # Leader board id to the (hostname, listen port) responses go to, reused between packets
+        self._reply_addresses = {}
+        self.duplicate_moves = 0
+        # Packed calibration levels, read on the node thread so status reports never touch the IMU bus
+        self._imu_status_cache = IMU_STATUS_UNKNOWN
+        self._imu_status_read_at = None
 
     def run(self):
         while self.running:
+            self._refresh_imu_status()
             message = self.follower_client.receive()
             if message is None:
                 continue
-            packet = MultiAntennyPacket.deserialize(message.raw_message)
-            if isinstance(packet.payload, HeartbeatRequest):
-                self._handle_heartbeat(packet, message)
-            elif isinstance(packet.payload, MoveRequest):
-                self._handle_move(packet, message)
-            else:
-                raise NotImplementedError(
-                        "Unable to handle packet type {}".format(type(packet.payload)))
+            try:
+                self._handle_message(message)
+            finally:
+                self.follower_client.release(message)
+
+    def _handle_message(self, message: FollowerMessage):
+        try:
+            packet = self._codec.decode(message.raw_message, message.length)
+        except ValueError as e:
+            print("Dropping packet: {}".format(e))
+            return
+        if isinstance(packet.payload, HeartbeatRequest):
+            self._handle_heartbeat(packet, message)
+        elif isinstance(packet.payload, MoveRequest):
+            self._handle_move(packet, message)
+        elif isinstance(packet.payload, MultiMoveRequest):
+            self._handle_multi_move(packet, message)
+        else:
+            raise NotImplementedError(
+                    "Unable to handle packet type {}".format(type(packet.payload)))
 
     def follow(self, board_id: int):
         if board_id not in self._leaders:
@@ -195,9 +422,15 @@ class AntennyFollowerNode(Thread):
         self._leaders.add(packet.header.board_id)
         if packet.header.board_id == self.following_id:
             print("Got heartbeat from leader id={}".format(self.following_id))
+            response = self._heartbeat_response
+            response.header.sequence = self._sequence.next()
+            response.payload.leader_send_us = packet.payload.leader_send_us
+            response.payload.follower_receive_us = common_time_from_ticks_us(message.received_ticks)
+            response.payload.follower_send_us = common_time_us()
+            # Copied out of the codec buffer because the client sends it from another thread
             self.follower_client.send((
-                create_heartbeat_response_packet(self.board_id).serialize(),
-                (message.sender_hostname, packet.header.listen_port)
+                bytes(self._codec.encode(response)),
+                self._reply_address(message, packet)
             ))
         else:
             print("Ignoring heartbeat from leader id={}".format(packet.header.board_id))
@@ -213,28 +446,185 @@ class AntennyFollowerNode(Thread):
                     packet.payload.board_id
             ))
             return
-        now = time.time()
-        if packet.payload.move_at_timestamp < now:
-            print("Received a MoveRequest after the given timestamp, NOT moving!")
+        self._accept_move(
+                packet,
+                message,
+                packet.payload.azimuth,
+                packet.payload.elevation,
+                packet.payload.move_at_timestamp * 1000000 + int(packet.payload.move_at_millis * 1000000),
+        )
+
+    def _handle_multi_move(
+            self,
+            packet: MultiAntennyPacket,
+            message: FollowerMessage,
+    ):
+        assert isinstance(packet.payload, MultiMoveRequest)
+        entry = packet.payload.find(self.board_id)
+        if entry is None:
+            return
+        azimuth, elevation, offset_us = entry
+        # The table entry converts the shared move time to this device's clock
+        move_at_us = packet.payload.move_at_timestamp * 1000000 + int(packet.payload.move_at_millis * 1000000)
+        self._accept_move(
+                packet,
+                message,
+                azimuth,
+                elevation,
+                move_at_us + offset_us,
+        )
+
+    def _accept_move(
+            self,
+            packet: MultiAntennyPacket,
+            message: FollowerMessage,
+            azimuth: int,
+            elevation: int,
+            move_at_us: int,
+    ):
+        leader_id = packet.header.board_id
+        sequence = packet.header.sequence
+        assert isinstance(message, UDPFollowerMessage)
+        if self._is_duplicate_move(leader_id, sequence):
+            self.duplicate_moves += 1
+            # The leader retransmits until acknowledged, so answer again without moving again. A sequence
+            # missing from the history never arrived before a newer move and is too late to apply
+            move_ok = self._move_history[leader_id].lookup(sequence)
+            self._send_move_response(message, packet, move_ok is True)
             return
-        delta = packet.payload.move_at_timestamp - now
-        delta += packet.payload.move_at_millis - (RTC.datetime()[-1] / 1000000)
-        if delta > 10000:
+        delta_us = move_at_us - common_time_us()
+        move_ok = True
+        if delta_us < 0:
+            print("Received a MoveRequest after the given timestamp, NOT moving!")
+            move_ok = False
+        elif delta_us > 10000 * 1000000:
             print("Very large time offset.")
+            move_ok = False
+        else:
+            token = (sequence, self._reply_address(message, packet))
+            move_ok = self.scheduler.schedule(move_at_us, azimuth, elevation, token)
+        history = self._move_history.get(leader_id)
+        if history is None:
+            history = _MoveHistory()
+            self._move_history[leader_id] = history
+        history.record(sequence, move_ok)
+        self._last_move_sequence[leader_id] = sequence
+        self._send_move_response(message, packet, move_ok)
+
+    def _on_move_applied(self, token):
+        """
+        Scheduler callback, starts watching the platform converge on the move that was just applied
+        :param token:
+        :return:
+        """
+        if self._settle_token is not None:
+            # Superseded before it converged
+            self._send_status_report(self._settle_token, False, 0, 0, 0)
+        self._settle_token = token
+        self.api.platform.watch_settle(self._on_settled)
+
+    def _on_settled(self, settled: bool, settle_ms: int, azimuth_error: float, elevation_error: float):
+        token = self._settle_token
+        self._settle_token = None
+        if token is not None:
+            self._send_status_report(token, settled, settle_ms, azimuth_error, elevation_error)
+
+    def _send_status_report(self, token, settled: bool, settle_ms: int, azimuth_error: float, elevation_error: float):
+        move_sequence, address = token
+        self.follower_client.send((
+            create_move_status_packet(
+                    self.board_id,
+                    self._sequence.next(),
+                    move_sequence,
+                    settled,
+                    settle_ms,
+                    azimuth_error,
+                    elevation_error,
+                    self._imu_status(),
+            ).serialize(),
+            address
+        ))
+
+    def _refresh_imu_status(self):
+        """
+        Reads the IMU calibration levels if the cached ones are old
+        :return:
+        """
+        now = ticks_ms()
+        if self._imu_status_read_at is not None and ticks_diff(now, self._imu_status_read_at) < _IMU_STATUS_REFRESH_MS:
             return
-        print("Sleeping for time delta of {} seconds".format(delta))
-        time.sleep(delta)
-        self.api.platform.set_azimuth(packet.payload.azimuth)
-        self.api.platform.set_elevation(packet.payload.elevation)
-        assert isinstance(message, UDPFollowerMessage)
+        self._imu_status_read_at = now
+        imu = self.api.imu
+        try:
+            self._imu_status_cache = pack_imu_status(
+                    imu.get_accelerometer_status(), imu.get_magnetometer_status(), imu.get_gyro_status())
+        except (NotImplementedError, OSError, TypeError):
+            self._imu_status_cache = IMU_STATUS_UNKNOWN
+
+    def _imu_status(self) -> int:
+        """
+        Cached calibration levels, called from the PID loop's settle callback where the IMU bus
+        must not be used
+        :return:
+        """
+        platform = self.api.platform
+        if hasattr(platform, "last_reading_ms"):
+            reading_ms = platform.last_reading_ms
+            if reading_ms is None or ticks_diff(ticks_ms(), reading_ms) >= _IMU_STALE_MS:
+                # The PID loop stopped reading the IMU, the cached levels can not be trusted
+                return IMU_STATUS_UNKNOWN
+        return self._imu_status_cache
+
+    def _is_duplicate_move(self, leader_id: int, sequence: int) -> bool:
+        """
+        Checks if a move request was already handled, or was superseded by a newer one
+        :param leader_id:
+        :param sequence:
+        :return:
+        """
+        last_sequence = self._last_move_sequence.get(leader_id)
+        if last_sequence is None or sequence_newer(sequence, last_sequence):
+            return False
+        return (last_sequence - sequence) % SEQUENCE_MODULUS < _SEQUENCE_REORDER_WINDOW
+
+    def _send_move_response(
+            self,
+            message: UDPFollowerMessage,
+            packet: MultiAntennyPacket,
+            move_ok: bool,
+    ):
+        response = self._move_response
+        response.header.sequence = self._sequence.next()
+        response.payload.move_ok = move_ok
+        response.payload.ack_sequence = packet.header.sequence
         self.follower_client.send((
-            create_move_response_packet(self.board_id, move_ok=True).serialize(),
-            (message.sender_hostname, packet.header.listen_port)
+            bytes(self._codec.encode(response)),
+            self._reply_address(message, packet)
         ))
 
+    def _reply_address(self, message: UDPFollowerMessage, packet: MultiAntennyPacket):
+        """
+        Gets the address responses to a packet go to, the same tuple as long as the leader's does not change
+        :param message:
+        :param packet:
+        :return: (hostname, port)
+        """
+        leader_id = packet.header.board_id
+        address = self._reply_addresses.get(leader_id)
+        if address is None or address[0] != message.sender_hostname or address[1] != packet.header.listen_port:
+            address = (message.sender_hostname, packet.header.listen_port)
+            self._reply_addresses[leader_id] = address
+        return address
+
+def main(board_id: int = None):
+    # Importing main brings up the hardware, so it is left out of the module imports to keep
+    # the node usable from the CPython simulator
+    from main import start
 
-def main(board_id: int):
     api = start()
+    if board_id is None:
+        # Set per board by fleet provisioning
+        board_id = api.antenny_config.get("board_id")
     # api = esp32_antenna_api_factory(True, True)
     udp_client = UDPFollowerClient(Queue(), Queue(), MCAST_PORT)
     follower = AntennyFollowerNode(board_id, udp_client, api)
@@ -247,6 +637,7 @@ def main(board_id: int):
         print(e)
         udp_client.stop()
         follower.stop()
+        follower.scheduler.clear()
         return
     follower.join()
     udp_client.join()
@@ -256,6 +647,6 @@ if __name__ == '__main__':
     import argparse
 
     parser = argparse.ArgumentParser()
-    parser.add_argument('device_id', type=int)
+    parser.add_argument('device_id', type=int, nargs='?', default=None)
     args = parser.parse_args()
     main(args.device_id)
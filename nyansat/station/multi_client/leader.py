@@ -1,22 +1,48 @@
+import _thread
 import random
 import socket
 import time
 
+try:
+    import uselect as select
+except ImportError:
+    import select
+
 from antenny_threading import Thread, Queue, Empty
-from multi_client.common import common_time
-from multi_client.protocol.constants import HEARTBEAT_PAYLOAD_TYPE, MOVE_REQUEST_PAYLOAD_TYPE
+from multi_client.choreography import Choreography, ChoreographyEngine, beam_sweep, raster_scan
+from multi_client.common import common_time, common_time_us
+from multi_client.poller import POLL_TIMEOUT_MS, Waker, drain_queue, is_socket_event
+from multi_client.protocol.constants import (
+    HEARTBEAT_PAYLOAD_TYPE, MOVE_REQUEST_PAYLOAD_TYPE, MULTI_MOVE_REQUEST_PAYLOAD_TYPE,
+)
 from multi_client.protocol.heartbeat import HeartbeatRequest, HeartbeatResponse
-from multi_client.protocol.move import MoveRequest
-from multi_client.protocol.packet import MultiAntennyPacket, MultiAntennyPacketHeader
+from multi_client.protocol.move import MoveRequest, MoveResponse, MultiMoveRequest
+from multi_client.protocol.packet import MultiAntennyPacket, MultiAntennyPacketHeader, SequenceCounter
+from multi_client.protocol.status import MoveStatusReport, unpack_imu_status
+from multi_client.rtt import RttEstimator
 
 MULTICAST_ADDR = "224.11.11.11"
 _DEFAULT_TIMEOUT = 0.0001
-
-
-def create_heartbeat_request_packet(board_id: int, listen_port: int):
+_MAX_MOVE_ATTEMPTS = 5
+_MIN_RETRANSMIT_INTERVAL = 0.02
+_COMPLETED_MOVE_HISTORY = 64
+# Keeps a MultiMoveRequest within a single 1024 byte datagram
+_MAX_MULTI_MOVE_ENTRIES = 71
+_HEARTBEAT_POLL_INTERVAL = 0.005
+# Longest the move tracker sleeps with nothing to retransmit, also bounds how long stop() takes
+_TRACKER_IDLE_WAIT = 0.5
+# Acknowledgements and settle reports arrive milliseconds apart at best
+_WAIT_POLL_INTERVAL = 0.005
+_OFFSET_WINDOW = 8
+_OFFSET_DELAY_MARGIN_US = 500
+_RTT_WINDOW = 64
+_HEALTH_REPORT_INTERVAL = 30
+
+
+def create_heartbeat_request_packet(board_id: int, listen_port: int, sequence: int, leader_send_us: int):
     return MultiAntennyPacket(
-            MultiAntennyPacketHeader(board_id, HEARTBEAT_PAYLOAD_TYPE, listen_port),
-            HeartbeatRequest(),
+            MultiAntennyPacketHeader(board_id, HEARTBEAT_PAYLOAD_TYPE, listen_port, sequence),
+            HeartbeatRequest(leader_send_us),
     )
 
 
@@ -28,13 +54,28 @@ def create_move_request_packet(
         move_at_timestamp: int,
         move_at_millis: float,
         listen_port: int,
+        sequence: int,
 ):
     return MultiAntennyPacket(
-            MultiAntennyPacketHeader(from_board_id, MOVE_REQUEST_PAYLOAD_TYPE, listen_port),
+            MultiAntennyPacketHeader(from_board_id, MOVE_REQUEST_PAYLOAD_TYPE, listen_port, sequence),
             MoveRequest(to_board_id, azimuth, elevation, move_at_timestamp, move_at_millis),
     )
 
 
+def create_multi_move_request_packet(
+        from_board_id: int,
+        entries,
+        move_at_timestamp: int,
+        move_at_millis: float,
+        listen_port: int,
+        sequence: int,
+):
+    return MultiAntennyPacket(
+            MultiAntennyPacketHeader(from_board_id, MULTI_MOVE_REQUEST_PAYLOAD_TYPE, listen_port, sequence),
+            MultiMoveRequest(entries, move_at_timestamp, move_at_millis),
+    )
+
+
 class LeaderClient(Thread):
 
     def __init__(
@@ -45,7 +86,24 @@ class LeaderClient(Thread):
         super(LeaderClient, self).__init__()
         self.outbound_queue = outbound_queue
         self.inbound_queue = inbound_queue
-        self._payloads_by_packet_type = {}
+        # recv is called from the heartbeat and the move tracker threads, so the queues of the payloads
+        # followers send exist from the start and any other type is added under the lock
+        self._payloads_by_packet_type = {
+            HeartbeatResponse: Queue(),
+            MoveResponse: Queue(),
+            MoveStatusReport: Queue(),
+        }
+        self._payloads_lock = _thread.allocate_lock()
+        # Payload type to the queue of a consumer that blocks on it, set up before the client starts
+        self._routes = {}
+        # Start at a random sequence number so followers do not mistake a restarted leader's packets for duplicates
+        self._sequence = SequenceCounter(random.getrandbits(16))
+
+    def next_sequence(self) -> int:
+        """
+        Gets the sequence number for the next packet sent by this leader
+        """
+        return self._sequence.next()
 
     def recv(
             self,
@@ -57,12 +115,18 @@ class LeaderClient(Thread):
         try:
             recv = self.inbound_queue.get(timeout=_DEFAULT_TIMEOUT)
         except Empty:
-            return None
+            # Packets of this type may already have been sorted out by an earlier call
+            recv = None
         while recv is not None:
             curr_payload_type = type(recv.payload)
-            if curr_payload_type not in self._payloads_by_packet_type:
-                self._payloads_by_packet_type[curr_payload_type] = Queue()
-            self._payloads_by_packet_type[curr_payload_type].put(recv)
+            queue = self._payloads_by_packet_type.get(curr_payload_type)
+            if queue is None:
+                with self._payloads_lock:
+                    queue = self._payloads_by_packet_type.get(curr_payload_type)
+                    if queue is None:
+                        queue = Queue()
+                        self._payloads_by_packet_type[curr_payload_type] = queue
+            queue.put(recv)
             try:
                 recv = self.inbound_queue.get(timeout=_DEFAULT_TIMEOUT)
             except Empty:
@@ -72,17 +136,43 @@ class LeaderClient(Thread):
         except (Empty, KeyError):
             return None
 
+    def route(self, payload_types, queue: Queue):
+        """
+        Delivers packets of the given payload types straight to a queue as they arrive, instead of
+        holding them for recv, so a consumer can block until one comes in
+        :param payload_types:
+        :param queue:
+        :return:
+        """
+        for payload_type in payload_types:
+            self._routes[payload_type] = queue
+
+    def _dispatch(self, packet: MultiAntennyPacket):
+        """
+        Hands a received packet to its consumer
+        """
+        queue = self._routes.get(type(packet.payload))
+        if queue is None:
+            queue = self.inbound_queue
+        queue.put(packet)
+
     def send(self, message):
         self.outbound_queue.put(message)
 
 
 class UDPLeaderClient(LeaderClient):
+    """
+    Sends to the multicast group and receives follower responses from a single thread
+    blocked in poll() on the socket and on a wakeup socket signalled by send()
+    """
+
     def __init__(
             self,
             outbound_queue: Queue,
             inbound_queue: Queue,
             broadcast_port: int,
             listen_port: int,
+            wakeup_port: int = None,
     ):
         super(UDPLeaderClient, self).__init__(outbound_queue, inbound_queue)
         self._port = broadcast_port
@@ -91,60 +181,172 @@ class UDPLeaderClient(LeaderClient):
                 socket.SOCK_DGRAM,
                 socket.IPPROTO_UDP
         )
-        self._mcast_send_socket.settimeout(0.01)
+        self._mcast_send_socket.setblocking(False)
         self._mcast_send_socket.bind(('', listen_port))
+        self._waker = Waker(wakeup_port if wakeup_port is not None else listen_port + 1)
+
+    def send(self, message):
+        self.outbound_queue.put(message)
+        self._waker.wake()
 
     def _send(self):
         """
         Send any queued outbound messages
         """
-        try:
-            message = self.outbound_queue.get()
-        except Empty:
-            return
-        self._mcast_send_socket.sendto(message, (MULTICAST_ADDR, self._port))
+        for message in drain_queue(self.outbound_queue):
+            try:
+                self._mcast_send_socket.sendto(message, (MULTICAST_ADDR, self._port))
+            except OSError as e:
+                print("Failed to send to the multicast group: {}".format(e))
 
     def run(self):
+        poller = select.poll()
+        poller.register(self._mcast_send_socket, select.POLLIN)
+        self._waker.register(poller)
         while self.running:
-            self._send()
-            self._recv()
+            for event in poller.poll(POLL_TIMEOUT_MS):
+                if is_socket_event(event[0], self._mcast_send_socket):
+                    self._recv()
+                else:
+                    self._waker.clear()
+                    self._send()
 
     def _recv(self):
-        try:
-            raw_message, _ = self._mcast_send_socket.recvfrom(1024)
-        except OSError:
-            return
-        self.inbound_queue.put(MultiAntennyPacket.deserialize(raw_message))
+        """
+        Reads every datagram waiting on the socket
+        """
+        while True:
+            try:
+                raw_message, _ = self._mcast_send_socket.recvfrom(1024)
+            except OSError:
+                return
+            received_us = common_time_us()
+            try:
+                packet = MultiAntennyPacket.deserialize(raw_message)
+            except ValueError as e:
+                print("Dropping packet: {}".format(e))
+                continue
+            packet.received_us = received_us
+            self._dispatch(packet)
 
 
 class OnlineDevice(object):
+    """
+    A follower seen by the heartbeat, with an estimate of its clock offset and network delay.
+    Each heartbeat exchange gives four timestamps: leader send (t1), follower receive (t2),
+    follower send (t3) and leader receive (t4). The follower clock offset is
+    ((t2 - t1) + (t3 - t4)) / 2 and the round trip delay is (t4 - t1) - (t3 - t2).
+    Queueing only ever adds delay, so the exchange with the lowest delay in the window
+    gives the most trustworthy offset, and exchanges much slower than it are ignored.
+    Round trip statistics are kept over a longer window by an RttEstimator.
+    """
 
     def __init__(
             self,
             device_id: int,
             last_online: float,
-            round_trip_times,
+            window: int = _OFFSET_WINDOW,
+            rtt_window: int = _RTT_WINDOW,
     ):
         self.device_id = device_id
         self.last_online = last_online
-        self.round_trip_times = round_trip_times
+        self._offsets_us = [0] * window
+        self._delays_us = [0] * window
+        self._count = 0
+        self._index = 0
+        self.rejected_samples = 0
+        self.rtt = RttEstimator(rtt_window)
 
     def __repr__(self):
-        return "<Device device_id={} online={} avg RTT={}>".format(
+        return "<Device device_id={} online={} rtt={} offset_us={} delay_us={}>".format(
                 self.device_id,
                 self.is_online(),
-                self.average_rtt()
+                self.rtt,
+                self.offset_us(),
+                self.one_way_delay_us(),
         )
 
     def is_online(self, offline_time=10):
         return common_time() - self.last_online < offline_time
 
-    def add_rtt(self, new_rtt: float):
+    def add_exchange(
+            self,
+            leader_send_us: int,
+            follower_receive_us: int,
+            follower_send_us: int,
+            leader_receive_us: int,
+    ):
+        """
+        Adds the four timestamps of a heartbeat exchange
+        :return: False if the exchange was rejected
+        """
         self.last_online = common_time()
-        self.round_trip_times.append(new_rtt)
+        delay = (leader_receive_us - leader_send_us) - (follower_send_us - follower_receive_us)
+        if delay < 0:
+            # Only possible with a broken timestamp
+            self.rejected_samples += 1
+            return False
+        offset = ((follower_receive_us - leader_send_us) + (follower_send_us - leader_receive_us)) // 2
+        self._offsets_us[self._index] = offset
+        self._delays_us[self._index] = delay
+        self._index = (self._index + 1) % len(self._delays_us)
+        self.rtt.add(delay)
+        if self._count < len(self._delays_us):
+            self._count += 1
+        return True
+
+    def _best_sample(self):
+        best = None
+        for i in range(self._count):
+            if best is None or self._delays_us[i] < self._delays_us[best]:
+                best = i
+        return best
+
+    def offset_us(self) -> int:
+        """
+        Estimates the follower clock minus the leader clock
+        :return: microseconds
+        """
+        best = self._best_sample()
+        if best is None:
+            return 0
+        # Average the offsets of the exchanges that were nearly as fast as the fastest one
+        limit = self._delays_us[best] + self._delays_us[best] // 2 + _OFFSET_DELAY_MARGIN_US
+        total = 0
+        count = 0
+        for i in range(self._count):
+            if self._delays_us[i] <= limit:
+                total += self._offsets_us[i]
+                count += 1
+        return total // count
+
+    def one_way_delay_us(self) -> int:
+        """
+        Estimates the leader to follower network delay
+        :return: microseconds
+        """
+        best = self._best_sample()
+        if best is None:
+            return 0
+        return self._delays_us[best] // 2
 
     def average_rtt(self):
-        return sum(self.round_trip_times) / len(self.round_trip_times)
+        """
+        Average round trip delay over the RTT window
+        :return: seconds
+        """
+        mean_us = self.rtt.mean_us()
+        if mean_us is None:
+            return 0
+        return mean_us / 1000000
+
+    def to_device_time_us(self, leader_time_us: int) -> int:
+        """
+        Converts a leader clock time to the follower's clock
+        :param leader_time_us:
+        :return:
+        """
+        return leader_time_us + self.offset_us()
 
 
 class HeartbeatThread(Thread):
@@ -154,11 +356,20 @@ class HeartbeatThread(Thread):
             board_id: int,
             listen_port: int,
             client: LeaderClient,
+            report_interval: float = _HEALTH_REPORT_INTERVAL,
     ):
+        """
+        :param board_id:
+        :param listen_port:
+        :param client:
+        :param report_interval: seconds between printed health reports, None to disable them
+        """
         super(HeartbeatThread, self).__init__()
         self.board_id = board_id
         self.client = client
         self.listen_port = listen_port
+        self.report_interval = report_interval
+        self._last_report = common_time()
         self._online_devices = {}
 
     def get_device_info(self, device_id):
@@ -168,34 +379,423 @@ class HeartbeatThread(Thread):
             return None
 
     def hearbeat(self):
-        heart_beat = common_time()
-        serialized = create_heartbeat_request_packet(self.board_id, self.listen_port).serialize()
+        serialized = create_heartbeat_request_packet(
+                self.board_id,
+                self.listen_port,
+                self.client.next_sequence(),
+                common_time_us(),
+        ).serialize()
         self.client.send(serialized)
-        delay = 0
-        while delay < 0.25:
-            time.sleep(_DEFAULT_TIMEOUT)
-            delay += _DEFAULT_TIMEOUT
+        # Responses carry their own timestamps, so collection latency does not affect the estimate
+        deadline = common_time() + 0.25
+        while common_time() < deadline:
+            time.sleep(_HEARTBEAT_POLL_INTERVAL)
             recv = self.client.recv(HeartbeatResponse)
             while recv is not None:
-                device_id = recv.header.board_id
-                if device_id not in self._online_devices:
-                    self._online_devices[device_id] = OnlineDevice(
-                            device_id,
-                            heart_beat + delay,
-                            [delay]
-                    )
-                else:
-                    self._online_devices[device_id].add_rtt(delay)
+                self._add_response(recv)
                 recv = self.client.recv(HeartbeatResponse)
-        for device in self._online_devices.values():
-            print(device)
+
+    def _add_response(self, packet: MultiAntennyPacket):
+        device_id = packet.header.board_id
+        if device_id not in self._online_devices:
+            self._online_devices[device_id] = OnlineDevice(device_id, common_time())
+        response = packet.payload
+        self._online_devices[device_id].add_exchange(
+                response.leader_send_us,
+                response.follower_receive_us,
+                response.follower_send_us,
+                packet.received_us,
+        )
+
+    def health_report(self) -> str:
+        """
+        Renders the link health of every device seen by the heartbeat, times in milliseconds
+        :return:
+        """
+        now = common_time()
+        lines = ["{:>6} {:>6} {:>6} {:>7} {:>7} {:>7} {:>7} {:>7} {:>9} {:>7}".format(
+                "device", "online", "seen", "rtt", "ewma", "p50", "p95", "p99", "offset", "samples")]
+        for device_id in sorted(self._online_devices):
+            device = self._online_devices[device_id]
+            rtt = device.rtt
+            p50, p95, p99 = rtt.percentiles_us()
+            lines.append("{:>6} {:>6} {:>6} {:>7} {:>7} {:>7} {:>7} {:>7} {:>9} {:>7}".format(
+                    device_id,
+                    "yes" if device.is_online() else "no",
+                    "{:.0f}s".format(now - device.last_online),
+                    _format_us(rtt.mean_us()),
+                    _format_us(rtt.ewma_us()),
+                    _format_us(p50),
+                    _format_us(p95),
+                    _format_us(p99),
+                    _format_us(device.offset_us()),
+                    rtt.total_samples,
+            ))
+        return "\n".join(lines)
 
     def run(self):
         while self.running:
             self.hearbeat()
+            if self.report_interval is not None and common_time() - self._last_report >= self.report_interval:
+                self._last_report = common_time()
+                print(self.health_report())
             time.sleep(.5)
 
 
+class PendingMove(object):
+    """
+    A move request that is retransmitted until every follower it addresses acknowledges it,
+    or its deadline passes
+    """
+
+    def __init__(
+            self,
+            device_ids,
+            sequence: int,
+            serialized: bytes,
+            deadline: float,
+            retransmit_interval: float,
+    ):
+        self.device_ids = list(device_ids)
+        self.sequence = sequence
+        self.serialized = serialized
+        self.deadline = deadline
+        self.retransmit_interval = retransmit_interval
+        self.first_sent = common_time()
+        self.last_sent = self.first_sent
+        self.attempts = 1
+        self.unacked = set(self.device_ids)
+        # Device ID to True if the follower accepted the move
+        self.results = {}
+        # Device ID to the MoveStatusReport sent once the follower converged
+        self.reports = {}
+
+    def __repr__(self):
+        return "<PendingMove devices={} sequence={} attempts={} acked={} move_ok={}>".format(
+                self.device_ids, self.sequence, self.attempts, self.acked, self.move_ok)
+
+    @property
+    def acked(self) -> bool:
+        return not self.unacked
+
+    @property
+    def move_ok(self) -> bool:
+        return self.acked and all(self.results.values())
+
+    @property
+    def settled(self) -> bool:
+        """
+        True once every follower that accepted the move reported its final status
+        """
+        return self.acked and all(
+                [device_id in self.reports for device_id, move_ok in self.results.items() if move_ok])
+
+
+class DeliveryStats(object):
+    """
+    Move delivery counters for one follower
+    """
+
+    def __init__(self):
+        self.sent = 0
+        self.retransmitted = 0
+        self.acked = 0
+        self.rejected = 0
+        self.missed = 0
+
+    def __repr__(self):
+        return "<DeliveryStats sent={} retransmitted={} acked={} rejected={} missed={}>".format(
+                self.sent, self.retransmitted, self.acked, self.rejected, self.missed)
+
+
+class LatencyStats(object):
+    """
+    Running count, minimum, maximum and mean of a latency in milliseconds
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.total = 0
+
+    def __repr__(self):
+        return "<LatencyStats count={} min={} max={} mean={}>".format(self.count, self.min, self.max, self.mean)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total / self.count
+
+
+class DeviceStatus(object):
+    """
+    What the leader knows about the last moves of one follower
+    """
+
+    def __init__(self, device_id: int):
+        self.device_id = device_id
+        self.ack_latency = LatencyStats()
+        self.settle_time = LatencyStats()
+        self.settled = 0
+        self.unsettled = 0
+        self.last_report = None
+        self.last_report_time = None
+
+    def __repr__(self):
+        return "<DeviceStatus device_id={} settled={} unsettled={} last_report={}>".format(
+                self.device_id, self.settled, self.unsettled, self.last_report)
+
+
+class ArrayStatusTable(object):
+    """
+    Per device move status, aggregated from move acknowledgements and status reports
+    """
+
+    def __init__(self):
+        self._devices = {}
+
+    def get(self, device_id: int):
+        return self._devices.get(device_id)
+
+    def device_ids(self):
+        return sorted(self._devices)
+
+    def _get_device(self, device_id: int) -> DeviceStatus:
+        status = self._devices.get(device_id)
+        if status is None:
+            status = DeviceStatus(device_id)
+            self._devices[device_id] = status
+        return status
+
+    def record_ack(self, device_id: int, latency_ms: float):
+        """
+        Records the time from first sending a move to its acknowledgement
+        :param device_id:
+        :param latency_ms:
+        :return:
+        """
+        self._get_device(device_id).ack_latency.add(latency_ms)
+
+    def record_report(self, device_id: int, report: MoveStatusReport):
+        status = self._get_device(device_id)
+        status.last_report = report
+        status.last_report_time = common_time()
+        if report.settled:
+            status.settled += 1
+            status.settle_time.add(report.settle_ms)
+        else:
+            status.unsettled += 1
+
+    def format(self) -> str:
+        """
+        Renders the table for printing
+        :return:
+        """
+        lines = ["{:>6} {:>8} {:>8} {:>8} {:>9} {:>9} {:>7} {:>7} {:>8}".format(
+                "device", "ack avg", "ack max", "settled", "settle ms", "worst ms", "az err", "el err", "imu")]
+        for device_id in self.device_ids():
+            status = self._devices[device_id]
+            report = status.last_report
+            lines.append("{:>6} {:>8} {:>8} {:>8} {:>9} {:>9} {:>7} {:>7} {:>8}".format(
+                    device_id,
+                    _format_ms(status.ack_latency.mean),
+                    _format_ms(status.ack_latency.max),
+                    "{}/{}".format(status.settled, status.settled + status.unsettled),
+                    _format_ms(status.settle_time.mean),
+                    _format_ms(status.settle_time.max),
+                    "-" if report is None else "{:.2f}".format(report.azimuth_error),
+                    "-" if report is None else "{:.2f}".format(report.elevation_error),
+                    "-" if report is None else _format_imu_status(report.imu_status),
+            ))
+        return "\n".join(lines)
+
+
+def _format_us(value) -> str:
+    if value is None:
+        return "-"
+    return "{:.1f}".format(value / 1000)
+
+
+def _format_ms(value) -> str:
+    if value is None:
+        return "-"
+    return "{:.1f}".format(value)
+
+
+def _format_imu_status(imu_status: int) -> str:
+    levels = unpack_imu_status(imu_status)
+    if levels is None:
+        return "?"
+    return "{}{}{}".format(*levels)
+
+
+class MoveAckTracker(Thread):
+    """
+    Tracks move acknowledgements per follower, retransmitting unacknowledged moves a bounded
+    number of times while they can still arrive before their scheduled move time.
+    """
+
+    def __init__(
+            self,
+            client: LeaderClient,
+            max_attempts: int = _MAX_MOVE_ATTEMPTS,
+    ):
+        super(MoveAckTracker, self).__init__()
+        self.client = client
+        self.max_attempts = max_attempts
+        self._pending = {}
+        self._completed = {}
+        self._completed_order = []
+        self._stats = {}
+        self.status_table = ArrayStatusTable()
+        # Acknowledgements and reports as they arrive, None entries only wake the thread up
+        self._events = Queue()
+        client.route((MoveResponse, MoveStatusReport), self._events)
+
+    def track(self, pending: PendingMove):
+        """
+        Starts tracking a move that was just sent
+        """
+        for device_id in pending.device_ids:
+            self._get_stats(device_id).sent += 1
+        self._pending[pending.sequence] = pending
+        # The thread may be sleeping until a later retransmission
+        self._events.put(None)
+
+    def get_move(self, sequence: int):
+        """
+        Gets a pending or recently completed move by sequence number
+        """
+        pending = self._pending.get(sequence)
+        if pending is None:
+            pending = self._completed.get(sequence)
+        return pending
+
+    def is_complete(self, sequence: int) -> bool:
+        return sequence not in self._pending
+
+    def is_settled(self, sequence: int) -> bool:
+        """
+        Checks if a move completed and every follower that accepted it reported its final status
+        """
+        if not self.is_complete(sequence):
+            return False
+        pending = self._completed.get(sequence)
+        return pending is None or pending.settled
+
+    def get_stats(self, device_id: int):
+        return self._stats.get(device_id)
+
+    def _get_stats(self, device_id: int) -> DeliveryStats:
+        stats = self._stats.get(device_id)
+        if stats is None:
+            stats = DeliveryStats()
+            self._stats[device_id] = stats
+        return stats
+
+    def poll(self, timeout: float = 0.):
+        """
+        Consumes received acknowledgements and retransmits moves that are due
+        :param timeout: seconds to wait for the first acknowledgement or report
+        """
+        try:
+            if timeout > 0:
+                packet = self._events.get(timeout=timeout)
+            else:
+                packet = self._events.get_nowait()
+        except Empty:
+            packet = None
+        while True:
+            if packet is None:
+                pass
+            elif isinstance(packet.payload, MoveResponse):
+                self._acknowledge(packet.header.board_id, packet.payload)
+            else:
+                self._add_report(packet.header.board_id, packet.payload)
+            try:
+                packet = self._events.get_nowait()
+            except Empty:
+                break
+        now = common_time()
+        for pending in list(self._pending.values()):
+            if now >= pending.deadline:
+                for device_id in pending.unacked:
+                    print("Device {} did not acknowledge move {} in time".format(device_id, pending.sequence))
+                    self._get_stats(device_id).missed += 1
+                self._complete(pending)
+            elif pending.attempts < self.max_attempts and \
+                    now - pending.last_sent >= pending.retransmit_interval:
+                pending.attempts += 1
+                pending.last_sent = now
+                for device_id in pending.unacked:
+                    self._get_stats(device_id).retransmitted += 1
+                self.client.send(pending.serialized)
+
+    def _acknowledge(self, device_id: int, response: MoveResponse):
+        pending = self._pending.get(response.ack_sequence)
+        if pending is None or device_id not in pending.unacked:
+            return
+        pending.unacked.discard(device_id)
+        pending.results[device_id] = response.move_ok
+        self.status_table.record_ack(device_id, (common_time() - pending.first_sent) * 1000)
+        stats = self._get_stats(device_id)
+        if response.move_ok:
+            stats.acked += 1
+        else:
+            stats.rejected += 1
+        if pending.acked:
+            self._complete(pending)
+
+    def _add_report(self, device_id: int, report: MoveStatusReport):
+        self.status_table.record_report(device_id, report)
+        # Reports normally arrive after the move was acknowledged, a lost ack is implied by the report
+        pending = self._pending.get(report.move_sequence)
+        if pending is not None and device_id in pending.unacked:
+            self._acknowledge(device_id, MoveResponse(True, report.move_sequence))
+        pending = self.get_move(report.move_sequence)
+        if pending is not None and device_id in pending.device_ids:
+            pending.reports[device_id] = report
+
+    def _complete(self, pending: PendingMove):
+        self._pending.pop(pending.sequence, None)
+        self._completed[pending.sequence] = pending
+        self._completed_order.append(pending.sequence)
+        if len(self._completed_order) > _COMPLETED_MOVE_HISTORY:
+            self._completed.pop(self._completed_order.pop(0), None)
+
+    def _next_wakeup(self, now: float) -> float:
+        """
+        :param now:
+        :return: seconds until the next deadline or retransmission is due
+        """
+        wait = _TRACKER_IDLE_WAIT
+        for pending in list(self._pending.values()):
+            due = pending.deadline
+            if pending.attempts < self.max_attempts:
+                due = min(due, pending.last_sent + pending.retransmit_interval)
+            wait = min(wait, due - now)
+        return max(wait, 0.)
+
+    def run(self):
+        while self.running:
+            self.poll(self._next_wakeup(common_time()))
+
+    def stop(self):
+        self.running = False
+        self._events.put(None)
+        super(MoveAckTracker, self).stop()
+
+
 class AntennyLeader(object):
 
     def __init__(
@@ -204,17 +804,23 @@ class AntennyLeader(object):
             listen_port: int,
             leader_client: LeaderClient,
             heartbeat: HeartbeatThread,
+            move_tracker: MoveAckTracker = None,
     ):
         self.board_id = board_id
         self.listen_port = listen_port
         self.client = leader_client
         self.heartbeat = heartbeat
+        if move_tracker is None:
+            move_tracker = MoveAckTracker(leader_client)
+        self.move_tracker = move_tracker
 
     def start(self):
         self.heartbeat.start()
+        self.move_tracker.start()
 
     def stop(self):
         self.heartbeat.stop()
+        self.move_tracker.stop()
 
     def wait_for_devices(
             self,
@@ -239,37 +845,140 @@ class AntennyLeader(object):
             elevation: int,
             move_at_timestamp: float,
     ):
+        """
+        Schedules a move on a follower, the request is retransmitted until acknowledged
+        :return: the sequence number of the move request, None if it was not sent
+        """
         device_info = self.heartbeat.get_device_info(device_id)
         if device_info is None:
             print(
                     "Not sending move command to an unknown device with ID '{}'".format(device_id))
-            return
+            return None
         if not device_info.is_online():
             print("Not sending move command to an offline device")
-            return
-        rtt_delta = device_info.average_rtt()
-        move_at = move_at_timestamp - (rtt_delta / 2)  # 1/2 full RTT delay
+            return None
+        move_at_us = int(move_at_timestamp * 1000000)
+        # The follower waits for the move time on its own clock
+        device_move_at_us = device_info.to_device_time_us(move_at_us)
+        sequence = self.client.next_sequence()
         move_packet = create_move_request_packet(
                 self.board_id,
                 device_id,
                 azimuth,
                 elevation,
-                int(move_at),
-                move_at - int(move_at),
+                device_move_at_us // 1000000,
+                (device_move_at_us % 1000000) / 1000000,
                 self.listen_port,
+                sequence,
         )
-        self.client.send(move_packet.serialize())
-
-
-def y2k_timestamp():
-    return time.time() - 946684800.0
-
+        serialized = move_packet.serialize()
+        self.client.send(serialized)
+        # A retransmission is only useful while it can still reach the follower before the move time
+        self.move_tracker.track(PendingMove(
+                [device_id],
+                sequence,
+                serialized,
+                (move_at_us - device_info.one_way_delay_us()) / 1000000,
+                max(device_info.one_way_delay_us() * 4 / 1000000, _MIN_RETRANSMIT_INTERVAL),
+        ))
+        return sequence
+
+    def move_many(
+            self,
+            moves,
+            move_at_timestamp: float,
+    ):
+        """
+        Schedules moves on many followers with a single multicast MultiMoveRequest
+        :param moves: list of (device_id, azimuth, elevation)
+        :param move_at_timestamp: shared move time on the leader clock
+        :return: the sequence number of the move request, None if it was not sent
+        """
+        entries = []
+        max_delay_us = 0
+        for device_id, azimuth, elevation in moves:
+            device_info = self.heartbeat.get_device_info(device_id)
+            if device_info is None or not device_info.is_online():
+                print("Not sending move command to unknown or offline device with ID '{}'".format(device_id))
+                continue
+            max_delay_us = max(max_delay_us, device_info.one_way_delay_us())
+            # Each entry carries the conversion from the leader clock to the device clock
+            entries.append((device_id, azimuth, elevation, device_info.offset_us()))
+        if not entries:
+            return None
+        if len(entries) > _MAX_MULTI_MOVE_ENTRIES:
+            raise ValueError("A MultiMoveRequest holds at most {} devices".format(_MAX_MULTI_MOVE_ENTRIES))
+        sequence = self.client.next_sequence()
+        move_packet = create_multi_move_request_packet(
+                self.board_id,
+                entries,
+                int(move_at_timestamp),
+                move_at_timestamp - int(move_at_timestamp),
+                self.listen_port,
+                sequence,
+        )
+        serialized = move_packet.serialize()
+        self.client.send(serialized)
+        self.move_tracker.track(PendingMove(
+                [entry[0] for entry in entries],
+                sequence,
+                serialized,
+                move_at_timestamp - max_delay_us / 1000000,
+                max(max_delay_us * 4 / 1000000, _MIN_RETRANSMIT_INTERVAL),
+        ))
+        return sequence
+
+    def wait_for_moves(
+            self,
+            sequences,
+            max_delay=10,
+    ):
+        """
+        Waits until the given moves were acknowledged or missed their deadline
+        :param sequences: sequence numbers returned by move
+        :param max_delay:
+        :return: dictionary of sequence number to True if the follower accepted the move
+        """
+        deadline = common_time() + max_delay
+        while not all([self.move_tracker.is_complete(sequence) for sequence in sequences]):
+            if common_time() >= deadline:
+                break
+            time.sleep(_WAIT_POLL_INTERVAL)
+        results = {}
+        for sequence in sequences:
+            pending = self.move_tracker.get_move(sequence)
+            results[sequence] = pending is not None and pending.move_ok
+        return results
+
+    def wait_for_settle(
+            self,
+            sequences,
+            max_delay=10,
+    ):
+        """
+        Waits until every follower that accepted the given moves reported that its platform
+        converged, or gave up converging
+        :param sequences: sequence numbers returned by move or move_many
+        :param max_delay:
+        :return: dictionary of sequence number to a dictionary of device ID to MoveStatusReport,
+        None for devices that did not report
+        """
+        deadline = common_time() + max_delay
+        while not all([self.move_tracker.is_settled(sequence) for sequence in sequences]):
+            if common_time() >= deadline:
+                break
+            time.sleep(_WAIT_POLL_INTERVAL)
+        results = {}
+        for sequence in sequences:
+            pending = self.move_tracker.get_move(sequence)
+            if pending is None:
+                results[sequence] = {}
+                continue
+            results[sequence] = {device_id: pending.reports.get(device_id) for device_id in pending.device_ids}
+        return results
 
-def programmed_move_demo(device_ids, moves):
-    for el, az, delay in moves:
-        for device_id in device_ids:
-            leader.move(device_id, az, el, y2k_timestamp() + 1)
-        time.sleep(delay)
+    def array_status(self) -> ArrayStatusTable:
+        return self.move_tracker.status_table
 
 
 if __name__ == '__main__':
@@ -279,18 +988,24 @@ if __name__ == '__main__':
     udp_client.start()
     heartbeat = HeartbeatThread(board_id, listen_port, udp_client)
     leader = AntennyLeader(board_id, listen_port, udp_client, heartbeat)
+    device_ids = [1, 2]
     try:
         leader.start()
-        leader.wait_for_devices([1, 2])
-        # leader.wait_for_devices([1])
-        for _ in range(1000):
-            moves = []
-            for _ in range(10):
-                moves.append((random.randint(5, 175), random.randint(5, 175), 2))
-            programmed_move_demo(
-                    [1, 2],
-                    moves,
-            )
-    except:
+        leader.wait_for_devices(device_ids)
+        choreography = Choreography().add_group("array", device_ids)
+        choreography.set_group_timeline("array", raster_scan(5, 175, 10, 80, rows=8, row_duration=10))
+        engine = ChoreographyEngine(leader, choreography)
+        engine.start()
+        engine.join()
+        print(engine.get_status())
+        beam = beam_sweep(Choreography(), device_ids, 5, 175, 45, duration=10, stagger=1)
+        engine = ChoreographyEngine(leader, beam)
+        engine.start()
+        engine.join()
+        print(engine.get_status())
+        if engine.last_sequence is not None:
+            leader.wait_for_settle([engine.last_sequence])
+        print(leader.array_status().format())
+    finally:
         leader.stop()
         udp_client.stop()
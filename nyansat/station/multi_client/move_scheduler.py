@@ -0,0 +1,150 @@
+try:
+    import uheapq as heapq
+except ImportError:
+    import heapq
+
+import _thread
+
+try:
+    import machine
+except ImportError:
+    import threading
+
+    machine = None
+
+from exceptions import AntennyConfigException
+from multi_client.common import common_time_us
+
+# The timer is armed this long before a deadline, the rest is waited out against the clock,
+# which hides the millisecond granularity and callback latency of the timer
+_EARLY_WAKE_US = 2000
+_MAX_PENDING_MOVES = 32
+
+
+class _OneShotTimer(object):
+    """
+    A re-armable one shot timer, a hardware timer on the ESP32 and a thread on CPython
+    """
+
+    def __init__(self, timer_id: int = None):
+        self._timer = None
+        if machine is not None:
+            self._timer = machine.Timer(timer_id)
+
+    def arm(self, delay_ms: int, callback):
+        if machine is not None:
+            self._timer.init(period=max(delay_ms, 1), mode=machine.Timer.ONE_SHOT, callback=lambda t: callback())
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay_ms / 1000, callback)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def cancel(self):
+        if machine is not None:
+            self._timer.deinit()
+        elif self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+class MoveScheduler(object):
+    """
+    Applies follower moves at their scheduled time. Pending moves are kept in a
+    min-heap ordered by deadline and a one shot timer is armed for the earliest
+    one, so the receive thread never sleeps waiting for a move.
+    """
+
+    def __init__(self, platform, timer_id: int = None, on_move=None, reserved_timer_ids=()):
+        """
+        :param platform: PlatformController the moves are applied to
+        :param timer_id: hardware timer id, unused on CPython
+        :param on_move: called with the move's token from the timer callback after a move was applied
+        :param reserved_timer_ids: hardware timers already used by the station, re-initializing
+        one of them would silently stop its callbacks
+        """
+        if timer_id is not None and timer_id in reserved_timer_ids:
+            print("Hardware timer {} is already in use, pick another move_timer_id".format(timer_id))
+            raise AntennyConfigException("move_timer_id {} is already in use".format(timer_id))
+        self.platform = platform
+        self.on_move = on_move
+        self._heap = []
+        self._order = 0
+        self._timer = _OneShotTimer(timer_id)
+        self._fire_lock = _thread.allocate_lock()
+        self.moves_applied = 0
+        self.last_late_us = 0
+        self.max_late_us = 0
+
+    def schedule(self, move_at_us: int, azimuth, elevation, token=None) -> bool:
+        """
+        Queues a move
+        :param move_at_us: disciplined time of the move, microseconds since 2000-01-01
+        :param azimuth:
+        :param elevation:
+        :param token: passed to on_move once the move is applied
+        :return: False if too many moves are already pending
+        """
+        if len(self._heap) >= _MAX_PENDING_MOVES:
+            print("Move scheduler is full, dropping move")
+            return False
+        # The order counter keeps moves with the same deadline in arrival order
+        self._order += 1
+        heapq.heappush(self._heap, (move_at_us, self._order, azimuth, elevation, token))
+        if self._heap[0][1] == self._order:
+            self._arm()
+        return True
+
+    def pending(self) -> int:
+        return len(self._heap)
+
+    def clear(self):
+        """
+        Drops every pending move
+        :return:
+        """
+        self._timer.cancel()
+        while self._heap:
+            heapq.heappop(self._heap)
+
+    def _arm(self):
+        if not self._heap:
+            return
+        delay_us = self._heap[0][0] - common_time_us() - _EARLY_WAKE_US
+        self._timer.arm(max(delay_us // 1000, 0), self._fire)
+
+    def _fire(self):
+        """
+        Timer callback, applies every move that is due
+        :return:
+        """
+        # A re-armed timer may fire while a previous callback is still running, that one re-arms when done
+        if not self._fire_lock.acquire(0):
+            return
+        try:
+            heap = self._heap
+            while heap and heap[0][0] - common_time_us() <= _EARLY_WAKE_US:
+                move_at_us, _, azimuth, elevation, token = heapq.heappop(heap)
+                now = common_time_us()
+                while now < move_at_us:
+                    now = common_time_us()
+                self.platform.set_azimuth(azimuth)
+                self.platform.set_elevation(elevation)
+                self.moves_applied += 1
+                self.last_late_us = common_time_us() - move_at_us
+                if self.last_late_us > self.max_late_us:
+                    self.max_late_us = self.last_late_us
+                if self.on_move is not None:
+                    self.on_move(token)
+        finally:
+            self._fire_lock.release()
+        self._arm()
+
+    def get_status(self) -> dict:
+        return {
+            "pending": len(self._heap),
+            "moves_applied": self.moves_applied,
+            "last_late_us": self.last_late_us,
+            "max_late_us": self.max_late_us,
+        }
@@ -0,0 +1,96 @@
+import socket
+
+try:
+    import uselect as select
+except ImportError:
+    import select
+
+from antenny_threading import Empty
+
+# poll() returns at least this often so a stopped client thread notices
+POLL_TIMEOUT_MS = 500
+_WAKEUP_HOST = '127.0.0.1'
+
+
+def is_socket_event(event_object, sock) -> bool:
+    """
+    Checks if a poll() result refers to a socket, CPython reports file descriptors
+    and MicroPython reports the registered object
+    :param event_object:
+    :param sock:
+    :return:
+    """
+    if event_object is sock:
+        return True
+    return isinstance(event_object, int) and hasattr(sock, "fileno") and event_object == sock.fileno()
+
+
+def drain_queue(queue):
+    """
+    Removes every item currently in a queue without blocking
+    :param queue:
+    :return: list of items in the order they were queued
+    """
+    items = []
+    while True:
+        try:
+            items.append(queue.get_nowait())
+        except Empty:
+            return items
+
+
+class Waker(object):
+    """
+    Wakes a thread blocked in poll() when another thread queues outbound data. A
+    connected socket pair is used where available, otherwise one byte is sent to a
+    UDP socket bound to the loopback interface on wakeup_port.
+    """
+
+    def __init__(self, wakeup_port: int):
+        self._address = None
+        if hasattr(socket, "socketpair"):
+            self.socket, self._send_socket = socket.socketpair()
+        else:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.socket.bind((_WAKEUP_HOST, wakeup_port))
+            self._send_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._address = socket.getaddrinfo(_WAKEUP_HOST, wakeup_port)[0][-1]
+        self.socket.setblocking(False)
+        self._pending = False
+
+    def register(self, poller):
+        poller.register(self.socket, select.POLLIN)
+
+    def wake(self):
+        """
+        Makes the poller return, repeated calls before the poller runs send nothing
+        :return:
+        """
+        if self._pending:
+            return
+        self._pending = True
+        try:
+            if self._address is None:
+                self._send_socket.send(b'\x00')
+            else:
+                self._send_socket.sendto(b'\x00', self._address)
+        except OSError:
+            # The wakeup buffer is full, the poller is already due to run
+            pass
+
+    def clear(self):
+        """
+        Consumes pending wakeups, called by the polling thread before draining its queue
+        :return:
+        """
+        self._pending = False
+        while True:
+            try:
+                if not self.socket.recv(64):
+                    return
+            except OSError:
+                return
+
+    def close(self):
+        self.socket.close()
+        self._send_socket.close()
@@ -0,0 +1,2 @@
+# Importing the payload modules registers the built-in payload types
+from multi_client.protocol import heartbeat, move, status
@@ -0,0 +1,61 @@
+import struct
+
+from multi_client.protocol.packet import MultiAntennyPacket, MultiAntennyPacketHeader
+from multi_client.protocol.payload import get_payload_class
+
+MAX_PACKET_SIZE = 1024
+
+
+class PacketCodec(object):
+    """
+    Encodes packets into one preallocated buffer and decodes them into reused header
+    and payload instances, one per payload type. Nothing returned by the codec may be
+    kept past the next call: the encoded view is overwritten by the next encode and the
+    decoded packet is refilled by the next decode. Callers that need to keep a packet,
+    such as one queued for another thread, must copy it or use MultiAntennyPacket.
+    """
+
+    def __init__(self, size: int = MAX_PACKET_SIZE):
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self._header = MultiAntennyPacketHeader()
+        self._payloads = {}
+        self._packet = MultiAntennyPacket(self._header, None)
+
+    def encode(self, packet: MultiAntennyPacket):
+        """
+        Encodes a packet into the codec buffer
+        :param packet:
+        :return: memoryview of the encoded bytes
+        """
+        if packet.size() > len(self._buffer):
+            raise ValueError("Packet of {} bytes does not fit the codec buffer".format(packet.size()))
+        return self._view[:packet.pack_into(self._buffer)]
+
+    def decode(self, data, length: int = None) -> MultiAntennyPacket:
+        """
+        Decodes a received packet in place
+        :param data: received bytes
+        :param length: number of valid bytes in data, defaults to all of it
+        :return: the codec's reused packet
+        """
+        if length is None:
+            length = len(data)
+        header = self._header
+        try:
+            header.unpack_from(data, 0, length)
+            payload = self._payloads.get(header.payload_type)
+            if payload is None:
+                payload = get_payload_class(header.payload_type)()
+                self._payloads[header.payload_type] = payload
+            payload.unpack_from(
+                    data,
+                    MultiAntennyPacketHeader.HEADER_LENGTH,
+                    length - MultiAntennyPacketHeader.HEADER_LENGTH,
+            )
+        except struct.error as e:
+            raise ValueError("Truncated packet: {}".format(e))
+        packet = self._packet
+        packet.payload = payload
+        packet.received_us = None
+        return packet
@@ -1,5 +1,11 @@
+PROTOCOL_VERSION = 0x02
+SEQUENCE_MODULUS = 0x10000
+
 HEARTBEAT_PAYLOAD_TYPE = 0x01
 HEARTBEAT_PAYLOAD_ACK_TYPE = 0x02
 
 MOVE_REQUEST_PAYLOAD_TYPE = 0x03
 MOVE_RESPONSE_PAYLOAD_TYPE = 0x04
+
+MULTI_MOVE_REQUEST_PAYLOAD_TYPE = 0x05
+MOVE_STATUS_PAYLOAD_TYPE = 0x06
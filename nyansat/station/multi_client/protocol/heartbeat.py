@@ -1,28 +1,75 @@
+import struct
+
 from multi_client.protocol.constants import HEARTBEAT_PAYLOAD_ACK_TYPE, HEARTBEAT_PAYLOAD_TYPE
-from multi_client.protocol.payload import MultiAntennyPayload
+from multi_client.protocol.payload import MultiAntennyPayload, register_payload
 
 
 class HeartbeatRequest(MultiAntennyPayload):
+    """
+    Carries the leader's send time, the first of the four NTP style timestamps
+    """
+    PAYLOAD_TYPE = HEARTBEAT_PAYLOAD_TYPE
+    STRUCT_FORMAT = '!q'
+    LENGTH = 8
 
-    def __init__(self):
+    def __init__(
+            self,
+            leader_send_us: int = 0,
+    ):
         super(HeartbeatRequest, self).__init__(HEARTBEAT_PAYLOAD_TYPE)
+        self.leader_send_us = leader_send_us
+
+    def size(self):
+        return self.LENGTH
 
-    def serialize(self):
-        return b'heartbeat'
+    def pack_into(self, buffer, offset: int):
+        struct.pack_into(self.STRUCT_FORMAT, buffer, offset, self.leader_send_us)
+        return self.LENGTH
 
-    @classmethod
-    def deserialize(cls, payload: bytes):
-        return cls()
+    def unpack_from(self, buffer, offset: int, length: int):
+        self.leader_send_us = struct.unpack_from(self.STRUCT_FORMAT, buffer, offset)[0]
+        return self
 
 
 class HeartbeatResponse(MultiAntennyPayload):
+    """
+    Echoes the leader's send time with the follower's receive and send times, the
+    leader adds its receive time when the response arrives
+    """
+    PAYLOAD_TYPE = HEARTBEAT_PAYLOAD_ACK_TYPE
+    STRUCT_FORMAT = '!qqq'
+    LENGTH = 24
 
-    def __init__(self):
+    def __init__(
+            self,
+            leader_send_us: int = 0,
+            follower_receive_us: int = 0,
+            follower_send_us: int = 0,
+    ):
         super(HeartbeatResponse, self).__init__(HEARTBEAT_PAYLOAD_ACK_TYPE)
+        self.leader_send_us = leader_send_us
+        self.follower_receive_us = follower_receive_us
+        self.follower_send_us = follower_send_us
+
+    def size(self):
+        return self.LENGTH
+
+    def pack_into(self, buffer, offset: int):
+        struct.pack_into(
+                self.STRUCT_FORMAT,
+                buffer,
+                offset,
+                self.leader_send_us,
+                self.follower_receive_us,
+                self.follower_send_us,
+        )
+        return self.LENGTH
+
+    def unpack_from(self, buffer, offset: int, length: int):
+        self.leader_send_us, self.follower_receive_us, self.follower_send_us = struct.unpack_from(
+                self.STRUCT_FORMAT, buffer, offset)
+        return self
 
-    def serialize(self):
-        return b'heartbeat:ack'
 
-    @classmethod
-    def deserialize(cls, payload: bytes):
-        return cls()
+register_payload(HeartbeatRequest)
+register_payload(HeartbeatResponse)
@@ -1,19 +1,23 @@
 import struct
 
-from multi_client.protocol.constants import MOVE_REQUEST_PAYLOAD_TYPE, MOVE_RESPONSE_PAYLOAD_TYPE
-from multi_client.protocol.payload import MultiAntennyPayload
+from multi_client.protocol.constants import (
+    MOVE_REQUEST_PAYLOAD_TYPE, MOVE_RESPONSE_PAYLOAD_TYPE, MULTI_MOVE_REQUEST_PAYLOAD_TYPE,
+)
+from multi_client.protocol.payload import MultiAntennyPayload, register_payload
 
 
 class MoveRequest(MultiAntennyPayload):
+    PAYLOAD_TYPE = MOVE_REQUEST_PAYLOAD_TYPE
     STRUCT_FORMAT = '!hhhid'
+    LENGTH = 18
 
     def __init__(
             self,
-            board_id: int,
-            azimuth: int,
-            elevation: int,
-            move_at_timestamp: int,
-            move_at_millis: float,
+            board_id: int = 0,
+            azimuth: int = 0,
+            elevation: int = 0,
+            move_at_timestamp: int = 0,
+            move_at_millis: float = 0.,
     ):
         super(MoveRequest, self).__init__(MOVE_REQUEST_PAYLOAD_TYPE)
         self.board_id = board_id
@@ -27,35 +31,172 @@ class MoveRequest(MultiAntennyPayload):
             self.board_id, self.azimuth, self.elevation, self.move_at_timestamp,
             self.move_at_millis)
 
-    def serialize(self):
-        packed = struct.pack(
+    def size(self):
+        return self.LENGTH
+
+    def pack_into(self, buffer, offset: int):
+        struct.pack_into(
                 self.STRUCT_FORMAT,
+                buffer,
+                offset,
                 self.board_id,
                 self.azimuth,
                 self.elevation,
                 self.move_at_timestamp,
                 self.move_at_millis,
         )
-        return packed
+        return self.LENGTH
+
+    def unpack_from(self, buffer, offset: int, length: int):
+        self.board_id, self.azimuth, self.elevation, self.move_at_timestamp, self.move_at_millis = \
+            struct.unpack_from(self.STRUCT_FORMAT, buffer, offset)
+        return self
+
+
+class MultiMoveRequest(MultiAntennyPayload):
+    """
+    Moves many devices at a shared time. The table of (board_id, azimuth, elevation,
+    offset_us) entries is kept sorted by board_id so a follower can binary search for
+    its own entry without decoding the others. offset_us converts the shared move time
+    to the device's own clock, it is 64 bit since an unsynchronized RTC can be off by
+    far more than the 35 minutes an int32 of microseconds covers.
+    """
+    PAYLOAD_TYPE = MULTI_MOVE_REQUEST_PAYLOAD_TYPE
+    STRUCT_FORMAT = '!idH'
+    HEADER_LENGTH = 14
+    ENTRY_FORMAT = '!Hhhq'
+    ENTRY_LENGTH = 14
+
+    def __init__(
+            self,
+            entries=(),
+            move_at_timestamp: int = 0,
+            move_at_millis: float = 0.,
+    ):
+        """
+        :param entries: list of (board_id, azimuth, elevation, offset_us)
+        :param move_at_timestamp:
+        :param move_at_millis:
+        """
+        super(MultiMoveRequest, self).__init__(MULTI_MOVE_REQUEST_PAYLOAD_TYPE)
+        self.move_at_timestamp = move_at_timestamp
+        self.move_at_millis = move_at_millis
+        # Encoded entry table, a view into the received packet after decoding
+        table = self._pack_table(entries)
+        self._table = table
+        self.count = len(table) // self.ENTRY_LENGTH
+
+    def __repr__(self):
+        return "<MultiMoveRequest devices={} move_at={}:{}>".format(
+                self.count, self.move_at_timestamp, self.move_at_millis)
 
     @classmethod
-    def deserialize(cls, payload: bytes):
-        return cls(*struct.unpack(MoveRequest.STRUCT_FORMAT, payload))
+    def _pack_table(cls, entries):
+        entries = sorted(entries)
+        table = bytearray(len(entries) * cls.ENTRY_LENGTH)
+        previous = None
+        for i in range(len(entries)):
+            board_id, azimuth, elevation, offset_us = entries[i]
+            if board_id == previous:
+                raise ValueError("Duplicate board_id {} in MultiMoveRequest".format(board_id))
+            previous = board_id
+            struct.pack_into(
+                    cls.ENTRY_FORMAT, table, i * cls.ENTRY_LENGTH, board_id, azimuth, elevation, offset_us)
+        return bytes(table)
+
+    def get_entry(self, index: int):
+        """
+        Decodes one table entry
+        :param index:
+        :return: (board_id, azimuth, elevation, offset_us)
+        """
+        return struct.unpack_from(self.ENTRY_FORMAT, self._table, index * self.ENTRY_LENGTH)
+
+    def entries(self):
+        return [self.get_entry(i) for i in range(self.count)]
+
+    def board_ids(self):
+        return [self.get_entry(i)[0] for i in range(self.count)]
+
+    def find(self, board_id: int):
+        """
+        Binary searches the table for a device
+        :param board_id:
+        :return: (azimuth, elevation, offset_us), or None if the device is not part of this move
+        """
+        table = self._table
+        low = 0
+        high = self.count - 1
+        while low <= high:
+            middle = (low + high) // 2
+            offset = middle * self.ENTRY_LENGTH
+            entry_id = table[offset] << 8 | table[offset + 1]
+            if entry_id == board_id:
+                return struct.unpack_from(self.ENTRY_FORMAT, table, offset)[1:]
+            if entry_id < board_id:
+                low = middle + 1
+            else:
+                high = middle - 1
+        return None
+
+    def size(self):
+        return self.HEADER_LENGTH + len(self._table)
+
+    def pack_into(self, buffer, offset: int):
+        struct.pack_into(
+                self.STRUCT_FORMAT,
+                buffer,
+                offset,
+                self.move_at_timestamp,
+                self.move_at_millis,
+                self.count,
+        )
+        table_length = len(self._table)
+        start = offset + self.HEADER_LENGTH
+        buffer[start:start + table_length] = self._table
+        return self.HEADER_LENGTH + table_length
+
+    def unpack_from(self, buffer, offset: int, length: int):
+        self.move_at_timestamp, self.move_at_millis, count = struct.unpack_from(self.STRUCT_FORMAT, buffer, offset)
+        if length - self.HEADER_LENGTH != count * self.ENTRY_LENGTH:
+            raise ValueError("MultiMoveRequest table length does not match its entry count")
+        start = offset + self.HEADER_LENGTH
+        # The table is searched in place rather than copied out of the packet
+        self._table = memoryview(buffer)[start:start + count * self.ENTRY_LENGTH]
+        self.count = count
+        return self
 
 
 class MoveResponse(MultiAntennyPayload):
-    STRUCT_FORMAT = '!b'
+    PAYLOAD_TYPE = MOVE_RESPONSE_PAYLOAD_TYPE
+    STRUCT_FORMAT = '!bH'
+    LENGTH = 3
 
     def __init__(
             self,
-            move_ok: bool,
+            move_ok: bool = False,
+            ack_sequence: int = 0,
     ):
         super(MoveResponse, self).__init__(MOVE_RESPONSE_PAYLOAD_TYPE)
         self.move_ok = move_ok
+        self.ack_sequence = ack_sequence
+
+    def __repr__(self):
+        return "<MoveResponse move_ok={} ack_sequence={}>".format(self.move_ok, self.ack_sequence)
 
-    def serialize(self):
-        return struct.pack(self.STRUCT_FORMAT, self.move_ok)
+    def size(self):
+        return self.LENGTH
 
-    @classmethod
-    def deserialize(cls, payload: bytes):
-        return cls(bool(struct.unpack(MoveResponse.STRUCT_FORMAT, payload)[0]))
+    def pack_into(self, buffer, offset: int):
+        struct.pack_into(self.STRUCT_FORMAT, buffer, offset, self.move_ok, self.ack_sequence)
+        return self.LENGTH
+
+    def unpack_from(self, buffer, offset: int, length: int):
+        move_ok, self.ack_sequence = struct.unpack_from(self.STRUCT_FORMAT, buffer, offset)
+        self.move_ok = bool(move_ok)
+        return self
+
+
+register_payload(MoveRequest)
+register_payload(MultiMoveRequest)
+register_payload(MoveResponse)
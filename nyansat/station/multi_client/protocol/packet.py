@@ -1,41 +1,73 @@
 import struct
 
-from multi_client.protocol.constants import (
-    HEARTBEAT_PAYLOAD_ACK_TYPE, HEARTBEAT_PAYLOAD_TYPE,
-    MOVE_REQUEST_PAYLOAD_TYPE, MOVE_RESPONSE_PAYLOAD_TYPE,
-)
-from multi_client.protocol.heartbeat import HeartbeatRequest, HeartbeatResponse
-from multi_client.protocol.move import MoveRequest, MoveResponse
-from multi_client.protocol.payload import MultiAntennyPayload
+from multi_client.protocol.constants import PROTOCOL_VERSION, SEQUENCE_MODULUS
+from multi_client.protocol.payload import MultiAntennyPayload, get_payload_class
+
+
+def sequence_newer(sequence: int, last_sequence: int) -> bool:
+    """
+    Compares two wrapping sequence numbers
+    :param sequence:
+    :param last_sequence:
+    :return: True if sequence was sent after last_sequence
+    """
+    delta = (sequence - last_sequence) % SEQUENCE_MODULUS
+    return 0 < delta < SEQUENCE_MODULUS // 2
 
 
 class MultiAntennyPacketHeader(MultiAntennyPayload):
-    STRUCT_FORMAT = '!HHH'
-    HEADER_LENGTH = 6
+    STRUCT_FORMAT = '!BHHHH'
+    HEADER_LENGTH = 9
 
     def __init__(
             self,
-            board_id: int,
-            payload_type: int,
-            listen_port: int,
+            board_id: int = 0,
+            payload_type: int = 0,
+            listen_port: int = 0,
+            sequence: int = 0,
+            version: int = PROTOCOL_VERSION,
     ):
         self.board_id = board_id
         self.payload_type = payload_type
         self.listen_port = listen_port
+        self.sequence = sequence
+        self.version = version
 
-    def serialize(self):
-        return struct.pack(self.STRUCT_FORMAT, self.board_id, self.payload_type, self.listen_port)
+    def size(self):
+        return self.HEADER_LENGTH
 
-    @classmethod
-    def deserialize(cls, payload: bytes):
-        board_id, payload_type, listen_port = struct.unpack(
-                MultiAntennyPacketHeader.STRUCT_FORMAT,
-                payload[:MultiAntennyPacketHeader.HEADER_LENGTH],
-        )
-        return (
-            cls(board_id, payload_type, listen_port),
-            payload[MultiAntennyPacketHeader.HEADER_LENGTH:]
+    def pack_into(self, buffer, offset: int):
+        struct.pack_into(
+                self.STRUCT_FORMAT,
+                buffer,
+                offset,
+                self.version,
+                self.board_id,
+                self.payload_type,
+                self.listen_port,
+                self.sequence,
         )
+        return self.HEADER_LENGTH
+
+    def unpack_from(self, buffer, offset: int, length: int):
+        if length < self.HEADER_LENGTH or buffer[offset] != PROTOCOL_VERSION:
+            raise ValueError("Unsupported protocol version: {}".format(buffer[offset] if length else None))
+        self.version, self.board_id, self.payload_type, self.listen_port, self.sequence = struct.unpack_from(
+                self.STRUCT_FORMAT, buffer, offset)
+        return self
+
+
+class SequenceCounter(object):
+    """
+    Numbers the packets sent by one node
+    """
+
+    def __init__(self, start: int = 0):
+        self._sequence = start % SEQUENCE_MODULUS
+
+    def next(self) -> int:
+        self._sequence = (self._sequence + 1) % SEQUENCE_MODULUS
+        return self._sequence
 
 
 class MultiAntennyPacket(object):
@@ -47,21 +79,43 @@ class MultiAntennyPacket(object):
     ):
         self.header = header
         self.payload = payload
+        # Disciplined clock reading when the packet was received, set by the receiving client
+        self.received_us = None
+
+    def size(self):
+        return MultiAntennyPacketHeader.HEADER_LENGTH + self.payload.size()
+
+    def pack_into(self, buffer, offset: int = 0) -> int:
+        """
+        Encodes the packet into a buffer
+        :param buffer: writable buffer
+        :param offset:
+        :return: number of bytes written
+        """
+        length = self.header.pack_into(buffer, offset)
+        return length + self.payload.pack_into(buffer, offset + length)
 
     def serialize(self):
-        return self.header.serialize() + self.payload.serialize()
+        buffer = bytearray(self.size())
+        self.pack_into(buffer)
+        return bytes(buffer)
 
     @classmethod
     def deserialize(cls, raw_payload: bytes):
-        header, payload = MultiAntennyPacketHeader.deserialize(raw_payload)
-        if header.payload_type == HEARTBEAT_PAYLOAD_TYPE:
-            payload = HeartbeatRequest.deserialize(payload)
-        elif header.payload_type == HEARTBEAT_PAYLOAD_ACK_TYPE:
-            payload = HeartbeatResponse.deserialize(payload)
-        elif header.payload_type == MOVE_REQUEST_PAYLOAD_TYPE:
-            payload = MoveRequest.deserialize(payload)
-        elif header.payload_type == MOVE_RESPONSE_PAYLOAD_TYPE:
-            payload = MoveResponse.deserialize(payload)
-        else:
-            raise ValueError("Unknown payload type: {}".format(header.payload_type))
+        """
+        Decodes a packet into new header and payload objects, the payload type is looked up in the registry
+        :param raw_payload:
+        :return:
+        """
+        length = len(raw_payload)
+        try:
+            header = MultiAntennyPacketHeader().unpack_from(raw_payload, 0, length)
+            payload = get_payload_class(header.payload_type)()
+            payload.unpack_from(
+                    raw_payload,
+                    MultiAntennyPacketHeader.HEADER_LENGTH,
+                    length - MultiAntennyPacketHeader.HEADER_LENGTH,
+            )
+        except struct.error as e:
+            raise ValueError("Truncated packet: {}".format(e))
         return cls(header, payload)
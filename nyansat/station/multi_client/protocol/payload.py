@@ -1,4 +1,40 @@
+# Payload classes by payload type id, filled by register_payload
+PAYLOAD_TYPES = {}
+
+
+def register_payload(payload_class):
+    """
+    Makes a payload class decodable by its PAYLOAD_TYPE
+    :param payload_class: MultiAntennyPayload subclass
+    :return: payload_class
+    """
+    if payload_class.PAYLOAD_TYPE in PAYLOAD_TYPES:
+        raise ValueError("Payload type {} is already registered".format(payload_class.PAYLOAD_TYPE))
+    PAYLOAD_TYPES[payload_class.PAYLOAD_TYPE] = payload_class
+    return payload_class
+
+
+def get_payload_class(payload_type: int):
+    """
+    Looks up a registered payload class
+    :param payload_type:
+    :return:
+    """
+    try:
+        return PAYLOAD_TYPES[payload_type]
+    except KeyError:
+        raise ValueError("Unknown payload type: {}".format(payload_type))
+
+
 class MultiAntennyPayload(object):
+    """
+    Base class for packet payloads. Subclasses encode themselves with pack_into and
+    decode in place with unpack_from, so buffers and instances can be reused;
+    serialize and deserialize are allocating conveniences built on top of them.
+    Every constructor argument must have a default so an empty instance can be
+    created for decoding.
+    """
+    PAYLOAD_TYPE = None
 
     def __init__(
             self,
@@ -6,9 +42,37 @@ class MultiAntennyPayload(object):
     ):
         self.payload_type = payload_type
 
-    def serialize(self):
+    def size(self) -> int:
+        """
+        Gets the encoded length
+        :return:
+        """
         raise NotImplementedError
 
+    def pack_into(self, buffer, offset: int) -> int:
+        """
+        Encodes the payload into a buffer
+        :param buffer: writable buffer
+        :param offset:
+        :return: number of bytes written
+        """
+        raise NotImplementedError
+
+    def unpack_from(self, buffer, offset: int, length: int):
+        """
+        Decodes the payload from a buffer into this instance
+        :param buffer: readable buffer
+        :param offset:
+        :param length: encoded length of the payload
+        :return: self
+        """
+        raise NotImplementedError
+
+    def serialize(self):
+        buffer = bytearray(self.size())
+        self.pack_into(buffer, 0)
+        return bytes(buffer)
+
     @classmethod
     def deserialize(cls, payload: bytes):
-        raise NotImplementedError
+        return cls().unpack_from(payload, 0, len(payload))
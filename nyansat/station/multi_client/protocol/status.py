@@ -0,0 +1,97 @@
+import struct
+
+from multi_client.protocol.constants import MOVE_STATUS_PAYLOAD_TYPE
+from multi_client.protocol.payload import MultiAntennyPayload, register_payload
+
+IMU_STATUS_UNKNOWN = 0xFF
+
+
+def pack_imu_status(accelerometer: int, magnetometer: int, gyroscope: int) -> int:
+    """
+    Packs the 0-3 calibration levels of the IMU sensors into one byte
+    :param accelerometer:
+    :param magnetometer:
+    :param gyroscope:
+    :return:
+    """
+    return (accelerometer & 0x03) << 4 | (magnetometer & 0x03) << 2 | (gyroscope & 0x03)
+
+
+def unpack_imu_status(imu_status: int):
+    """
+    :param imu_status: byte built by pack_imu_status
+    :return: (accelerometer, magnetometer, gyroscope) calibration levels, None if unknown
+    """
+    if imu_status == IMU_STATUS_UNKNOWN:
+        return None
+    return (imu_status >> 4) & 0x03, (imu_status >> 2) & 0x03, imu_status & 0x03
+
+
+class MoveStatusReport(MultiAntennyPayload):
+    """
+    Sent by a follower once its platform converged on a move, or gave up trying
+    """
+    PAYLOAD_TYPE = MOVE_STATUS_PAYLOAD_TYPE
+    STRUCT_FORMAT = '!HBIhhB'
+    LENGTH = 12
+
+    def __init__(
+            self,
+            move_sequence: int = 0,
+            settled: bool = False,
+            settle_ms: int = 0,
+            azimuth_error: float = 0.,
+            elevation_error: float = 0.,
+            imu_status: int = IMU_STATUS_UNKNOWN,
+    ):
+        """
+        :param move_sequence: sequence number of the move request
+        :param settled: False if the platform did not converge before the timeout
+        :param settle_ms: time from applying the move to convergence
+        :param azimuth_error: final pointing error in degrees, sent with 0.01 degree resolution
+        :param elevation_error: final pointing error in degrees, sent with 0.01 degree resolution
+        :param imu_status: calibration levels packed by pack_imu_status
+        """
+        super(MoveStatusReport, self).__init__(MOVE_STATUS_PAYLOAD_TYPE)
+        self.move_sequence = move_sequence
+        self.settled = settled
+        self.settle_ms = settle_ms
+        self.azimuth_error = azimuth_error
+        self.elevation_error = elevation_error
+        self.imu_status = imu_status
+
+    def __repr__(self):
+        return "<MoveStatusReport move_sequence={} settled={} settle_ms={} error={}/{} imu={}>".format(
+                self.move_sequence, self.settled, self.settle_ms, self.azimuth_error, self.elevation_error,
+                unpack_imu_status(self.imu_status))
+
+    def size(self):
+        return self.LENGTH
+
+    def pack_into(self, buffer, offset: int):
+        struct.pack_into(
+                self.STRUCT_FORMAT,
+                buffer,
+                offset,
+                self.move_sequence,
+                self.settled,
+                self.settle_ms,
+                max(-32768, min(32767, int(self.azimuth_error * 100))),
+                max(-32768, min(32767, int(self.elevation_error * 100))),
+                self.imu_status,
+        )
+        return self.LENGTH
+
+    def unpack_from(self, buffer, offset: int, length: int):
+        move_sequence, settled, settle_ms, azimuth_error, elevation_error, imu_status = struct.unpack_from(
+                self.STRUCT_FORMAT, buffer, offset)
+        self.move_sequence = move_sequence
+        self.settled = bool(settled)
+        self.settle_ms = settle_ms
+        self.azimuth_error = azimuth_error / 100
+        self.elevation_error = elevation_error / 100
+        self.imu_status = imu_status
+        return self
+
+
+register_payload(MoveStatusReport)
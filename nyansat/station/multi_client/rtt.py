@@ -0,0 +1,115 @@
+from array import array
+
+_DEFAULT_WINDOW = 64
+# EWMA gain of 1/8, the smoothing factor TCP uses for its round trip estimate
+_EWMA_SHIFT = 3
+# Samples are kept in a signed 32 bit array, anything longer than this is clamped
+_MAX_SAMPLE_US = 0x7FFFFFFF
+
+
+class RttEstimator(object):
+    """
+    Round trip time statistics over a fixed window of samples. Samples are kept in a
+    preallocated ring, the mean is maintained incrementally as samples enter and leave
+    the window and an exponentially weighted moving average tracks recent changes.
+    Percentiles sort a copy of the window, so they are meant for reports rather than
+    every packet.
+    """
+
+    def __init__(self, window: int = _DEFAULT_WINDOW):
+        """
+        :param window: number of samples kept
+        """
+        self._samples = array('l', [0] * window)
+        self._index = 0
+        self._count = 0
+        self._total = 0
+        self._ewma = None
+        self.total_samples = 0
+
+    def __repr__(self):
+        return "<RttEstimator count={} mean_us={} ewma_us={} p50_us={} p95_us={} p99_us={}>".format(
+                self._count,
+                self.mean_us(),
+                self.ewma_us(),
+                self.percentile_us(50),
+                self.percentile_us(95),
+                self.percentile_us(99),
+        )
+
+    def __len__(self):
+        return self._count
+
+    def add(self, rtt_us: int):
+        """
+        Adds a round trip time sample
+        :param rtt_us:
+        :return:
+        """
+        rtt_us = max(0, min(_MAX_SAMPLE_US, int(rtt_us)))
+        samples = self._samples
+        if self._count == len(samples):
+            self._total -= samples[self._index]
+        else:
+            self._count += 1
+        samples[self._index] = rtt_us
+        self._total += rtt_us
+        self._index = (self._index + 1) % len(samples)
+        if self._ewma is None:
+            self._ewma = rtt_us
+        else:
+            self._ewma += (rtt_us - self._ewma) >> _EWMA_SHIFT
+        self.total_samples += 1
+
+    def mean_us(self):
+        """
+        :return: mean over the window, None without samples
+        """
+        if not self._count:
+            return None
+        return self._total // self._count
+
+    def ewma_us(self):
+        """
+        :return: exponentially weighted moving average, None without samples
+        """
+        return self._ewma
+
+    def min_us(self):
+        if not self._count:
+            return None
+        return min(self._samples[:self._count])
+
+    def max_us(self):
+        if not self._count:
+            return None
+        return max(self._samples[:self._count])
+
+    def percentile_us(self, percentile: float):
+        """
+        Nearest rank percentile over the window
+        :param percentile: 0-100
+        :return: None without samples
+        """
+        return self.percentiles_us((percentile,))[0]
+
+    def percentiles_us(self, percentiles=(50, 95, 99)):
+        """
+        Computes several percentiles with a single sort
+        :param percentiles:
+        :return: list of values in the order of percentiles, Nones without samples
+        """
+        if not self._count:
+            return [None] * len(percentiles)
+        ordered = sorted(self._samples[:self._count])
+        values = []
+        for percentile in percentiles:
+            rank = (percentile * self._count + 99) // 100
+            values.append(ordered[max(0, min(self._count - 1, int(rank) - 1))])
+        return values
+
+    def clear(self):
+        self._index = 0
+        self._count = 0
+        self._total = 0
+        self._ewma = None
@@ -0,0 +1,485 @@
+"""
+Runs a leader and many simulated followers in one CPython process to benchmark the
+multi client protocol without hardware. Nodes exchange datagrams through a simulated
+network that drops and delays them; everything else, from packet encoding to the move
+scheduler and the leader's retransmissions, is the code that runs on the boards.
+
+All nodes share the process clock, so the reported synchronization error measures
+delivery and scheduling, not clock discipline. The followers' timers also share the
+interpreter lock, which adds a few milliseconds of lateness that the boards do not see;
+the figures are for comparing runs, not for predicting hardware.
+
+    python -m multi_client.simulator --followers 50 --loss 0.05 --latency 0.005
+"""
+import heapq
+import os
+import random
+import sys
+import threading
+import time
+
+from antenny_threading import Queue
+from controller.mock_controller import MockPlatformController
+from imu.mock_imu import MockImuController
+from multi_client.common import common_time, common_time_us, ticks_us
+from multi_client.follower import AntennyFollowerNode, FollowerClient, UDPFollowerMessage
+from multi_client.leader import AntennyLeader, HeartbeatThread, LeaderClient, MoveAckTracker
+from multi_client.move_scheduler import MoveScheduler
+from multi_client.protocol.packet import MultiAntennyPacket
+
+LEADER_ID = 0x42
+_LEADER_PORT = 44444
+_SIMULATED_HOSTNAME = "127.0.0.1"
+_FOLLOW_TIMEOUT = 10
+# Heartbeats needed before the clock offset and delay estimates are usable
+_WARMUP_HEARTBEATS = 3
+_HEARTBEAT_PERIOD = 0.75
+
+
+class SimulatedNetwork(threading.Thread):
+    """
+    Delivers datagrams after a latency with uniform jitter, dropping each one with a
+    fixed probability. Every copy of a multicast datagram is dropped independently.
+    """
+
+    def __init__(
+            self,
+            loss: float = 0.,
+            latency: float = 0.001,
+            jitter: float = 0.,
+            seed: int = None,
+    ):
+        """
+        :param loss: probability of dropping a datagram, 0-1
+        :param latency: seconds
+        :param jitter: extra random delay of up to this many seconds
+        :param seed: seeds the loss and jitter
+        """
+        super(SimulatedNetwork, self).__init__()
+        self.daemon = True
+        self.loss = loss
+        self.latency = latency
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._heap = []
+        self._order = 0
+        self._condition = threading.Condition()
+        self.running = False
+        self.sent = 0
+        self.dropped = 0
+
+    def deliver(self, data: bytes, receiver):
+        """
+        Queues a datagram
+        :param data:
+        :param receiver: called with the datagram once it arrives
+        :return:
+        """
+        with self._condition:
+            self.sent += 1
+            if self._random.random() < self.loss:
+                self.dropped += 1
+                return
+            deliver_at = time.monotonic() + self.latency + self._random.uniform(0, self.jitter)
+            self._order += 1
+            heapq.heappush(self._heap, (deliver_at, self._order, data, receiver))
+            if self._heap[0][1] == self._order:
+                self._condition.notify()
+
+    def start(self):
+        self.running = True
+        super(SimulatedNetwork, self).start()
+
+    def stop(self):
+        with self._condition:
+            self.running = False
+            self._condition.notify()
+        self.join()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while self.running and (not self._heap or self._heap[0][0] > time.monotonic()):
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._condition.wait(timeout)
+                if not self.running:
+                    return
+                _, _, data, receiver = heapq.heappop(self._heap)
+            receiver(data)
+
+
+class SimulatedLeaderClient(LeaderClient):
+    """
+    LeaderClient whose multicast reaches every registered simulated follower
+    """
+
+    def __init__(self, network: SimulatedNetwork):
+        super(SimulatedLeaderClient, self).__init__(Queue(), Queue())
+        self.network = network
+        self._followers = []
+
+    def add_follower(self, follower_client):
+        self._followers.append(follower_client)
+
+    def send(self, message):
+        for follower_client in self._followers:
+            self.network.deliver(message, follower_client.deliver)
+
+    def deliver(self, data: bytes):
+        received_us = common_time_us()
+        try:
+            packet = MultiAntennyPacket.deserialize(data)
+        except ValueError as e:
+            print("Dropping packet: {}".format(e))
+            return
+        packet.received_us = received_us
+        self._dispatch(packet)
+
+    def run(self):
+        # Delivery happens on the network thread
+        while self.running:
+            time.sleep(0.1)
+
+
+class SimulatedFollowerClient(FollowerClient):
+
+    def __init__(self, network: SimulatedNetwork, leader_client: SimulatedLeaderClient):
+        super(SimulatedFollowerClient, self).__init__(Queue(), Queue())
+        self.network = network
+        self.leader_client = leader_client
+        leader_client.add_follower(self)
+
+    def send(self, message):
+        data, _ = message
+        self.network.deliver(data, self.leader_client.deliver)
+
+    def deliver(self, data: bytes):
+        self.inbound_queue.put(UDPFollowerMessage(data, _SIMULATED_HOSTNAME, _LEADER_PORT, ticks_us()))
+
+    def run(self):
+        while self.running:
+            time.sleep(0.1)
+
+
+class SimulatedPlatform(MockPlatformController):
+    """
+    Mock platform that holds its setpoint and converges after a fixed settle time
+    """
+
+    def __init__(self, settle_time: float = 0.):
+        super(SimulatedPlatform, self).__init__(None, None, MockImuController())
+        self.settle_time = settle_time
+        self._azimuth = 0
+        self._elevation = 0
+
+    def set_azimuth(self, azimuth):
+        self._azimuth = azimuth
+
+    def get_azimuth(self):
+        return self._azimuth
+
+    def set_elevation(self, elevation):
+        self._elevation = elevation
+
+    def get_elevation(self):
+        return self._elevation
+
+    def watch_settle(self, callback, tolerance: float = 1.0, samples: int = 5, timeout_ms: int = 10000):
+        if not self.settle_time:
+            callback(True, 0, 0, 0)
+            return
+        timer = threading.Timer(self.settle_time, callback, (True, int(self.settle_time * 1000), 0, 0))
+        timer.daemon = True
+        timer.start()
+
+
+class SimulatedApi(object):
+    """
+    The parts of AntennyAPI a follower node uses
+    """
+
+    def __init__(self, platform: SimulatedPlatform):
+        self.platform = platform
+        self.imu = platform.imu
+
+
+class _CpuMeteredScheduler(MoveScheduler):
+    """
+    MoveScheduler that accumulates the CPU time spent in its timer callbacks
+    """
+
+    def __init__(self, platform):
+        super(_CpuMeteredScheduler, self).__init__(platform)
+        self.cpu_time = 0.
+
+    def _fire(self):
+        start = time.thread_time()
+        super(_CpuMeteredScheduler, self)._fire()
+        self.cpu_time += time.thread_time() - start
+
+
+class _SimulatedFollowerNode(AntennyFollowerNode):
+    """
+    Follower node that records when each move was applied and the CPU time of its thread
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(_SimulatedFollowerNode, self).__init__(*args, **kwargs)
+        self.applied_us = {}
+        self.cpu_time = 0.
+
+    def _on_move_applied(self, token):
+        self.applied_us[token[0]] = common_time_us()
+        super(_SimulatedFollowerNode, self)._on_move_applied(token)
+
+    def run(self):
+        super(_SimulatedFollowerNode, self).run()
+        self.cpu_time = time.thread_time()
+
+
+class _CpuMeteredHeartbeat(HeartbeatThread):
+
+    def run(self):
+        super(_CpuMeteredHeartbeat, self).run()
+        self.cpu_time = time.thread_time()
+
+
+class _CpuMeteredTracker(MoveAckTracker):
+
+    def run(self):
+        super(_CpuMeteredTracker, self).run()
+        self.cpu_time = time.thread_time()
+
+
+class SimulatedFollower(object):
+
+    def __init__(
+            self,
+            board_id: int,
+            network: SimulatedNetwork,
+            leader_client: SimulatedLeaderClient,
+            settle_time: float = 0.,
+    ):
+        self.board_id = board_id
+        self.platform = SimulatedPlatform(settle_time)
+        self.scheduler = _CpuMeteredScheduler(self.platform)
+        self.client = SimulatedFollowerClient(network, leader_client)
+        self.node = _SimulatedFollowerNode(board_id, self.client, SimulatedApi(self.platform), self.scheduler)
+
+    def start(self):
+        self.client.start()
+        self.node.start()
+
+    def signal_stop(self):
+        """
+        Asks the threads to stop without waiting for them, so many followers stop in parallel
+        :return:
+        """
+        self.node.running = False
+        self.client.running = False
+
+    def stop(self):
+        self.node.stop()
+        self.client.stop()
+        self.scheduler.clear()
+
+    def cpu_time(self) -> float:
+        return self.node.cpu_time + self.scheduler.cpu_time
+
+
+def _percentile(ordered, percentile: float):
+    if not ordered:
+        return None
+    rank = (percentile * len(ordered) + 99) // 100
+    return ordered[max(0, min(len(ordered) - 1, int(rank) - 1))]
+
+
+class SimulationResult(object):
+
+    def __init__(self):
+        self.followers = 0
+        self.moves = 0
+        self.deliveries = 0
+        self.acked = 0
+        self.applied = 0
+        self.settle_reports = 0
+        self.retransmitted = 0
+        self.network_sent = 0
+        self.network_dropped = 0
+        # Applied time minus scheduled time for every applied move, microseconds
+        self.sync_errors_us = []
+        # Spread between the first and last device applying the same move, microseconds
+        self.spreads_us = []
+        self.follower_cpu = []
+        self.leader_cpu = 0.
+        self.wall_time = 0.
+
+    @property
+    def delivery_rate(self) -> float:
+        if not self.deliveries:
+            return 0.
+        return self.acked / self.deliveries
+
+    def as_dict(self) -> dict:
+        errors = sorted(abs(error) for error in self.sync_errors_us)
+        spreads = sorted(self.spreads_us)
+        return {
+            "followers": self.followers,
+            "moves": self.moves,
+            "delivery_rate": self.delivery_rate,
+            "applied_rate": self.applied / self.deliveries if self.deliveries else 0.,
+            "settle_reports": self.settle_reports,
+            "retransmitted": self.retransmitted,
+            "network_sent": self.network_sent,
+            "network_dropped": self.network_dropped,
+            "sync_error_p50_us": _percentile(errors, 50),
+            "sync_error_p99_us": _percentile(errors, 99),
+            "sync_error_max_us": errors[-1] if errors else None,
+            "spread_p50_us": _percentile(spreads, 50),
+            "spread_max_us": spreads[-1] if spreads else None,
+            "follower_cpu_mean_s": sum(self.follower_cpu) / len(self.follower_cpu) if self.follower_cpu else 0.,
+            "follower_cpu_max_s": max(self.follower_cpu) if self.follower_cpu else 0.,
+            "leader_cpu_s": self.leader_cpu,
+            "wall_time_s": self.wall_time,
+        }
+
+    def format(self) -> str:
+        return "\n".join("{:>20}: {}".format(key, value) for key, value in self.as_dict().items())
+
+
+def run_simulation(
+        followers: int = 10,
+        moves: int = 20,
+        interval: float = 0.2,
+        lead: float = 0.3,
+        loss: float = 0.,
+        latency: float = 0.001,
+        jitter: float = 0.,
+        settle_time: float = 0.,
+        seed: int = None,
+        verbose: bool = False,
+) -> SimulationResult:
+    """
+    Moves every simulated follower with one MultiMoveRequest per round and measures how
+    well the moves were delivered and synchronized
+    :param followers: number of simulated followers
+    :param moves: number of move rounds
+    :param interval: seconds between rounds
+    :param lead: seconds between sending a move and its move time
+    :param loss: probability of dropping a datagram
+    :param latency: one way network delay in seconds
+    :param jitter: extra random delay of up to this many seconds
+    :param settle_time: seconds the simulated platforms take to converge
+    :param seed: seeds the network loss and jitter
+    :param verbose: keep the nodes' console output
+    :return:
+    """
+    stdout = sys.stdout
+    if not verbose:
+        sys.stdout = open(os.devnull, 'w')
+    network = SimulatedNetwork(loss, latency, jitter, seed)
+    leader_client = SimulatedLeaderClient(network)
+    heartbeat = _CpuMeteredHeartbeat(LEADER_ID, _LEADER_PORT, leader_client, report_interval=None)
+    tracker = _CpuMeteredTracker(leader_client)
+    leader = AntennyLeader(LEADER_ID, _LEADER_PORT, leader_client, heartbeat, tracker)
+    nodes = [SimulatedFollower(board_id, network, leader_client, settle_time) for board_id in range(1, followers + 1)]
+    device_ids = [node.board_id for node in nodes]
+    result = SimulationResult()
+    result.followers = followers
+    scheduled_us = {}
+    started = time.monotonic()
+    try:
+        network.start()
+        leader_client.start()
+        for node in nodes:
+            node.start()
+        leader.start()
+        deadline = time.monotonic() + _FOLLOW_TIMEOUT
+        waiting = list(nodes)
+        while waiting:
+            if time.monotonic() > deadline:
+                raise RuntimeError("{} simulated followers never saw the leader".format(len(waiting)))
+            waiting = [node for node in waiting if not node.node.follow(LEADER_ID)]
+            time.sleep(0.05)
+        leader.wait_for_devices(device_ids)
+        time.sleep(_WARMUP_HEARTBEATS * _HEARTBEAT_PERIOD)
+        for round_index in range(moves):
+            move_at = common_time() + lead
+            azimuth = round_index % 180
+            sequence = leader.move_many(
+                    [(device_id, azimuth, 45) for device_id in device_ids],
+                    move_at,
+            )
+            if sequence is not None:
+                scheduled_us[sequence] = int(move_at * 1000000)
+            time.sleep(interval)
+        # Status reports are not retransmitted, so with loss some never arrive
+        leader.wait_for_settle(list(scheduled_us), max_delay=lead + settle_time + 1)
+    finally:
+        leader.stop()
+        for node in nodes:
+            node.signal_stop()
+        for node in nodes:
+            node.stop()
+        leader_client.stop()
+        network.stop()
+        if not verbose:
+            sys.stdout.close()
+            sys.stdout = stdout
+    result.wall_time = time.monotonic() - started
+    result.moves = len(scheduled_us)
+    result.network_sent = network.sent
+    result.network_dropped = network.dropped
+    result.leader_cpu = heartbeat.cpu_time + tracker.cpu_time
+    status_table = leader.array_status()
+    for node in nodes:
+        stats = tracker.get_stats(node.board_id)
+        if stats is not None:
+            result.deliveries += stats.sent
+            result.acked += stats.acked
+            result.retransmitted += stats.retransmitted
+        status = status_table.get(node.board_id)
+        if status is not None:
+            result.settle_reports += status.settled
+        result.follower_cpu.append(node.cpu_time())
+    for sequence, move_at_us in scheduled_us.items():
+        applied = [node.node.applied_us[sequence] for node in nodes if sequence in node.node.applied_us]
+        result.applied += len(applied)
+        result.sync_errors_us.extend(applied_us - move_at_us for applied_us in applied)
+        if len(applied) > 1:
+            result.spreads_us.append(max(applied) - min(applied))
+    return result
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the multi client protocol with simulated followers")
+    parser.add_argument('--followers', type=int, default=50)
+    parser.add_argument('--moves', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=0.2, help="seconds between move rounds")
+    parser.add_argument('--lead', type=float, default=0.3, help="seconds between sending a move and its move time")
+    parser.add_argument('--loss', type=float, default=0., help="probability of dropping a datagram")
+    parser.add_argument('--latency', type=float, default=0.001, help="one way delay in seconds")
+    parser.add_argument('--jitter', type=float, default=0., help="extra random delay in seconds")
+    parser.add_argument('--settle-time', type=float, default=0., help="seconds the platforms take to converge")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--verbose', action='store_true', help="show the nodes' console output")
+    args = parser.parse_args()
+    result = run_simulation(
+            followers=args.followers,
+            moves=args.moves,
+            interval=args.interval,
+            lead=args.lead,
+            loss=args.loss,
+            latency=args.latency,
+            jitter=args.jitter,
+            settle_time=args.settle_time,
+            seed=args.seed,
+            verbose=args.verbose,
+    )
+    print(result.format())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""
+Lightweight instrumentation of named code sections. Every section counts its calls and their total
+and worst duration in ticks_us. The heap a section allocates can be measured as well, but
+gc.mem_alloc walks the whole heap on MicroPython, so allocation tracking is off unless asked for
+with enable(track_alloc=True) and only meant for short measurement runs. Sections are used as
+context managers or through the profile decorator:
+
+    _IMU_READ = section("imu_read")
+
+    with _IMU_READ:
+        azimuth = imu.get_azimuth()
+
+    @profile("gps_parse")
+    def update(self):
+        ...
+
+Sections are not reentrant, a section nested in itself or entered from two threads at once
+only records the innermost call.
+"""
+import gc
+
+try:
+    from utime import ticks_us, ticks_diff
+except ImportError:
+    import time
+
+    def ticks_us():
+        return time.monotonic_ns() // 1000
+
+    def ticks_diff(new, old):
+        return new - old
+
+try:
+    _mem_alloc = gc.mem_alloc
+except AttributeError:
+    # CPython has no allocation counter
+    def _mem_alloc():
+        return 0
+
+_enabled = True
+_track_alloc = False
+_sections = {}
+
+
+class Section:
+    """
+    Statistics of one named section
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._start_us = None
+        self._start_alloc = None
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.total_us = 0
+        self.max_us = 0
+        self.alloc_bytes = 0
+        self.max_alloc = 0
+
+    def __enter__(self):
+        if _enabled:
+            if _track_alloc:
+                self._start_alloc = _mem_alloc()
+            self._start_us = ticks_us()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        start_us = self._start_us
+        if start_us is None:
+            return False
+        elapsed = ticks_diff(ticks_us(), start_us)
+        self._start_us = None
+        self.calls += 1
+        self.total_us += elapsed
+        if elapsed > self.max_us:
+            self.max_us = elapsed
+        start_alloc = self._start_alloc
+        if start_alloc is not None:
+            # A collection during the section makes the delta negative, count it as no allocation
+            allocated = max(_mem_alloc() - start_alloc, 0)
+            self._start_alloc = None
+            self.alloc_bytes += allocated
+            if allocated > self.max_alloc:
+                self.max_alloc = allocated
+        return False
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "total_us": self.total_us,
+            "avg_us": self.total_us // self.calls if self.calls else 0,
+            "max_us": self.max_us,
+            "alloc_bytes": self.alloc_bytes,
+            "avg_alloc": self.alloc_bytes // self.calls if self.calls else 0,
+            "max_alloc": self.max_alloc,
+        }
+
+
+def section(name: str) -> Section:
+    """
+    Gets the section of a name, created on first use. Hot paths should keep the returned object
+    instead of looking it up on every call.
+    :param name:
+    :return:
+    """
+    instance = _sections.get(name)
+    if instance is None:
+        instance = Section(name)
+        _sections[name] = instance
+    return instance
+
+
+def profile(name: str = None):
+    """
+    Decorator recording every call of a function in a section
+    :param name: section name, the function name by default
+    """
+    def decorator(function):
+        instance = section(name or function.__name__)
+
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with instance:
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def enable(enabled: bool = True, track_alloc: bool = False):
+    """
+    Turns recording on or off, a disabled section costs a flag check
+    :param enabled:
+    :param track_alloc: also measure the heap allocated by each section, costs a heap walk on
+    every enter and exit
+    :return:
+    """
+    global _enabled, _track_alloc
+    _enabled = enabled
+    _track_alloc = enabled and track_alloc
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def is_tracking_alloc() -> bool:
+    return _track_alloc
+
+
+def reset():
+    for instance in _sections.values():
+        instance.reset()
+
+
+def report():
+    """
+    :return: section name to statistics dictionary, for the sections that were entered
+    """
+    result = {}
+    for name, instance in _sections.items():
+        if instance.calls:
+            result[name] = instance.as_dict()
+    return result
+
+
+def compact_report():
+    """
+    Short form of the report for telemetry
+    :return: section name to [calls, total_us, max_us, alloc_bytes]
+    """
+    result = {}
+    for name, instance in _sections.items():
+        if instance.calls:
+            result[name] = [instance.calls, instance.total_us, instance.max_us, instance.alloc_bytes]
+    return result
+
+
+def print_report():
+    print("{:<16} {:>8} {:>10} {:>8} {:>8} {:>10} {:>8}".format(
+        "section", "calls", "total_us", "avg_us", "max_us", "alloc_B", "avg_B"))
+    for name, stats in sorted(report().items()):
+        print("{:<16} {:>8} {:>10} {:>8} {:>8} {:>10} {:>8}".format(
+            name, stats["calls"], stats["total_us"], stats["avg_us"], stats["max_us"], stats["alloc_bytes"],
+            stats["avg_alloc"]))
+    if not _enabled:
+        print("Profiling is disabled")
+    elif not _track_alloc:
+        print("Allocation tracking is off")
@@ -0,0 +1,290 @@
+"""
+Runs the periodic jobs of the station (PID loop, IMU collection, GPS polling, screen refresh)
+from a single hardware timer instead of one timer each. The timer ticks at the greatest common
+divisor of the job periods; on every tick the due jobs run in priority order and the time each
+one takes is measured, so the CPU share of every job can be reported and budgeted.
+"""
+try:
+    import machine
+    from utime import ticks_ms, ticks_us, ticks_diff, ticks_add
+except ImportError:
+    import threading
+    import time
+
+    machine = None
+
+    def ticks_ms():
+        return int(time.monotonic() * 1000)
+
+    def ticks_us():
+        return time.monotonic_ns() // 1000
+
+    def ticks_diff(new, old):
+        return new - old
+
+    def ticks_add(ticks, delta):
+        return ticks + delta
+
+from config.config import shared_config
+
+# Higher priorities run first when several jobs are due on the same tick
+PRIORITY_SENSOR = 3
+PRIORITY_CONTROL = 2
+PRIORITY_BACKGROUND = 1
+PRIORITY_DISPLAY = 0
+PRIORITY_IDLE = -1
+
+_DEFAULT_TIMER_ID = 0
+
+
+def _gcd(a: int, b: int) -> int:
+    while b:
+        a, b = b, a % b
+    return a
+
+
+class PeriodicJob:
+    """
+    A job and its run statistics
+    """
+
+    def __init__(self, name: str, callback, period_ms: int, priority: int, after: str = None):
+        self.name = name
+        self.callback = callback
+        self.period_ms = period_ms
+        self.priority = priority
+        self.after = after
+        self.last_tick = -1
+        self.next_due = ticks_ms()
+        self.runs = 0
+        self.busy_us = 0
+        self.max_us = 0
+        self.missed = 0
+        self.errors = 0
+        self.last_error = None
+
+    def reset_stats(self):
+        self.runs = 0
+        self.busy_us = 0
+        self.max_us = 0
+        self.missed = 0
+        self.errors = 0
+        self.last_error = None
+        self.last_tick = -1
+
+
+class TimerScheduler:
+    """
+    Multiplexes periodic jobs onto one hardware timer, a thread on CPython. The timer only runs
+    while there are jobs.
+    """
+
+    def __init__(self, timer_id: int = _DEFAULT_TIMER_ID, tick_ms: int = None):
+        """
+        :param timer_id: hardware timer id
+        :param tick_ms: fixed tick, by default the greatest common divisor of the job periods
+        """
+        self.timer_id = timer_id
+        self.fixed_tick_ms = tick_ms
+        self.tick_ms = tick_ms or 0
+        self._timer = None
+        self._running = False
+        # Replaced rather than mutated, so jobs can add or remove jobs from their callback
+        self._jobs = ()
+        self._in_tick = False
+        self._stats_started = ticks_us()
+        self.ticks = 0
+        self.late_ticks = 0
+
+    def add(
+            self,
+            name: str,
+            callback,
+            period_ms: int,
+            priority: int = PRIORITY_BACKGROUND,
+            after: str = None,
+    ) -> PeriodicJob:
+        """
+        Adds or replaces a job
+        :param name: unique job name
+        :param callback: called without arguments
+        :param period_ms:
+        :param priority: PRIORITY_* or any int
+        :param after: once due, wait for a tick on which this job ran and run right after it, for work
+        that should land in the quiet part of another job's period. Needs a lower priority than that job.
+        :return: the job
+        """
+        if period_ms < 1:
+            raise ValueError("Job period must be at least 1 ms")
+        job = PeriodicJob(name, callback, int(period_ms), priority, after)
+        jobs = [existing for existing in self._jobs if existing.name != name]
+        jobs.append(job)
+        jobs.sort(key=lambda j: -j.priority)
+        self._jobs = tuple(jobs)
+        self._retune()
+        return job
+
+    def remove(self, name: str):
+        """
+        Removes a job, the timer is released when no job is left
+        :param name:
+        :return: True if the job existed
+        """
+        jobs = tuple(job for job in self._jobs if job.name != name)
+        removed = len(jobs) != len(self._jobs)
+        self._jobs = jobs
+        self._retune()
+        return removed
+
+    def get(self, name: str):
+        for job in self._jobs:
+            if job.name == name:
+                return job
+        return None
+
+    def _retune(self):
+        """
+        Restarts the timer at the tick the current jobs need, or stops it
+        """
+        if not self._jobs:
+            self._stop_timer()
+            return
+        tick_ms = self.fixed_tick_ms
+        if tick_ms is None:
+            tick_ms = 0
+            for job in self._jobs:
+                tick_ms = _gcd(tick_ms, job.period_ms)
+        if self._running and tick_ms == self.tick_ms:
+            return
+        self.tick_ms = tick_ms
+        self._stop_timer()
+        self._start_timer()
+
+    def _start_timer(self):
+        self._running = True
+        if machine is not None:
+            if self._timer is None:
+                self._timer = machine.Timer(self.timer_id)
+            self._timer.init(period=self.tick_ms, mode=machine.Timer.PERIODIC, callback=self._tick)
+            return
+        self._timer = threading.Thread(target=self._thread_loop, args=(self.tick_ms,))
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _stop_timer(self):
+        if not self._running:
+            return
+        self._running = False
+        if machine is not None:
+            self._timer.deinit()
+        # The CPython thread notices on its next tick that it was replaced or stopped
+
+    def _thread_loop(self, tick_ms: int):
+        me = threading.current_thread()
+        next_tick = time.monotonic()
+        while self._running and self._timer is me:
+            next_tick += tick_ms / 1000
+            self._tick(None)
+            time.sleep(max(next_tick - time.monotonic(), 0))
+
+    def _tick(self, timer):
+        """
+        Timer callback, runs the due jobs in priority order
+        """
+        if self._in_tick:
+            self.late_ticks += 1
+            return
+        self._in_tick = True
+        try:
+            self.ticks += 1
+            now = ticks_ms()
+            # Ticks jitter by a millisecond or two, a job due within half a tick runs on this one
+            slack_ms = self.tick_ms // 2
+            for job in self._jobs:
+                late_ms = ticks_diff(now, job.next_due)
+                if late_ms + slack_ms < 0:
+                    continue
+                if job.after is not None:
+                    leader = self.get(job.after)
+                    if leader is not None and leader.last_tick != self.ticks:
+                        # Stays due until a tick on which the job it follows runs
+                        continue
+                start = ticks_us()
+                try:
+                    job.callback()
+                except Exception as e:
+                    job.errors += 1
+                    job.last_error = e
+                elapsed = ticks_diff(ticks_us(), start)
+                job.runs += 1
+                job.last_tick = self.ticks
+                job.busy_us += elapsed
+                if elapsed > job.max_us:
+                    job.max_us = elapsed
+                if job.after is not None:
+                    # Waiting for the job it follows is not a miss
+                    job.next_due = ticks_add(now, job.period_ms)
+                elif late_ms - slack_ms >= job.period_ms:
+                    # Missed periods are dropped rather than run back to back
+                    job.missed += late_ms // job.period_ms
+                    job.next_due = ticks_add(now, job.period_ms)
+                else:
+                    job.next_due = ticks_add(job.next_due, job.period_ms)
+        finally:
+            self._in_tick = False
+
+    def reset_stats(self):
+        self._stats_started = ticks_us()
+        self.ticks = 0
+        self.late_ticks = 0
+        for job in self._jobs:
+            job.reset_stats()
+
+    def report(self):
+        """
+        Run statistics of every job since the last reset
+        :return: job name to dictionary with the period, priority, runs, cpu_percent, avg_us, max_us, missed and errors
+        """
+        elapsed_us = max(ticks_diff(ticks_us(), self._stats_started), 1)
+        report = {}
+        for job in self._jobs:
+            report[job.name] = {
+                "period_ms": job.period_ms,
+                "priority": job.priority,
+                "runs": job.runs,
+                "cpu_percent": 100 * job.busy_us / elapsed_us,
+                "avg_us": job.busy_us // job.runs if job.runs else 0,
+                "max_us": job.max_us,
+                "missed": job.missed,
+                "errors": job.errors,
+            }
+        return report
+
+    def print_report(self):
+        report = self.report()
+        print("Timer {} ticking every {} ms, {} late tick(s)".format(self.timer_id, self.tick_ms, self.late_ticks))
+        print("{:<12} {:>6} {:>4} {:>8} {:>6} {:>8} {:>8} {:>6} {:>6}".format(
+            "job", "period", "prio", "runs", "cpu%", "avg_us", "max_us", "missed", "errors"))
+        total = 0
+        for name, job in report.items():
+            total += job["cpu_percent"]
+            print("{:<12} {:>6} {:>4} {:>8} {:>6.1f} {:>8} {:>8} {:>6} {:>6}".format(
+                name, job["period_ms"], job["priority"], job["runs"], job["cpu_percent"], job["avg_us"],
+                job["max_us"], job["missed"], job["errors"]))
+        print("Total CPU: {:.1f}%".format(total))
+
+
+_shared_scheduler = None
+
+
+def shared_scheduler() -> TimerScheduler:
+    """
+    Gets the station's scheduler, on the timer given by scheduler_timer_id in the antenny config
+    :return:
+    """
+    global _shared_scheduler
+    if _shared_scheduler is None:
+        config = shared_config("antenny")
+        timer_id = config.get("scheduler_timer_id") if config.has("scheduler_timer_id") else _DEFAULT_TIMER_ID
+        _shared_scheduler = TimerScheduler(timer_id)
+    return _shared_scheduler
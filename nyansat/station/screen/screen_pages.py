@@ -0,0 +1,307 @@
+try:
+    from utime import ticks_ms, ticks_diff
+except ImportError:
+    import time
+
+    def ticks_ms():
+        return int(time.monotonic() * 1000)
+
+    def ticks_diff(new, old):
+        return new - old
+
+try:
+    import network
+except ImportError:
+    network = None
+
+from gps.nmea import new_fix, FIX_VALID, FIX_LATITUDE, FIX_LONGITUDE, FIX_ALTITUDE, FIX_SATELLITES
+
+LINE_WIDTH = 16
+NUM_LINES = 4
+
+_SPACE = 0x20
+_MINUS = 0x2D
+_DOT = 0x2E
+_OVERFLOW = 0x23
+_ZERO = 0x30
+# The IMU is shown as down once the PID loop has not read it for this long
+_IMU_STALE_MS = 1000
+
+
+class FixedWidthLine(object):
+    """
+    A preallocated line of display characters. Numbers are written digit by
+    digit so that rendering a page never builds a string.
+    """
+
+    def __init__(self, width: int = LINE_WIDTH):
+        self.buffer = bytearray(width)
+        self.clear()
+
+    def clear(self):
+        buffer = self.buffer
+        for i in range(len(buffer)):
+            buffer[i] = _SPACE
+
+    def put_text(self, position: int, text: bytes):
+        """
+        Copies constant text into the line
+        :param position:
+        :param text:
+        :return:
+        """
+        buffer = self.buffer
+        for i in range(len(text)):
+            if position + i >= len(buffer):
+                return
+            buffer[position + i] = text[i]
+
+    def put_number(self, position: int, width: int, value, decimals: int = 0):
+        """
+        Writes a right aligned fixed point number, or dashes if the value is unknown
+        :param position:
+        :param width:
+        :param value: integer scaled by 10 ** decimals, or None
+        :param decimals: number of digits after the decimal point
+        :return:
+        """
+        buffer = self.buffer
+        end = position + width - 1
+        if value is None:
+            for i in range(position, end):
+                buffer[i] = _SPACE
+            buffer[end] = _MINUS
+            return
+        negative = value < 0
+        if negative:
+            value = -value
+        i = end
+        for _ in range(decimals):
+            if i < position:
+                return self._overflow(position, end)
+            buffer[i] = _ZERO + value % 10
+            value //= 10
+            i -= 1
+        if decimals:
+            if i < position:
+                return self._overflow(position, end)
+            buffer[i] = _DOT
+            i -= 1
+        while True:
+            if i < position:
+                return self._overflow(position, end)
+            buffer[i] = _ZERO + value % 10
+            value //= 10
+            i -= 1
+            if not value:
+                break
+        if negative:
+            if i < position:
+                return self._overflow(position, end)
+            buffer[i] = _MINUS
+            i -= 1
+        while i >= position:
+            buffer[i] = _SPACE
+            i -= 1
+
+    def _overflow(self, position: int, end: int):
+        for i in range(position, end + 1):
+            self.buffer[i] = _OVERFLOW
+
+
+def _tenths(value):
+    """
+    Scales a measurement to an integer number of tenths
+    :param value:
+    :return:
+    """
+    if value is None:
+        return None
+    return int(value * 10)
+
+
+class ScreenPage(object):
+    """
+    A page of the screen dashboard, re-rendered every period milliseconds.
+    """
+
+    def __init__(self, period: int):
+        self.period = period
+        self.lines = [FixedWidthLine() for _ in range(NUM_LINES)]
+
+    def render(self):
+        """
+        Updates self.lines from the latest station state
+        :return:
+        """
+        raise NotImplementedError()
+
+
+class PointingPage(ScreenPage):
+    """
+    Current azimuth/elevation, PID setpoint error and component health
+    """
+
+    def __init__(self, api, period: int = 200):
+        super(PointingPage, self).__init__(period)
+        self.api = api
+        self._sta = network.WLAN(network.STA_IF) if network is not None else None
+        self.lines[0].put_text(0, b"AZ")
+        self.lines[1].put_text(0, b"EL")
+        self.lines[2].put_text(0, b"SP")
+        self.lines[3].put_text(0, b"IMU  GPS  NET")
+
+    def render(self):
+        platform = self.api.platform
+        azimuth = getattr(platform, "last_azimuth", None)
+        elevation = getattr(platform, "last_elevation", None)
+        azimuth_setpoint = getattr(platform, "new_azimuth", None)
+        elevation_setpoint = getattr(platform, "new_elevation", None)
+        self._render_axis(self.lines[0], azimuth, azimuth_setpoint)
+        self._render_axis(self.lines[1], elevation, elevation_setpoint)
+        self.lines[2].put_number(3, 6, _tenths(azimuth_setpoint), 1)
+        self.lines[2].put_number(10, 6, _tenths(elevation_setpoint), 1)
+        status = self.lines[3].buffer
+        # The PID loop's cached reading, reading the IMU here would contend with it for the bus
+        reading_ms = getattr(platform, "last_reading_ms", None)
+        status[3] = _flag(
+            azimuth is not None and reading_ms is not None and ticks_diff(ticks_ms(), reading_ms) < _IMU_STALE_MS)
+        status[8] = _flag(_gps_valid(self.api.gps))
+        status[13] = _flag(self._sta is not None and self._sta.isconnected())
+
+    @staticmethod
+    def _render_axis(line: FixedWidthLine, reading, setpoint):
+        line.put_number(3, 6, _tenths(reading), 1)
+        if reading is None or setpoint is None:
+            line.put_number(10, 6, None)
+        else:
+            line.put_number(10, 6, _tenths(setpoint - reading), 1)
+
+
+class GPSPage(ScreenPage):
+    """
+    Latest GPS fix
+    """
+
+    def __init__(self, api, period: int = 1000):
+        super(GPSPage, self).__init__(period)
+        self.api = api
+        self._fix = new_fix()
+        self.lines[0].put_text(0, b"FIX   SAT")
+        self.lines[1].put_text(0, b"LAT")
+        self.lines[2].put_text(0, b"LON")
+        self.lines[3].put_text(0, b"ALT")
+
+    def render(self):
+        get_parser = getattr(self.api.gps, "get_parser", None)
+        if get_parser is None:
+            for line in self.lines[1:]:
+                line.put_number(4, 12, None)
+            self.lines[0].buffer[4] = _flag(False)
+            self.lines[0].put_number(10, 2, None)
+            return
+        fix = self._fix
+        get_parser().read_fix(fix)
+        self.lines[0].buffer[4] = _flag(fix[FIX_VALID])
+        self.lines[0].put_number(10, 2, fix[FIX_SATELLITES])
+        self.lines[1].put_number(4, 12, fix[FIX_LATITUDE], 6)
+        self.lines[2].put_number(4, 12, fix[FIX_LONGITUDE], 6)
+        self.lines[3].put_number(4, 10, fix[FIX_ALTITUDE], 2)
+        self.lines[3].put_text(14, b"m")
+
+
+class NetworkPage(ScreenPage):
+    """
+    Wi-Fi mode, signal strength and address
+    """
+
+    def __init__(self, period: int = 2000):
+        super(NetworkPage, self).__init__(period)
+        self._sta = network.WLAN(network.STA_IF) if network is not None else None
+        self._ap = network.WLAN(network.AP_IF) if network is not None else None
+        self._address = None
+        self.lines[0].put_text(0, b"WIFI")
+        self.lines[1].put_text(0, b"RSSI")
+
+    def render(self):
+        mode = b"OFF "
+        rssi = None
+        interface = None
+        if self._sta is not None and self._sta.isconnected():
+            mode = b"STA "
+            interface = self._sta
+            try:
+                rssi = self._sta.status("rssi")
+            except (OSError, ValueError):
+                rssi = None
+        elif self._ap is not None and self._ap.active():
+            mode = b"AP  "
+            interface = self._ap
+        self.lines[0].put_text(5, mode)
+        self.lines[1].put_number(5, 4, rssi)
+        address = interface.ifconfig()[0] if interface is not None else None
+        if address != self._address:
+            # Only happens when the address changes
+            self._address = address
+            self.lines[2].clear()
+            if address is not None:
+                self.lines[2].put_text(0, address.encode())
+
+
+class ScreenDashboard(object):
+    """
+    Cycles through screen pages, rendering the visible one at its own rate
+    """
+
+    def __init__(self, screen, pages, page_duration: int = 5000):
+        self.screen = screen
+        self.pages = pages
+        self.page_duration = page_duration
+        self.rotate = True
+        self._page_index = 0
+        self._page_shown_at = ticks_ms()
+        self._rendered_at = None
+
+    def show_page(self, index: int, rotate: bool = False):
+        """
+        Switches to a page
+        :param index:
+        :param rotate: keep cycling through pages afterwards
+        :return:
+        """
+        self._page_index = index % len(self.pages)
+        self._page_shown_at = ticks_ms()
+        self._rendered_at = None
+        self.rotate = rotate
+
+    def tick(self):
+        """
+        Renders the visible page if it is due, called from the screen refresh timer
+        :return:
+        """
+        now = ticks_ms()
+        if self.rotate and len(self.pages) > 1 and ticks_diff(now, self._page_shown_at) >= self.page_duration:
+            self._page_index = (self._page_index + 1) % len(self.pages)
+            self._page_shown_at = now
+            self._rendered_at = None
+        page = self.pages[self._page_index]
+        if self._rendered_at is not None and ticks_diff(now, self._rendered_at) < page.period:
+            return
+        self._rendered_at = now
+        page.render()
+        for line_num in range(len(page.lines)):
+            self.screen.update_line_bytes(page.lines[line_num].buffer, line_num)
+
+
+def _flag(value):
+    return 0x2B if value else _MINUS
+
+
+def _gps_valid(gps):
+    get_parser = getattr(gps, "get_parser", None)
+    if get_parser is None:
+        return False
+    return get_parser().read_fix(_GPS_FLAG_FIX) > 0 and _GPS_FLAG_FIX[FIX_VALID] == 1
+
+
+_GPS_FLAG_FIX = new_fix()
@@ -2,10 +2,12 @@ import socket
 import struct
 
 from antenny_threading import Thread
+from clock.clock import now_us
 from imu.mock_imu import MockImuController
 from gps.gps import GPSController
 from imu.imu import ImuController
 from gps.mock_gps_controller import MockGPSController
+from profiler import profiler
 
 try:
     import utime as time
@@ -26,6 +28,10 @@ MCAST_PORT = 31337
 IS_ALL_GROUPS = False
 INADDR_ANY = 0
 MAX_MESSAGE_SIZE = 1024
+# Profiling statistics are added to every this many telemetry messages
+PROFILE_EVERY = 25
+
+_TELEMETRY_SEND = profiler.section("telemetry_send")
 
 DEFAULT_POLL_DELAY = 0.001
 
@@ -42,38 +48,47 @@ class AbstractTelemetrySender(Thread, TelemetrySender):
         self._gps_controller = gps_controller
         self._imu_controller = imu_controller
         self._interval = interval
+        self._messages = 0
+        # Reused for every message, fields that are unavailable are sent as null
+        self._telemetry = {
+            "time": 0,
+            "azimuth": None,
+            "elevation": None,
+            "gps_valid": None,
+            "coordinates_lng": None,
+            "coordinates_lat": None,
+            "altitude": None,
+            "speed": None,
+        }
 
     def run(self):
         while self.running:
-            telemetry = self._fetch_telemetry_data()
-            self._send_message(telemetry)
+            with _TELEMETRY_SEND:
+                telemetry = self._fetch_telemetry_data()
+                self._messages += 1
+                if self._messages % PROFILE_EVERY == 0 and profiler.is_enabled():
+                    telemetry = dict(telemetry)
+                    telemetry["profile"] = profiler.compact_report()
+                self._send_message(telemetry)
             time.sleep(self._interval)
 
     def _fetch_telemetry_data(self):
         """
-        Format & enqueu teleme
+        Fills the telemetry message
         """
-        if hasattr(time, 'tick_ms'):
-            data = {"time": time.ticks_ms()}
-        else:
-            data = {"time": time.time()}
-        imu_position = self._imu_controller.euler()
-        if imu_position is not None:
-            # TODO: these values need to be chosen based on a configuration index
-            data.update({
-                "azimuth": imu_position[1],
-                "elevation": imu_position[0],
-                # "z": imu_position[2],
-            })
+        data = self._telemetry
+        data["time"] = now_us()
+        imu_position = self._imu_controller.get_euler()
+        # TODO: these values need to be chosen based on a configuration index
+        data["azimuth"] = imu_position[1] if imu_position is not None else None
+        data["elevation"] = imu_position[0] if imu_position is not None else None
         gps_status = self._gps_controller.get_status()
         if gps_status is not None:
-            data.update({
-                "gps_valid": gps_status.valid,
-                "coordinates_lng": gps_status.longitude,
-                "coordinates_lat": gps_status.latitude,
-                "altitude": gps_status.altitude,
-                "speed": gps_status.set_speed,
-            })
+            data["gps_valid"] = gps_status.valid
+            data["coordinates_lng"] = gps_status.longitude
+            data["coordinates_lat"] = gps_status.latitude
+            data["altitude"] = gps_status.altitude
+            data["speed"] = gps_status.speed
         return data
 
     def _send_message(self, message: dict):